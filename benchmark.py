@@ -0,0 +1,220 @@
+import argparse
+import copy
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import support_stats
+from tools import config
+from tools.lib import fakeAPI, googleAPI, mail, stats, util
+
+# Week counted by the benchmark. Mailboxes are generated around it so results do not depend on the current date.
+START = datetime(2018, 1, 4)
+END = START + timedelta(days=7)
+
+
+def peak_memory():
+    """
+    :return: float peak resident set size of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)  # Reported in bytes
+    return peak / 1024.0  # Reported in KB
+
+
+def deep_size(obj, seen=None):
+    """
+    Approximates the memory retained by an object including everything it references. Objects shared with other
+    parts of the program (i.e. interned strings) are counted once.
+    :param obj: object to measure
+    :param seen: ids of objects already counted (default = None)
+    :return: int size in bytes
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif not isinstance(obj, (basestring, int, long, float, bool, type(None))):
+        if hasattr(obj, '__dict__'):
+            size += deep_size(obj.__dict__, seen)
+        for cls in type(obj).__mro__:
+            for slot in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, slot):
+                    size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def timed(results, name, function, *args):
+    """
+    Runs function and records how long it took and the process's peak memory once it finished.
+    :param results: list the (name, seconds, peak memory) is appended to
+    :param name: stage name
+    :param function: stage being timed
+    :param args: arguments passed to function
+    :return: the result of function
+    """
+    start = time.time()
+    result = function(*args)
+    results.append((name, time.time() - start, peak_memory()))
+    return result
+
+
+def _engine_counts(engine, threads, member_data, stat_labels):
+    """
+    Counts stats for threads with the given engine without changing member_data.
+    :return: (dictionary of every stat count by (dictionary name, stat), member stats by name, open inquiry ids)
+    """
+    config.ENGINE = engine
+    counter = stats.StatCounter(stat_labels)
+    members = copy.deepcopy(member_data)
+    open_inquiries = counter.count_stats(threads, members, '')
+    counts = {}
+    for name in ['stat_labels', 'ping_stats', 'total_stats', 'vm_stats']:
+        for stat, value in getattr(counter, name).iteritems():
+            counts[(name, stat)] = value.get_count()
+    return counts, dict((name, mem.get_stats()) for name, mem in members.iteritems()), sorted(open_inquiries)
+
+
+def verify_engines(threads, member_data, stat_labels):
+    """
+    Counts stats for threads with the loop and columnar engines and compares the results.
+    :return: list of str describing each difference. Empty if the engines agree.
+    """
+    engine = config.ENGINE
+    try:
+        loop = _engine_counts('loop', threads, member_data, stat_labels)
+        columnar = _engine_counts('columnar', threads, member_data, stat_labels)
+    finally:
+        config.ENGINE = engine
+
+    differences = []
+    for key in sorted(set(loop[0]) | set(columnar[0])):
+        if loop[0].get(key) != columnar[0].get(key):
+            differences.append("%s %s: loop %s, columnar %s" % (key[0], key[1], loop[0].get(key),
+                                                                columnar[0].get(key)))
+    for name in sorted(loop[1]):
+        if loop[1][name] != columnar[1][name]:
+            differences.append("member %s: loop %s, columnar %s" % (name, loop[1][name], columnar[1][name]))
+    if loop[2] != columnar[2]:
+        differences.append("open inquiries: loop %d, columnar %d" % (len(loop[2]), len(columnar[2])))
+    return differences
+
+
+def run(message_count, member_count, workers, seed, error_rate, measure_threads=False, verify=False):
+    """
+    Builds a synthetic mailbox and times each stage of the stats pipeline against it.
+    :param message_count: approximate number of messages in the mailbox
+    :param member_count: number of members on the Member Stats tab
+    :param workers: number of threads fetched concurrently
+    :param seed: random seed used to generate the mailbox
+    :param error_rate: share of requests which fail with a retryable error
+    :param measure_threads: True if the memory retained by the threads built by read_stats should be measured
+                            (default = False)
+    :param verify: True if the stats counted by the loop and columnar engines should be compared (default = False)
+    :return: (list of (stage, seconds, peak memory MB), number of messages, number of threads, bytes retained by the
+             threads or None if they were not measured, list of engine differences or None if not verified)
+    """
+    members = fakeAPI.member_names(member_count)
+    mailbox = fakeAPI.build_mailbox(message_count, START, END, members, seed)
+    mail_api = fakeAPI.FakeMailService(mailbox, error_rate=error_rate, seed=seed)
+    sheets_api = fakeAPI.build_sheets(members, seed=seed)
+
+    config.COUNT_ALL = True  # Never prompt
+    config.WORKERS = workers
+    config.QUERY = "after:" + START.strftime('%Y/%m/%d') + " before:" + END.strftime('%Y/%m/%d') + " " + config.QUERY
+    support_stats.START_DATE = util.parse_date(START.strftime('%m/%d/%Y'))
+    support_stats.END_DATE = util.parse_date(END.strftime('%m/%d/%Y'))
+    cutoff = support_stats.START_DATE
+
+    results = [('generate', 0.0, peak_memory())]
+    member_data, stat_labels = timed(results, 'read_members', support_stats.read_members, config.MEMBER_STATS_SHEET,
+                                     config.RETENTION_SPREADSHEET_ID, sheets_api, 3, config.SHORT_NAME_RANGE)
+    admins, admin_emails = timed(results, 'read_admins', support_stats.read_admins, config.ADMIN_SHEET,
+                                 config.RETENTION_SPREADSHEET_ID, sheets_api)
+    counter = stats.StatCounter(stat_labels)
+    classifier = mail.LabelClassifier(counter.stat_labels, member_data.keys())
+    threads = timed(results, 'read_stats', support_stats.read_stats, classifier, '', mail_api, cutoff,
+                    mail_api.clone, None, admins, admin_emails)
+    retained = None
+    if measure_threads:
+        retained = deep_size(threads)
+    timed(results, 'evaluate_threads', support_stats.evaluate_threads, threads, member_data)
+    differences = None
+    if verify:
+        differences = verify_engines(threads, member_data, stat_labels)
+    timed(results, 'count_stats', counter.count_stats, threads, member_data, '')
+    timed(results, 'format_stats', counter.format_stats)
+
+    read = sum(len(mailbox.threads[thread_id]) for thread_id in threads)
+    return results, read, len(threads), retained, differences
+
+
+def print_results(results, message_count, thread_count):
+    print "\n%-18s %10s %14s %14s %12s" % ("Stage", "Seconds", "Messages/s", "Threads/s", "Peak MB")
+    total = 0.0
+    for name, seconds, peak in results:
+        total += seconds
+        if seconds > 0:
+            print "%-18s %10.3f %14.0f %14.0f %12.1f" % (name, seconds, message_count / seconds,
+                                                          thread_count / seconds, peak)
+        else:
+            print "%-18s %10s %14s %14s %12.1f" % (name, "", "", "", peak)
+    print "%-18s %10.3f %14.0f %14.0f %12.1f" % ("total", total, message_count / total, thread_count / total,
+                                                  results[-1][2])
+
+
+def args_parser():
+    arg_parser = argparse.ArgumentParser(description='Benchmark stats against a synthetic mailbox')
+    arg_parser.add_argument("-m", "--messages", type=int, default=10000, help="number of messages in the mailbox")
+    arg_parser.add_argument("--members", type=int, default=200, help="number of members")
+    arg_parser.add_argument("-w", "--workers", type=int, default=1,
+                            help="number of threads fetched concurrently")
+    arg_parser.add_argument("--seed", type=int, default=0, help="random seed used to generate the mailbox")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="share of requests which fail with a retryable error")
+    arg_parser.add_argument("--memory", action="store_true",
+                            help="measure the memory retained by the threads built by read_stats")
+    arg_parser.add_argument("--engine", choices=['loop', 'columnar'], default='loop',
+                            help="engine used to count stats")
+    arg_parser.add_argument("--verify", action="store_true",
+                            help="check that the loop and columnar engines count the same stats")
+    return arg_parser
+
+
+def main():
+    args = args_parser().parse_args()
+    config.ENGINE = args.engine
+    # Label maps of the synthetic mailbox must never replace the cached maps of the real accounts.
+    cache_dir = tempfile.mkdtemp()
+    googleAPI.LABEL_CACHE_FILE = cache_dir + '/{account}_labels.pickle'
+    try:
+        print "Benchmarking " + str(args.messages) + " messages with " + str(args.workers) + " workers..."
+        results, message_count, thread_count, retained, differences = run(
+            args.messages, args.members, args.workers, args.seed, args.error_rate, args.memory, args.verify)
+    finally:
+        shutil.rmtree(cache_dir)
+    print_results(results, message_count, thread_count)
+    if retained is not None:
+        print "\nThreads retain %.1f MB (%.0f bytes per thread, %.0f bytes per message)" % (
+            retained / (1024.0 * 1024.0), float(retained) / thread_count, float(retained) / message_count)
+    googleAPI.print_request_summary()
+    if differences is not None:
+        if differences:
+            util.print_error("Engines differ:\n" + "\n".join(differences))
+            sys.exit(1)
+        print "Loop and columnar engines agree"
+
+
+if __name__ == '__main__':
+    main()
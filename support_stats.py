@@ -1,9 +1,32 @@
+import copy
 import csv
+import datetime
+import json
+import multiprocessing
+import os
+import pickle
+import socket
+import sys
+import threading
+import time
+import traceback
 from tools import config
-from tools.lib import mail, members, stats, util, googleAPI
+from tools.lib import archive, mail, members, stats, util, googleAPI, store, sync
 from googleapiclient.errors import HttpError
+from ssl import SSLError
 
 MAIL_API, SHEETS_API, SUPPORT_MAIL_API, GOV_SUPPORT_MAIL_API = None, None, None, None
+GOV_SHEETS_API = None  # Separate Sheets service for the gov pipeline when pipelines run in parallel.
+SUPPORT_MAIL_FACTORY, GOV_SUPPORT_MAIL_FACTORY = None, None
+START_DATE, END_DATE = None, None  # Set by init_param. END_DATE is exclusive.
+BASE_QUERY = None  # config.QUERY before the run dates were added to it
+WATCH_ERRORS = (HttpError, SSLError, socket.error)  # Errors retried while stats are watched
+
+# Exit codes reported by main
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_NEEDS_INPUT = 2  # Stats stopped for input which could not be asked for. i.e. threads deferred to a file
+EXIT_WARNINGS = 3  # Stats finished but errors were printed. Some results may need to be entered manually.
 
 
 def read_members(mem_stats_sheet, retention_sheet_id, sheets_api, stat_header_index, short_name_range):
@@ -38,19 +61,102 @@ def read_admins(admin_sheet, retention_sheet_id, sheets_api):
     return admins, admin_emails
 
 
-def update_admin_dates(threads, admins, admin_emails):
-    for thread in threads:
-        for msg in threads[thread].messages:
-            if msg.get_from_address() in admin_emails:
-                admin = admins[admin_emails[msg.get_from_address()]]
-                admin.update_last_contact(msg.get_date())
-                if "check-in call" in msg.get_labels():
-                    admin.update_check_in(msg.get_date())
+def update_admin_dates(msg, admins, admin_emails):
+    """
+    Updates the last contact and check in dates of the admin who sent msg, if any.
+    :param msg: mail.Message
+    :param admins: admin dictionary with (k,v) = (id, Admin() object)
+    :param admin_emails: admin id of each admin email
+    :return: None
+    """
+    admin_id = admin_emails.get(msg.get_from_address())
+    if admin_id is not None:
+        admin = admins[admin_id]
+        admin.update_last_contact(msg.get_date())
+        if msg.is_check_in():
+            admin.update_check_in(msg.get_date())
+
+
+def add_message(threads, msg, classifier, cutoff, admins=None, admin_emails=None, decisions=None):
+    """
+    Adds msg to the thread it belongs to, creating the thread if needed. Spam and ideas are skipped.
+    :param threads: thread dictionary with (k,v) = (thread id, mail.Thread)
+    :param msg: mail.Message
+    :param classifier: mail.LabelClassifier used to evaluate msg
+    :param cutoff: threads started before cutoff do not count
+    :param admins: admin dictionary with (k,v) = (id, Admin() object) or None if admins are not tracked
+    :param admin_emails: admin id of each admin email or None if admins are not tracked
+    :param decisions: mail.Decisions consulted before the user is asked if a thread should count. (default = None)
+    :return: False if msg was skipped
+    """
+    if msg.is_spam() or msg.is_idea():
+        # Spam and ideas should never count
+        return False
+
+    if admin_emails is not None:
+        update_admin_dates(msg, admins, admin_emails)
+
+    thread_id = msg.get_thread_id()
+    if thread_id not in threads:
+        threads[thread_id] = mail.Thread(msg, classifier, cutoff, decisions)
+    else:
+        threads[thread_id].add_message(msg, classifier, cutoff, decisions)
+    return True
+
+
+def _pending_file(file_base):
+    return 'tools/' + file_base + 'pending.txt'
+
+
+def read_decisions(file_base):
+    # Read in answers given to "Should the following message be counted?" in earlier runs
+    filename = 'tools/' + file_base + 'decisions.txt'
+    pending_file = _pending_file(file_base)
+    try:
+        decisions = mail.Decisions.from_file(filename, defer=config.DEFER is not None)
+        answered = decisions.read_pending(pending_file)
+    except IOError, e:
+        util.print_error("Error: " + filename + " or " + pending_file + " is not formatted properly. "
+                         "Please correct or delete the file. Then re-run stats.")
+        raise e
+    if answered > 0:
+        print str(answered) + " answers read from " + pending_file
+        decisions.write_to_file()
+        os.remove(pending_file)
+    return decisions
 
 
-def read_inbox(stat_counter, file_base, support_mail_api):
+def review_decisions(threads, decisions, file_base):
+    """
+    Asks the user about the threads decisions deferred while threads were read. With config.DEFER = 'file' the threads
+    are written to the pending file instead and stats stop so they can be answered before stats are re-run.
+    :param threads: thread dictionary returned by read_stats
+    :param decisions: mail.Decisions used to read threads
+    :param file_base: preface of the pending file
+    :return: None
+    :raise util.PromptError: if threads were written to the pending file
+    """
+    if len(decisions.pending) == 0:
+        return
+    if config.DEFER == 'file':
+        pending_file = _pending_file(file_base)
+        decisions.write_pending(pending_file)
+        raise util.PromptError(str(len(decisions.pending)) + " threads need to be reviewed. Answer them in " +
+                               pending_file + " then re-run stats.")
+    try:
+        decisions.review(threads)
+    finally:
+        decisions.write_to_file()
+
+
+def read_inbox(classifier, file_base, support_mail_api, message_store=None, decisions=None):
     print "\nReading Support Inbox..."
-    inbox_threads = googleAPI.get_thread_ids(support_mail_api, "me", "label:Inbox")
+    if message_store is None:
+        inbox_threads = googleAPI.get_thread_ids(support_mail_api, "me", "label:Inbox")
+    else:
+        if not sync.sync(support_mail_api, message_store, file_base):
+            print "Full sync performed"
+        inbox_threads = message_store.thread_ids(file_base + 'support', 'INBOX')
     print "...done"
 
     try:
@@ -64,66 +170,89 @@ def read_inbox(stat_counter, file_base, support_mail_api):
               'the file.'
         print 'Alternatively, you may locate/restore the prior version of open.txt to the tools folder and ' \
               're-run the script. This is recommended.'
-        raw_input("Press enter to rebuild the file OR exit the script to locate and restore the file.")
-        temp = START_DATE
-        config.START_DATE = util.parse_date("January 1, 2000")
-        inbox = googleAPI.get_messages_from_threads(support_mail_api, "me", "label:Inbox")
-        open_inquiries = mail.OpenInquiry.from_current_inbox(inbox, stat_counter.stat_labels)
-        config.START_DATE = temp
+        with util.PROMPT_LOCK:
+            util.prompt("Press enter to rebuild the file OR exit the script to locate and restore the file.")
+        inbox = googleAPI.get_messages_from_threads(support_mail_api, "me", "label:Inbox",
+                                                    account=file_base + 'support')
+        # Every thread in the inbox is considered regardless of when it started.
+        try:
+            open_inquiries = mail.OpenInquiry.from_current_inbox(inbox, classifier,
+                                                                 util.parse_date("January 1, 2000"), decisions)
+        finally:
+            if decisions is not None:
+                decisions.write_to_file()
         print 'Done reading inbox for open inquiries.'
 
     return inbox_threads, open_inquiries
 
 
-def read_stats(stat_counter, file_base, support_mail_api, cutoff, member_labels):
+def read_stats(classifier, file_base, support_mail_api, cutoff, support_mail_factory=None,
+               message_store=None, admins=None, admin_emails=None, decisions=None):
+    """
+    Builds the threads matching config.QUERY. Admin dates are updated as each message is read so that threads only
+    need to keep their totals.
+    :param admins: admin dictionary with (k,v) = (id, Admin() object) or None if admins are not tracked
+    :param admin_emails: admin id of each admin email or None if admins are not tracked
+    :param decisions: mail.Decisions consulted before the user is asked if a thread should count. Answers given are
+                      written to its file once every thread is built. (default = None)
+    :return: thread dictionary with (k,v) = (thread id, mail.Thread)
+    """
     threads = {}
 
     # Obtain mail from Support Inbox and begin thread counting
     i = 0
+    log_base = file_base
     if config.TEST:
-        file_base = "test_"+file_base
+        log_base = "test_"+file_base
     mail_out, fmail_out, mail_writer, fmail_writer = None, None, None, None
     if config.DEBUG:
         #  Open log files
-        mail_out = open('tools/logs/' + file_base + 'mail.csv', 'wb')
-        fmail_out = open('tools/logs/' + file_base + 'formatted_mail.csv', 'wb')
+        mail_out = open('tools/logs/' + log_base + 'mail.csv', 'wb')
+        fmail_out = open('tools/logs/' + log_base + 'formatted_mail.csv', 'wb')
         mail_writer = csv.writer(mail_out)
         mail_writer.writerow(['Thread ID', 'Date', 'From', 'To', 'Subject', 'X-Gmail-Labels'])
         fmail_writer = csv.writer(fmail_out)
         fmail_writer.writerow(['Thread ID', 'Date', 'From', 'To', 'Subject', 'Labels'])
 
-    print "Reading stats label...."
-    gmail_messages = googleAPI.get_messages_from_threads(support_mail_api, 'me', config.QUERY)
-    print "...done"
-
-    print "Building thread data..."
-    for message in gmail_messages:
-        msg = mail.Message(message)
-        msg_id = msg.get_thread_id()
+    # Messages are generated as their threads are fetched so threads are built while later threads download.
+    if message_store is None:
+        gmail_messages = googleAPI.iter_messages_from_threads(support_mail_api, 'me', config.QUERY, config.WORKERS,
+                                                              support_mail_factory, file_base + 'support')
+    else:
+        gmail_messages = sync.iter_messages_from_threads(support_mail_api, message_store, file_base, config.QUERY,
+                                                         'me', config.WORKERS, support_mail_factory)
 
-        if config.DEBUG:
-            mail_writer.writerow([msg_id, message['Date'], message['From'], message['To'],
-                                  message['Subject'], message['X-Gmail-Labels']])
+    print "Reading stats label and building thread data..."
+    date_fallbacks = util.get_date_fallbacks()
+    # Answers given before a failure or exit are kept for the next run.
+    try:
+        for message in gmail_messages:
+            msg = mail.Message(message)
+            msg_id = msg.get_thread_id()
 
-            fmail_writer.writerow([msg_id, msg.get_date(), msg.get_from_address(), msg.get_to(),
-                                   msg.get_subject(), msg.get_labels()])
+            if config.DEBUG:
+                mail_writer.writerow([msg_id, message['Date'], message['From'], message['To'],
+                                      message['Subject'], message['X-Gmail-Labels']])
 
-        if msg.is_spam() or msg.is_idea():
-            # Spam and ideas should never count
-            continue
+                fmail_writer.writerow([msg_id, msg.get_date(), msg.get_from_address(), msg.get_to(),
+                                       msg.get_subject(), msg.get_labels()])
 
-        if msg_id not in threads:
-            threads[msg_id] = mail.Thread(msg, stat_counter.stat_labels, cutoff, member_labels)
-        else:
-            threads[msg_id].add_message(msg, stat_counter.stat_labels, cutoff, member_labels)
+            if not add_message(threads, msg, classifier, cutoff, admins, admin_emails, decisions):
+                continue
 
-        if not config.COUNT_EVERY == 0 and i % config.COUNT_EVERY == 0:
-            print i, msg
-        i += 1
+            if not config.COUNT_EVERY == 0 and i % config.COUNT_EVERY == 0:
+                print i, msg
+            i += 1
 
-    if config.DEBUG:
-        fmail_out.close()
-        mail_out.close()
+    finally:
+        if config.DEBUG:
+            fmail_out.close()
+            mail_out.close()
+        if decisions is not None:
+            decisions.write_to_file()
+    date_fallbacks = util.get_date_fallbacks() - date_fallbacks
+    if date_fallbacks > 0:
+        print str(date_fallbacks) + " message dates were not RFC 2822 dates and were parsed with the slower parser"
     print "...done"
     return threads
 
@@ -162,7 +291,7 @@ def get_retention_member_update_requests(mem_stats_sheet_id, member_data, stat_l
     :param stat_labels: Stat Labels used as header on specified shet
     :return: [Member Update Request, Member Sort Request]
     """
-    new_mem_data = map(members.Member.create_stat_row, member_data.values())
+    new_mem_data = members.Member.create_stat_rows(member_data.values())
 
     mem_request = googleAPI.update_request(mem_stats_sheet_id, new_mem_data,
                                            1, len(member_data) + 1, 0, len(stat_labels) + 3)
@@ -178,7 +307,7 @@ def get_retention_admin_update_requests(admin_sheet_id, admins):
     :param admins: new member data
     :return: Admin Update Request
     """
-    new_admin_data = map(lambda adm: members.Admin.create_stat_row(admins[adm]), sorted(admins.keys()))
+    new_admin_data = members.Admin.create_stat_rows([admins[adm] for adm in sorted(admins.keys())])
     return googleAPI.update_request(admin_sheet_id, new_admin_data, 1, len(new_admin_data) + 1, 4, 6)
 
 
@@ -218,7 +347,7 @@ def duplicate_current_tab(sheets_api, current_sheet_id, enrollment_dash_id):
         print '2. Copy all cells on duplicated tab and paste as values to remove formulas'
         print '3. Go to "Data -> Named Ranges" and remove all named ranges associated with the duplicated sheet'
         print '4. Delete all call information on the "Current" Tab of the Enrollment Dashboard'
-        raw_input("Press enter to continue.")
+        util.prompt("Press enter to continue.", "")
 
     else:
         # Try each request individually in case one fails.
@@ -231,19 +360,19 @@ def duplicate_current_tab(sheets_api, current_sheet_id, enrollment_dash_id):
             util.print_error("Error: Failed to delete named ranges on duplicated current tab. See steps below.")
             print 'On the Enrollment Dashboard go to "Data -> Named Ranges" and remove all named ranges associated ' \
                   'with the tab ' + new_title
-            raw_input("Press enter to continue.")
+            util.prompt("Press enter to continue.", "")
         try:
             googleAPI.remove_formulas(sheets_api, enrollment_dash_id, new_title + '!A:A')
         except HttpError:
             util.print_error("Error: Failed to remove values on duplicated current tab. See steps below.")
             print 'Copy all cells on ' + new_title + ' of the Enrollment Dashboard and paste values to remove formulas'
-            raw_input("Press enter to continue.")
+            util.prompt("Press enter to continue.", "")
         try:
             googleAPI.clear_ranges(sheets_api, enrollment_dash_id, ['Current_Calls', 'Bens_Calls'])
         except HttpError:
             util.print_error("Error: Failed to clear cells on Current tab of Enrollment Dashboard. See steps below.")
             print "Delete all call information on the 'Current' Tab of the Enrollment Dashboard"
-            raw_input("Press enter to continue.")
+            util.prompt("Press enter to continue.", "")
 
 
 def send_stats_email(stat_counter, mail_api, to_address, subject):
@@ -258,7 +387,7 @@ def send_stats_email(stat_counter, mail_api, to_address, subject):
 
     except HttpError:
         util.print_error("Error: Failed to send email to Andy. Use text in email.txt or text printed to terminal.")
-        raw_input("Press enter to continue.")
+        util.prompt("Press enter to continue.", "")
     print "...done"
 
 
@@ -276,38 +405,106 @@ def send_combined_stats_email(support_stat_counter, gov_stat_counter, mail_api,
         googleAPI.send_message(mail_api, "me", to_address, subject, html_body)
     except HttpError:
         util.print_error("Error: Failed to send email to Andy. Use text in email.txt or text printed to terminal.")
-        raw_input("Press enter to continue.")
+        util.prompt("Press enter to continue.", "")
     print "...done"
 
 
+def _start_thread(target, *args, **kwargs):
+    """
+    Runs target on a new thread.
+    :param target: function to run
+    :param args: positional arguments passed to target
+    :param kwargs: keyword arguments passed to target
+    :return: function which waits for target to finish and returns its result. Any exception raised by target is
+             re-raised by this function.
+    """
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = target(*args, **kwargs)
+        except BaseException:
+            outcome['error'] = sys.exc_info()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True  # Never holds the process open once the main thread has exited
+    thread.start()
+
+    def join():
+        thread.join()
+        if 'error' in outcome:
+            error_type, error, trace = outcome['error']
+            raise error_type, error, trace
+        return outcome['result']
+
+    return join
+
+
+def get_support_stats():
+    print "Running SUPPORT stats...."
+    return get_stats(SUPPORT_MAIL_API, SHEETS_API, START_DATE, "", config.MEMBER_STATS_SHEET,
+                     config.MEMBER_STATS_SHEET_ID,
+                     config.SHORT_NAME_RANGE,
+                     config.RETENTION_SPREADSHEET_ID,
+                     config.ADMIN_SHEET, config.ADMIN_SHEET_ID,
+                     True, True, SUPPORT_MAIL_FACTORY)
+
+
+def get_gov_stats(sheets_api):
+    print "Running GOV stats...."
+    return get_stats(GOV_SUPPORT_MAIL_API, sheets_api, START_DATE, "gov_",
+                     config.GOV_MEMBER_STATS_SHEET,
+                     config.GOV_MEMBER_STATS_SHEET_ID,
+                     config.GOV_SHORT_NAME_RANGE,
+                     config.RETENTION_SPREADSHEET_ID,
+                     None, None, with_admins=False,  # No admin sheets for gov
+                     with_support_calls=False, support_mail_factory=GOV_SUPPORT_MAIL_FACTORY)
+
+
 def run_stats():
     # TODO add support for more than one additional inbox
     # TODO Rebuild application shortcut. Allow for shortcut to run rom desktop
     support_counter, support_open_inquiries = None, None
     update_requests = []
-    if not config.GOV:
-        print "Running SUPPORT stats...."
-        support_counter, update_requests, support_open_inquiries = \
-            get_stats(SUPPORT_MAIL_API, SHEETS_API, START_DATE, "", config.MEMBER_STATS_SHEET,
-                      config.MEMBER_STATS_SHEET_ID,
-                      config.SHORT_NAME_RANGE,
-                      config.RETENTION_SPREADSHEET_ID,
-                      config.ADMIN_SHEET, config.ADMIN_SHEET_ID,
-                      True, True)
-
-    # Reset id to for ay new counter
-    stats.Stat._id = 0
-    print "Running GOV stats...."
-    gov_counter, gov_update_requests, gov_open_inquiries = \
-        get_stats(GOV_SUPPORT_MAIL_API, SHEETS_API, START_DATE, "gov_",
-                  config.GOV_MEMBER_STATS_SHEET,
-                  config.GOV_MEMBER_STATS_SHEET_ID,
-                  config.GOV_SHORT_NAME_RANGE,
-                  config.RETENTION_SPREADSHEET_ID,
-                  None, None, with_admins=False,  # No admin sheets for gov
-                  with_support_calls=False)
+    if config.PARALLEL and not config.GOV:
+        # Each pipeline uses its own mail and sheets services and its own counters so they can run side by side.
+        join_gov = _start_thread(get_gov_stats, GOV_SHEETS_API)
+        try:
+            support_counter, update_requests, support_open_inquiries = get_support_stats()
+        except BaseException:
+            error_type, error, trace = sys.exc_info()
+            # Gov stats are finished before the support error is reported so they never prompt after it.
+            try:
+                join_gov()
+            except BaseException, e:
+                util.print_error("Error: Gov stats also failed. " + str(e))
+            raise error_type, error, trace
+        gov_counter, gov_update_requests, gov_open_inquiries = join_gov()
+    else:
+        if not config.GOV:
+            support_counter, update_requests, support_open_inquiries = get_support_stats()
+        gov_counter, gov_update_requests, gov_open_inquiries = get_gov_stats(SHEETS_API)
     update_requests.extend(gov_update_requests)
 
+    publish_stats(support_counter, support_open_inquiries, gov_counter, gov_open_inquiries, update_requests)
+
+
+def publish_stats(support_counter, support_open_inquiries, gov_counter, gov_open_inquiries, update_requests):
+    """
+    Writes the week's stats to the Weekly Support Stats and Retention sheets, records open inquiries and sends the stats
+    email.
+    :param support_counter: support StatCounter or None if only gov stats were run
+    :param support_open_inquiries: support open inquiries or None if only gov stats were run
+    :param gov_counter: gov StatCounter
+    :param gov_open_inquiries: gov open inquiries
+    :param update_requests: Retention sheet update requests for both accounts
+    :return: None
+    """
+    if not config.SKIP:
+        if not config.GOV:
+            record_week(support_counter, '', START_DATE, END_DATE)
+        record_week(gov_counter, 'gov_', START_DATE, END_DATE)
+
     print "Updating Weekly Support Stats gsheet..."
     if not config.GOV:
         support_counter.update_weekly_support_stats(SHEETS_API, config.WEEKLY_STATS_SPREADSHEET_ID)
@@ -333,6 +530,8 @@ def run_stats():
     else:
         send_combined_stats_email(support_counter, gov_counter, MAIL_API, config.STATS_TO_ADDRESS)
 
+    googleAPI.print_request_summary()
+
 
 def get_stats(support_mail_api, sheets_api, cutoff,
               file_base,
@@ -343,7 +542,8 @@ def get_stats(support_mail_api, sheets_api, cutoff,
               admin_sheet,
               admin_sheet_id,
               with_admins=True,
-              with_support_calls=True):
+              with_support_calls=True,
+              support_mail_factory=None):
     """
 
     :param file_base:
@@ -358,21 +558,35 @@ def get_stats(support_mail_api, sheets_api, cutoff,
     :param sheets_api:
     :param with_admins:
     :param with_support_calls:
+    :param support_mail_factory: function returning a new service for support_mail_api's account. Used by
+                                 concurrent fetch workers.
     :return: StatCounter, List of Google Sheet Update Requests, dictionary of open_inquiries
     """
 
     member_data, stat_labels = read_members(member_stats_sheet, retention_spreadsheet_id, sheets_api, 3,
                                             short_name_range)
+    start_stats = _member_stats(member_data)
     support_stat_counter = stats.StatCounter(stat_labels)
+    classifier = mail.LabelClassifier(support_stat_counter.stat_labels, member_data.keys())
 
     updated_open_inquiries = None
     update_requests = []
     if not config.SKIP:
-        inbox, open_inquiries = read_inbox(support_stat_counter, file_base, support_mail_api)
-        threads = read_stats(support_stat_counter, file_base, support_mail_api, cutoff, member_data.keys())
+        admins, admin_emails = None, None
         if with_admins:
             admins, admin_emails = read_admins(admin_sheet, retention_spreadsheet_id, sheets_api)
-            update_admin_dates(threads, admins, admin_emails)
+        message_store = None
+        if config.SYNC or config.CACHE:
+            message_store = store.MessageStore()
+        decisions = read_decisions(file_base)
+        inbox, open_inquiries = read_inbox(classifier, file_base, support_mail_api,
+                                           message_store if config.SYNC else None, decisions)
+        threads = read_stats(classifier, file_base, support_mail_api, cutoff, support_mail_factory,
+                             message_store if config.CACHE else None, admins, admin_emails, decisions)
+        if message_store is not None:
+            message_store.close()
+        review_decisions(threads, decisions, file_base)
+        if with_admins:
             admin_update_request = get_retention_admin_update_requests(admin_sheet_id, admins)
             update_requests.append(admin_update_request)
 
@@ -386,7 +600,10 @@ def get_stats(support_mail_api, sheets_api, cutoff,
     support_stat_counter.format_stats()
 
     if with_support_calls:
-        support_stat_counter.get_support_calls(SHEETS_API)
+        support_stat_counter.get_support_calls(sheets_api)
+
+    if not config.SKIP:
+        archive_stats(support_stat_counter, file_base, START_DATE, END_DATE, member_data, stat_labels, start_stats)
 
     # Update Google Sheets
     mem_update_request = get_retention_member_update_requests(member_stats_sheet_id, member_data, stat_labels)
@@ -395,38 +612,600 @@ def get_stats(support_mail_api, sheets_api, cutoff,
     return support_stat_counter, update_requests, updated_open_inquiries
 
 
+class WatchedStats(object):
+    """
+    Keeps the week's stats for one support account up to date while stats are watched (config.WATCH). The GMail history
+    is polled for changes and only threads whose history id changed are rebuilt. Stats are recounted from the threads
+    whenever they are needed as counting takes a fraction of the time reading the threads takes.
+
+    Members are read once per week and kept in tools/<file_base>watch_members.pickle so stats written to the Retention
+    sheet during the week are not counted twice if watching is restarted.
+    """
+
+    def __init__(self, support_mail_api, sheets_api, file_base, member_stats_sheet, member_stats_sheet_id,
+                 short_name_range, admin_sheet, admin_sheet_id, with_admins=True, with_support_calls=True,
+                 support_mail_factory=None):
+        """
+        Reads the members and every thread of the week starting on START_DATE. See get_stats for the parameters.
+        """
+        self.support_mail_api = support_mail_api
+        self.sheets_api = sheets_api
+        self.file_base = file_base
+        self.member_stats_sheet = member_stats_sheet
+        self.member_stats_sheet_id = member_stats_sheet_id
+        self.short_name_range = short_name_range
+        self.admin_sheet = admin_sheet
+        self.admin_sheet_id = admin_sheet_id
+        self.with_admins = with_admins
+        self.with_support_calls = with_support_calls
+        self.support_mail_factory = support_mail_factory
+        self.store = store.MessageStore()
+        self.start_week()
+
+    def _members_file(self):
+        return 'tools/' + self.file_base + 'watch_members.pickle'
+
+    def _read_week_members(self):
+        """
+        :return: members as they were before the week started and stat labels. See read_members.
+        """
+        filename = self._members_file()
+        week = START_DATE.strftime('%m/%d/%Y')
+        try:
+            with open(filename, 'rb') as f:
+                start, member_data, stat_labels = pickle.load(f)
+            if start == week:
+                print "Members read from " + filename
+                return member_data, stat_labels
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+        member_data, stat_labels = read_members(self.member_stats_sheet, config.RETENTION_SPREADSHEET_ID,
+                                                self.sheets_api, 3, self.short_name_range)
+        try:
+            with open(filename, 'wb') as out:
+                pickle.dump((week, member_data, stat_labels), out, pickle.HIGHEST_PROTOCOL)
+        except IOError:
+            util.print_error('Error: Could not write ' + filename + '. Stats written during the week will be counted '
+                             'twice if watching is restarted.')
+        return member_data, stat_labels
+
+    def start_week(self):
+        """
+        Reads the members and admins the week's stats are added to and builds every thread of the week starting on
+        START_DATE.
+        :return: None
+        """
+        self.member_data, self.stat_labels = self._read_week_members()
+        self.classifier = mail.LabelClassifier(stats.StatCounter(self.stat_labels).stat_labels,
+                                               self.member_data.keys())
+        self.admins, self.admin_emails = None, None
+        if self.with_admins:
+            self.admins, self.admin_emails = read_admins(self.admin_sheet, config.RETENTION_SPREADSHEET_ID,
+                                                         self.sheets_api)
+        self.decisions = read_decisions(self.file_base)
+        self.query = week_query(START_DATE, END_DATE)
+        self.threads = {}
+        self.history_ids = {}  # (k,v) = (thread id, history id the thread was built at)
+        self.update()
+
+    def update(self):
+        """
+        Rebuilds every thread of the week whose history id changed since it was built and drops threads which no
+        longer match the query.
+        :return: int number of threads rebuilt or dropped
+        """
+        listed = googleAPI.list_threads(self.support_mail_api, 'me', self.query)
+        listed_ids = set(thread['id'] for thread in listed)
+        dropped = [thread_id for thread_id in self.history_ids if thread_id not in listed_ids]
+        for thread_id in dropped:
+            del self.history_ids[thread_id]
+            self.threads.pop(thread_id, None)
+            # A thread which left the week no longer needs an answer before the week is published.
+            self.decisions.pending.pop(thread_id, None)
+
+        changed = [thread for thread in listed if self.history_ids.get(thread['id']) != str(thread['historyId'])]
+        history_ids = dict((thread['id'], str(thread['historyId'])) for thread in changed)
+        for thread_id, messages in sync.iter_threads(self.support_mail_api, self.store, self.file_base, changed, 'me',
+                                                     config.WORKERS, self.support_mail_factory):
+            if len(messages) == 0:
+                continue  # Could not be retrieved. The thread is rebuilt on the next update.
+            # Threads cannot un-count a message so changed threads are rebuilt from all of their messages.
+            self.threads.pop(thread_id, None)
+            for message in messages:
+                add_message(self.threads, mail.Message(message), self.classifier, START_DATE, self.admins,
+                            self.admin_emails, self.decisions)
+            self.history_ids[thread_id] = history_ids[thread_id]
+
+        self.decisions.write_to_file()
+        return len(changed) + len(dropped)
+
+    def _read_answers(self):
+        """
+        Records answers given in the pending file. Answered threads are rebuilt on the next update.
+        :return: True if any answer was recorded
+        """
+        pending_file = _pending_file(self.file_base)
+        try:
+            answered = self.decisions.read_pending(pending_file)
+        except IOError:
+            util.print_error("Error: " + pending_file + " is not formatted properly. Please correct the file.")
+            return False
+        if answered == 0:
+            return False
+
+        print str(answered) + " answers read from " + pending_file
+        for thread_id in [thread_id for thread_id in self.decisions.pending if thread_id in self.decisions.answers]:
+            del self.decisions.pending[thread_id]
+            self.history_ids.pop(thread_id, None)
+        self.decisions.write_to_file()
+        os.remove(pending_file)
+        return True
+
+    def poll(self):
+        """
+        Applies the changes made to the account since the last poll. Threads are only listed again if the account's
+        history changed or answers were given for pending threads.
+        :return: int number of threads rebuilt or dropped
+        """
+        history_id = sync.read_history_id(self.file_base)
+        sync.sync(self.support_mail_api, self.store, self.file_base)
+        answered = self._read_answers()
+        if not answered and sync.read_history_id(self.file_base) == history_id:
+            return 0
+        return self.update()
+
+    def _count(self):
+        """
+        :return: StatCounter and a copy of the members with the week's last contact and check in dates.
+        """
+        member_data = copy.deepcopy(self.member_data)
+        evaluate_threads(self.threads, member_data)
+        return stats.StatCounter(self.stat_labels), member_data
+
+    def _update_requests(self, member_data):
+        update_requests = []
+        if self.with_admins:
+            update_requests.append(get_retention_admin_update_requests(self.admin_sheet_id, self.admins))
+        update_requests.extend(get_retention_member_update_requests(self.member_stats_sheet_id, member_data,
+                                                                    self.stat_labels))
+        return update_requests
+
+    def flush(self):
+        """
+        Counts the week's stats so far. Pending threads are written to the pending file so they can be answered.
+        :return: List of Google Sheet Update Requests for the Retention sheet
+        """
+        counter, member_data = self._count()
+        counter.count_stats(self.threads, member_data, self.file_base)
+        if len(self.decisions.pending) > 0:
+            self.decisions.write_pending(_pending_file(self.file_base))
+        return self._update_requests(member_data)
+
+    def snapshot(self):
+        """
+        Counts the week's stats for publishing. Open inquiries are updated from the Inbox as in get_stats.
+        :return: StatCounter, List of Google Sheet Update Requests, dictionary of open_inquiries
+        """
+        counter, member_data = self._count()
+        # The Inbox is listed from GMail as in a run without --sync so it never depends on what the store missed.
+        inbox, open_inquiries = read_inbox(self.classifier, self.file_base, self.support_mail_api, None,
+                                           self.decisions)
+        updated_open_inquiries = count_stats(counter, self.threads, member_data, open_inquiries, inbox,
+                                             self.file_base)
+        counter.format_stats()
+        if self.with_support_calls:
+            counter.get_support_calls(self.sheets_api)
+        archive_stats(counter, self.file_base, START_DATE, END_DATE, member_data, self.stat_labels,
+                      _member_stats(self.member_data))
+        return counter, self._update_requests(member_data), updated_open_inquiries
+
+
+def watch_stats():
+    """
+    Keeps stats up to date until interrupted. Each account is polled every config.WATCH seconds and member and admin
+    stats are written to the Retention sheet every config.FLUSH_INTERVAL seconds. Once the week is over and no threads
+    are pending the week's stats are published like a normal run and the next week is watched.
+    :return: None
+    """
+    global START_DATE, END_DATE
+    print "Watching stats for " + START_DATE.strftime('%m/%d/%Y') + " - " + \
+          util.add_days(END_DATE, -1).strftime('%m/%d/%Y') + "..."
+    support, gov = None, None
+    if not config.GOV:
+        support = WatchedStats(SUPPORT_MAIL_API, SHEETS_API, "", config.MEMBER_STATS_SHEET,
+                               config.MEMBER_STATS_SHEET_ID, config.SHORT_NAME_RANGE,
+                               config.ADMIN_SHEET, config.ADMIN_SHEET_ID, True, True, SUPPORT_MAIL_FACTORY)
+    gov = WatchedStats(GOV_SUPPORT_MAIL_API, SHEETS_API, "gov_", config.GOV_MEMBER_STATS_SHEET,
+                       config.GOV_MEMBER_STATS_SHEET_ID, config.GOV_SHORT_NAME_RANGE,
+                       None, None, False, False, GOV_SUPPORT_MAIL_FACTORY)  # No admin sheets for gov
+    accounts = [account for account in (support, gov) if account is not None]
+
+    flushed = time.time()
+    starting = []  # Accounts whose new week could not be read yet
+    try:
+        while True:
+            for account in list(starting):
+                try:
+                    account.start_week()
+                except WATCH_ERRORS, e:
+                    util.print_error("Error: Failed to start the week for " + account.file_base + "support. Will "
+                                     "retry. " + str(e))
+                    continue
+                starting.remove(account)
+
+            for account in accounts:
+                if account in starting:
+                    continue
+                try:
+                    changed = account.poll()
+                except WATCH_ERRORS, e:
+                    util.print_error("Error: Failed to poll " + account.file_base + "support. Will retry. " + str(e))
+                    continue
+                if changed > 0:
+                    print str(changed) + " " + account.file_base + "support threads updated"
+
+            pending = sum(len(account.decisions.pending) for account in accounts)
+            week_over = datetime.datetime.now(util.EDT) >= END_DATE
+            if len(starting) > 0:
+                pass  # Nothing is published or flushed until every account has read the new week
+            elif week_over and pending == 0:
+                update_requests = []
+                support_counter, support_open_inquiries = None, None
+                if support is not None:
+                    support_counter, update_requests, support_open_inquiries = support.snapshot()
+                gov_counter, gov_update_requests, gov_open_inquiries = gov.snapshot()
+                update_requests.extend(gov_update_requests)
+                publish_stats(support_counter, support_open_inquiries, gov_counter, gov_open_inquiries,
+                              update_requests)
+                write_last_run(END_DATE)
+
+                START_DATE, END_DATE = END_DATE, util.add_days(END_DATE, 7)
+                print "Watching stats for " + START_DATE.strftime('%m/%d/%Y') + " - " + \
+                      util.add_days(END_DATE, -1).strftime('%m/%d/%Y') + "..."
+                # The new week is read at the top of the loop so a failure is retried like a failed poll.
+                starting = list(accounts)
+                flushed = time.time()
+            elif time.time() - flushed >= config.FLUSH_INTERVAL:
+                update_requests = []
+                for account in accounts:
+                    update_requests.extend(account.flush())
+                try:
+                    update_retention(SHEETS_API, config.RETENTION_SPREADSHEET_ID, update_requests)
+                except WATCH_ERRORS, e:
+                    util.print_error("Error: Failed to write member and admin stats to the Retention sheet. Will "
+                                     "retry on the next flush. " + str(e))
+                if week_over:
+                    util.print_error(str(pending) + " threads need to be reviewed before the week's stats are "
+                                     "published. Answer them in the pending files.")
+                flushed = time.time()
+
+            time.sleep(config.WATCH)
+    except KeyboardInterrupt:
+        print "\nStopped watching stats"
+    finally:
+        for account in accounts:
+            account.store.close()
+
+
+def _member_stats(member_data):
+    """
+    :param member_data: member dictionary with (k,v) = (name, Member() object)
+    :return: dictionary (k,v) = (name, copy of the member's stats)
+    """
+    return dict((name, list(mem.get_stats())) for name, mem in member_data.iteritems())
+
+
+def archive_stats(stat_counter, file_base, start_date, end_date, member_data=None, stat_labels=None,
+                  start_stats=None):
+    """
+    Adds the counts of a run to tools/<file_base>archive.npz so their history can be queried without the Weekly Stats
+    sheet. See archive.StatArchive. Runs are only archived if numpy is installed.
+    :param stat_counter: formatted StatCounter
+    :param file_base: '' for support or 'gov_' for gov support.
+    :param start_date: Earliest date for which stats were counted.
+    :param end_date: Date stats stopped counting (exclusive)
+    :param member_data: members with the run's stats added (default = None: member stats are not archived)
+    :param stat_labels: labels of the member stats
+    :param start_stats: member stats before the run's stats were added. See _member_stats. Required with member_data
+                        so only the week's stats are archived.
+    :return: None
+    """
+    if archive.numpy is None:
+        return
+    filename = _run_file(file_base + 'archive.npz')
+    try:
+        stat_archive = archive.StatArchive.from_file(filename)
+    except IOError:
+        util.print_error("Error: " + filename + " is not formatted properly. This run will not be archived. "
+                         "Please correct or move the file.")
+        return
+
+    stat_archive.add_run(start_date, end_date, stat_counter, member_data, stat_labels, start_stats)
+    try:
+        stat_archive.write_to_file()
+    except IOError:
+        util.print_error("Error: Could not write " + filename + ". This run will not be archived.")
+
+
+def _count_week(job):
+    """
+    Counts and formats the stats of one week of a backfill. Runs in a worker process if config.WORKERS > 1.
+    :param job: (thread dictionary of the week, member dictionary, stat labels, file_base, week start date)
+    :return: StatCounter
+    """
+    threads, member_data, stat_labels, file_base, start = job
+    stat_counter = stats.StatCounter(stat_labels)
+    # Each week has its own debug log so concurrent weeks do not write to the same file.
+    stat_counter.count_stats(threads, copy.deepcopy(member_data), file_base + start.strftime('%Y-%m-%d_'))
+    stat_counter.format_stats()
+    return stat_counter
+
+
+def get_backfill_stats(support_mail_api, sheets_api, file_base, member_stats_sheet, short_name_range, weeks,
+                       support_mail_factory=None):
+    """
+    Reads every thread between START_DATE and END_DATE at once and counts the stats of each week from the threads
+    started that week. A thread started in an earlier week never counts in a later week so each week's stats match a
+    run for that week. Open inquiries cannot be rebuilt for past weeks and are not counted.
+    :param file_base: '' for support or 'gov_' for gov support.
+    :param weeks: list of (start date, end date (exclusive)) of each week in order
+    :return: list of formatted StatCounter for each week
+    """
+    member_data, stat_labels = read_members(member_stats_sheet, config.RETENTION_SPREADSHEET_ID, sheets_api, 3,
+                                            short_name_range)
+    classifier = mail.LabelClassifier(stats.StatCounter(stat_labels).stat_labels, member_data.keys())
+    message_store = None
+    if config.CACHE:
+        message_store = store.MessageStore()
+    decisions = read_decisions(file_base)
+    threads = read_stats(classifier, file_base, support_mail_api, START_DATE, support_mail_factory, message_store,
+                         decisions=decisions)
+    if message_store is not None:
+        message_store.close()
+    review_decisions(threads, decisions, file_base)
+
+    buckets = [{} for week in weeks]
+    for thread_id, thread in threads.iteritems():
+        week = (thread.get_oldest_date() - START_DATE).days // 7
+        if 0 <= week < len(buckets):
+            buckets[week][thread_id] = thread
+
+    print "Counting stats for " + str(len(weeks)) + " weeks..."
+    jobs = [(bucket, member_data, stat_labels, file_base, start) for bucket, (start, end) in zip(buckets, weeks)]
+    if config.WORKERS > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(config.WORKERS, len(jobs)))
+        try:
+            counters = pool.map(_count_week, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        counters = [_count_week(job) for job in jobs]
+    print "...done"
+    return counters
+
+
+def backfill_stats():
+    """
+    Recomputes the weekly stats of every week between START_DATE and END_DATE from a single read of each account and
+    inserts a column for each week into the Weekly Support Stats sheets, oldest week first. Member stats, open
+    inquiries, the weekly averages and the stats email are left alone. Past weeks cannot be added to the weekly
+    averages as they only accept weeks newer than the last week recorded.
+    :return: None
+    """
+    weeks = []
+    start = START_DATE
+    while start < END_DATE:
+        end = min(util.add_days(start, 7), END_DATE)
+        weeks.append((start, end))
+        start = end
+    print "Backfilling " + str(len(weeks)) + " weeks of stats..."
+
+    support_counters = None
+    if not config.GOV:
+        print "Running SUPPORT stats...."
+        support_counters = get_backfill_stats(SUPPORT_MAIL_API, SHEETS_API, "", config.MEMBER_STATS_SHEET,
+                                              config.SHORT_NAME_RANGE, weeks, SUPPORT_MAIL_FACTORY)
+    print "Running GOV stats...."
+    gov_counters = get_backfill_stats(GOV_SUPPORT_MAIL_API, SHEETS_API, "gov_", config.GOV_MEMBER_STATS_SHEET,
+                                      config.GOV_SHORT_NAME_RANGE, weeks, GOV_SUPPORT_MAIL_FACTORY)
+
+    print "Updating Weekly Support Stats gsheet..."
+    for i, (start, end) in enumerate(weeks):
+        # Each column is dated the day after its week like the column of a weekly run.
+        if support_counters is not None:
+            archive_stats(support_counters[i], '', start, end)
+            support_counters[i].update_weekly_support_stats(SHEETS_API, config.WEEKLY_STATS_SPREADSHEET_ID, date=end)
+        archive_stats(gov_counters[i], 'gov_', start, end)
+        gov_counters[i].update_weekly_support_stats(SHEETS_API, config.WEEKLY_STATS_SPREADSHEET_ID,
+                                                    config.GOV_WEEKLY_STATS_SHEET_ID, date=end)
+    print "...done"
+
+    googleAPI.print_request_summary()
+
+
+def _run_file(name):
+    test = ''
+    if config.TEST:
+        test = 'test_'
+    return 'tools/' + test + name
+
+
+def _last_run_file():
+    return _run_file('last_run.txt')
+
+
+def record_week(stat_counter, file_base, start_date, end_date):
+    """
+    Adds the week's counts to the counts of the last 52 weeks kept in tools/<file_base>weeks.pickle so averages can be
+    reported with the week's stats. Runs that do not cover exactly 7 days are not added.
+    :param stat_counter: formatted StatCounter
+    :param file_base: '' for support or 'gov_' for gov support.
+    :param start_date: first day of the week
+    :param end_date: day after the last day of the week
+    :return: None
+    """
+    filename = _run_file(file_base + 'weeks.pickle')
+    if (end_date - start_date).days != 7:
+        print "Run is not exactly 7 days long. Its stats are not added to the averages in " + filename + "."
+        return
+    try:
+        weeks = stats.RollingWeeks.from_file(filename)
+    except IOError:
+        util.print_error("Error: " + filename + " is not formatted properly. Weekly averages will not be reported. "
+                         "Please correct or delete the file.")
+        return
+
+    if not stat_counter.record_week(weeks, start_date):
+        util.print_error("Stats for weeks before the last week in " + filename + " are not added to its averages.")
+        return
+    try:
+        weeks.write_to_file()
+    except IOError:
+        util.print_error("Error: Could not write " + filename + ". This week will be missing from weekly averages.")
+
+
+def read_last_run():
+    """
+    :return: datetime END_DATE (exclusive) of the last successful run or None if stats have not been run.
+    """
+    try:
+        with open(_last_run_file(), 'r') as f:
+            return util.parse_date(f.read().strip(), fuzzy=False)
+    except (IOError, TypeError):
+        return None
+
+
+def write_last_run(end_date):
+    """
+    Records the end of a successful run so the next batch run starts where it stopped.
+    :param end_date: END_DATE (exclusive) of the run
+    :return: None
+    """
+    with open(_last_run_file(), 'w') as out:
+        out.write(end_date.strftime('%m/%d/%Y') + '\n')
+
+
+def write_report(status, exit_code, started, error=None):
+    """
+    Writes a JSON report of the run to config.REPORT or prints it if config.REPORT is not set.
+    :param status: str 'ok' | 'warnings' | 'needs_input' | 'failed'
+    :param exit_code: int exit code of the run
+    :param started: float time the run started
+    :param error: str error which stopped the run (default = None)
+    :return: None
+    """
+    report = {
+        'status': status,
+        'exit_code': exit_code,
+        'start': START_DATE.strftime('%m/%d/%Y') if START_DATE is not None else None,
+        'end': util.add_days(END_DATE, -1).strftime('%m/%d/%Y') if END_DATE is not None else None,
+        'seconds': round(time.time() - started, 1),
+        'error': error,
+        'errors': util.get_errors(),
+        'requests': {'made': googleAPI.request_stats.requests, 'retried': googleAPI.request_stats.retries,
+                     'failed': googleAPI.request_stats.failures, 'dropped': len(googleAPI.request_stats.dropped)}
+    }
+    text = json.dumps(report, indent=2, sort_keys=True, separators=(',', ': '))
+    if config.REPORT is None:
+        print text
+    else:
+        with open(config.REPORT, 'w') as out:
+            out.write(text + '\n')
+
+
+def week_query(start_date, end_date):
+    """
+    :param start_date: earliest date stats count
+    :param end_date: date stats stop counting (exclusive)
+    :return: BASE_QUERY limited to messages sent between start_date and end_date
+    """
+    return "after:" + start_date.strftime('%Y/%m/%d') + " before:" + end_date.strftime('%Y/%m/%d') + " " + BASE_QUERY
+
+
 def init_param():
     util.parse()
     util.set_test(config.TEST)
     util.print_param()
     global START_DATE, END_DATE
-    START_DATE = util.get_cutoff_date(
+    START_DATE = util.get_run_date(
+        config.START,
         "\nOn which date were stats last run?\ni.e. "
-        "What is the earliest date for which stats should count, typically last Thursday?\n")
+        "What is the earliest date for which stats should count, typically last Thursday?\n",
+        read_last_run())
 
-    # This date is inclusive of when stats should count.
-    END_DATE = util.get_cutoff_date(
-        "\nEnter the final date for which stats should count. Typically this Wednesday.\n")
-    END_DATE = util.add_days(END_DATE, 1)
+    if config.WATCH is not None and config.END is None:
+        # Watched stats are published once the week is over
+        END_DATE = util.add_days(START_DATE, 7)
+    else:
+        # This date is inclusive of when stats should count. Batch runs count through yesterday.
+        END_DATE = util.get_run_date(
+            config.END,
+            "\nEnter the final date for which stats should count. Typically this Wednesday.\n",
+            util.parse_date(util.add_days(datetime.date.today(), -1).strftime('%m/%d/%Y')))
+        END_DATE = util.add_days(END_DATE, 1)
+
+    if config.BATCH and not config.BACKFILL and not config.INITIALS:
+        raise util.PromptError("Input needed: set config.INITIALS to sign the stats email in batch mode.")
 
     if END_DATE < START_DATE:
         raise RuntimeError("Start Date must be less than or equal to End Date.")
 
     # Update query to use cutoff dates
-    config.QUERY = "after:" + START_DATE.strftime('%Y/%m/%d') + " before:" + \
-                   END_DATE.strftime('%Y/%m/%d') + " " + config.QUERY
+    global BASE_QUERY
+    BASE_QUERY = config.QUERY
+    config.QUERY = week_query(START_DATE, END_DATE)
 
     # Create google api service objects
     global MAIL_API, SHEETS_API, SUPPORT_MAIL_API, GOV_SUPPORT_MAIL_API
+    global SUPPORT_MAIL_FACTORY, GOV_SUPPORT_MAIL_FACTORY, GOV_SHEETS_API
     MAIL_API = googleAPI.get_api('gmail', 'v1', 'personal', googleAPI.SCOPES, 3)
     SHEETS_API = googleAPI.get_api('sheets', 'v4', 'personal', googleAPI.SCOPES, 3)
+    if config.PARALLEL and not config.GOV:
+        GOV_SHEETS_API = googleAPI.get_api('sheets', 'v4', 'personal', googleAPI.SCOPES, 3)
     if not config.GOV:
-        SUPPORT_MAIL_API = googleAPI.get_api('gmail', 'v1', 'support', googleAPI.SUPPORT_SCOPE, 3)
-    GOV_SUPPORT_MAIL_API = googleAPI.get_api('gmail', 'v1', 'gov_support', googleAPI.GOV_SUPPORT_SCOPE, 3)
+        SUPPORT_MAIL_FACTORY = googleAPI.get_api_factory('gmail', 'v1', 'support', googleAPI.SUPPORT_SCOPE, 3)
+        SUPPORT_MAIL_API = SUPPORT_MAIL_FACTORY()
+    GOV_SUPPORT_MAIL_FACTORY = googleAPI.get_api_factory('gmail', 'v1', 'gov_support', googleAPI.GOV_SUPPORT_SCOPE, 3)
+    GOV_SUPPORT_MAIL_API = GOV_SUPPORT_MAIL_FACTORY()
+
+
+def main():
+    """
+    Runs stats and reports the outcome. A report is written when stats are run in batch mode or config.REPORT is set.
+    :return: int exit code. EXIT_OK, EXIT_WARNINGS if errors were printed along the way or messages could not be
+             retrieved, EXIT_NEEDS_INPUT if stats stopped for input that could not be asked for or EXIT_FAILED.
+    """
+    started = time.time()
+    error = None
+    try:
+        init_param()
+        if config.WATCH is not None:
+            watch_stats()
+        elif config.BACKFILL:
+            backfill_stats()
+        else:
+            run_stats()
+            write_last_run(END_DATE)
+    except util.PromptError, e:
+        status, exit_code, error = 'needs_input', EXIT_NEEDS_INPUT, str(e)
+        util.print_error(e)
+    except Exception, e:
+        status, exit_code, error = 'failed', EXIT_FAILED, str(e)
+        traceback.print_exc()
+    else:
+        status, exit_code = 'ok', EXIT_OK
+        if len(googleAPI.request_stats.dropped) > 0:
+            util.print_error("Warning: " + str(len(googleAPI.request_stats.dropped)) + " messages or threads could not "
+                             "be retrieved after every retry. Stats are incomplete and should be re-run.")
+        if len(util.get_errors()) > 0:
+            status, exit_code = 'warnings', EXIT_WARNINGS
+
+    if config.BATCH or config.REPORT is not None:
+        write_report(status, exit_code, started, error)
+    return exit_code
 
 
 if __name__ == '__main__':
-    START_DATE = util.parse_date("January 1, 2000")
-    END_DATE = util.parse_date("January 1, 2000")
-    init_param()
-    run_stats()
+    sys.exit(main())
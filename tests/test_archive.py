@@ -0,0 +1,90 @@
+"""
+Checks that archived runs hold the stats counted each week and the stats each member gained during the week. Run from
+the repository root with
+python -m unittest discover tests
+"""
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from tools.lib import archive, stats
+from tools.lib.members import Member
+
+STAT_LABELS = ['Issue', 'Training']
+START = date(2018, 1, 4)
+END = date(2018, 1, 11)
+
+
+def _counter(issues):
+    counter = stats.StatCounter(STAT_LABELS)
+    counter.stat_labels['Issue'].increment(issues)
+    counter.call_stats['Sessions'].set_count('')  # Calls that were not entered
+    return counter
+
+
+@unittest.skipIf(archive.numpy is None, "numpy is required to archive stats")
+class StatArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self._dir, 'archive.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_stat_counts_are_archived(self):
+        stat_archive = archive.StatArchive()
+        stat_archive.add_run(START, END, _counter(4))
+        weeks, values = stat_archive.series('Issue', 'stat_labels')
+        self.assertEqual((weeks, list(values)), ([START], [4]))
+        self.assertEqual(stat_archive.average('Issue'), 4)
+        self.assertTrue(math.isnan(stat_archive.query(stat='Sessions')[0][5]))
+        self.assertIsNone(stat_archive.average('Sessions'))
+
+    def test_member_rows_hold_the_week_deltas(self):
+        members = {'a': Member('a', None, None, [5, 3]), 'b': Member('b', None, None, [2, 0])}
+        stat_archive = archive.StatArchive()
+        # Member b was added during the week and started without stats.
+        stat_archive.add_run(START, END, _counter(4), members, STAT_LABELS, {'a': [4, 1]})
+
+        rows = stat_archive.query(kind=archive.MEMBERS)
+        self.assertEqual(sorted((row[4], row[3], row[5]) for row in rows),
+                         [(u'a', u'Issue', 1), (u'a', u'Training', 2), (u'b', u'Issue', 2), (u'b', u'Training', 0)])
+        self.assertEqual(stat_archive.average('Training', archive.MEMBERS, u'a'), 2)
+
+    def test_member_rows_require_start_stats(self):
+        members = {'a': Member('a', None, None, [5, 3])}
+        stat_archive = archive.StatArchive()
+        self.assertRaises(ValueError, stat_archive.add_run, START, END, _counter(4), members, STAT_LABELS)
+        self.assertEqual(len(stat_archive), 0)
+
+    def test_re_run_replaces_week(self):
+        stat_archive = archive.StatArchive()
+        stat_archive.add_run(START, END, _counter(4))
+        rows = len(stat_archive)
+        stat_archive.add_run(END, date(2018, 1, 18), _counter(8))
+        stat_archive.add_run(START, END, _counter(6))
+
+        self.assertEqual(len(stat_archive), 2 * rows)
+        weeks, values = stat_archive.series('Issue', 'stat_labels')
+        self.assertEqual((weeks, list(values)), ([START, END], [6, 8]))
+        self.assertEqual(stat_archive.average('Issue', start_date=END), 8)
+
+    def test_archive_is_kept_between_runs(self):
+        self.assertEqual(len(archive.StatArchive.from_file(self.filename)), 0)
+        stat_archive = archive.StatArchive(self.filename)
+        stat_archive.add_run(START, END, _counter(4), {'a': Member('a', None, None, [5, 3])}, STAT_LABELS, {})
+        stat_archive.write_to_file()
+
+        read = archive.StatArchive.from_file(self.filename)
+        self.assertEqual(len(read), len(stat_archive))
+        self.assertEqual(read.query()[:3], stat_archive.query()[:3])
+        weeks, values = read.series('Issue', archive.MEMBERS, u'a')
+        self.assertEqual((weeks, list(values)), ([START], [5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Checks that answers to "Should the following message be counted?" are kept between runs and can be given in the
+pending file. Run from the repository root with
+python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools.lib.mail import Decisions, Message
+
+
+def _message(from_address, subject):
+    return Message({'X-GM-THRID': 't1', 'To': 'support@irbnet.org', 'From': from_address, 'Subject': subject,
+                    'X-Gmail-Labels': ['INBOX', 'Issue'], 'Date': 'Wed, 03 Jan 2018 17:20:00 -0000'})
+
+
+class DecisionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self._dir, 'decisions.txt')
+        self.pending = os.path.join(self._dir, 'pending.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_answers_are_kept_between_runs(self):
+        decisions = Decisions.from_file(self.filename, [])
+        self.assertEqual(decisions.answers, {})
+        decisions.record('t1', True)
+        decisions.record('t2', False)
+        decisions.write_to_file()
+
+        decisions = Decisions.from_file(self.filename, [])
+        self.assertEqual(decisions.answers, {'t1': True, 't2': False})
+        self.assertTrue(decisions.get('t1', _message('user@example.com', 'Question')))
+        self.assertIsNone(decisions.get('t3', _message('user@example.com', 'Question')))
+
+    def test_unchanged_answers_are_not_written(self):
+        decisions = Decisions.from_file(self.filename, [])
+        decisions.record('t1', True)
+        decisions.write_to_file()
+        os.remove(self.filename)
+
+        decisions.write_to_file()
+        decisions.record('t1', True)
+        decisions.write_to_file()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_rules_answer_unrecorded_threads(self):
+        rules = [('from', 'noreply', False), ('label', 'Issue', True)]
+        decisions = Decisions(rules=rules)
+        self.assertFalse(decisions.get('t1', _message('noreply@example.com', 'Question')))
+        self.assertTrue(decisions.get('t1', _message('user@example.com', 'Question')))
+        decisions.record('t1', False)
+        self.assertFalse(decisions.get('t1', _message('user@example.com', 'Question')))
+        self.assertRaises(ValueError, Decisions, None, [('body', 'phrase', True)])
+
+    def test_pending_threads_are_answered_in_file(self):
+        decisions = Decisions.from_file(self.filename, [], defer=True)
+        for thread_id in ['t1', 't2', 't3']:
+            decisions.postpone(thread_id, _message('user@example.com', 'Question ' + thread_id), 'Support')
+        decisions.write_pending(self.pending)
+
+        with open(self.pending, 'r') as f:
+            lines = f.readlines()
+        self.assertEqual(len(lines), 4)
+        answers = {'t1': 'Y', 't2': 'n'}
+        with open(self.pending, 'w') as out:
+            for line in lines:
+                thread_id = line.split()[0]
+                out.write(line.replace(' ? ', ' ' + answers[thread_id] + ' ', 1) if thread_id in answers else line)
+
+        decisions = Decisions.from_file(self.filename, [], defer=True)
+        self.assertEqual(decisions.read_pending(self.pending), 2)
+        decisions.write_to_file()
+        self.assertEqual(Decisions.from_file(self.filename, []).answers, {'t1': True, 't2': False})
+
+    def test_missing_and_malformed_files(self):
+        decisions = Decisions.from_file(self.filename, [])
+        self.assertEqual(decisions.read_pending(self.pending), 0)
+
+        with open(self.filename, 'w') as out:
+            out.write('t1 maybe\n')
+        self.assertRaises(IOError, Decisions.from_file, self.filename, [])
+        with open(self.pending, 'w') as out:
+            out.write('t1 | Support | From: user@example.com\n')
+        self.assertRaises(IOError, decisions.read_pending, self.pending)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+"""
+Checks that the loop and columnar engines count the same stats. Run from the repository root with
+python -m unittest discover tests
+"""
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+from tools import config
+from tools.lib import googleAPI, stats
+
+
+class EngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self._config = dict((name, getattr(config, name)) for name in ['COUNT_ALL', 'WORKERS', 'QUERY', 'ENGINE'])
+        self._label_cache_file = googleAPI.LABEL_CACHE_FILE
+        # Label maps of the synthetic mailbox must never replace the cached maps of the real accounts.
+        self._cache_dir = tempfile.mkdtemp()
+        googleAPI.LABEL_CACHE_FILE = self._cache_dir + '/{account}_labels.pickle'
+
+    def tearDown(self):
+        for name, value in self._config.items():
+            setattr(config, name, value)
+        googleAPI.LABEL_CACHE_FILE = self._label_cache_file
+        shutil.rmtree(self._cache_dir)
+
+    @unittest.skipIf(stats.numpy is None, "numpy is required by the columnar engine")
+    def test_engines_agree(self):
+        results, messages, threads, retained, differences = benchmark.run(2000, 50, 1, 7, 0.0, verify=True)
+        self.assertGreater(threads, 0)
+        self.assertEqual(differences, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+Checks how requests are retried and how failed messages are counted and dropped. Run from the repository root with
+python -m unittest discover tests
+"""
+import socket
+import unittest
+
+from googleapiclient.errors import HttpError
+
+from tools.lib import fakeAPI, googleAPI
+
+
+class Request(object):
+    """
+    Request whose executions fail with each of the given errors in turn before it succeeds.
+    """
+
+    def __init__(self, errors):
+        self.methodId = 'fake.users.messages.get'
+        self.errors = list(errors)
+        self.executed = 0
+
+    def execute(self):
+        self.executed += 1
+        if len(self.errors) > 0:
+            raise self.errors.pop(0)
+        return {'id': 'response'}
+
+
+class RequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self._backoff_base = googleAPI.BACKOFF_BASE
+        self._request_stats = googleAPI.request_stats
+        googleAPI.BACKOFF_BASE = 0
+        googleAPI.request_stats = googleAPI.RequestStats()
+        self.stats = googleAPI.request_stats
+
+        self.mailbox = fakeAPI.Mailbox()
+        self.msg_ids = [self.mailbox.add_message('t' + str(i % 3), ['INBOX', 'Issue'], 'user@example.com',
+                                                 'support@irbnet.org', 'Subject', 1515000000 + i) for i in range(6)]
+
+    def tearDown(self):
+        googleAPI.BACKOFF_BASE = self._backoff_base
+        googleAPI.request_stats = self._request_stats
+
+    def test_retryable_errors_are_retried(self):
+        request = Request([fakeAPI._http_error(503, 'backendError'), fakeAPI._http_error(403, 'rateLimitExceeded'),
+                           socket.error('reset')])
+        self.assertEqual(googleAPI._execute(request), {'id': 'response'})
+        self.assertEqual((self.stats.requests, self.stats.retries, self.stats.failures), (4, 3, 0))
+
+    def test_other_errors_are_not_retried(self):
+        for status, reason in [(404, 'notFound'), (403, 'forbidden'), (400, 'invalidArgument')]:
+            request = Request([fakeAPI._http_error(status, reason)])
+            self.assertRaises(HttpError, googleAPI._execute, request)
+            self.assertEqual(request.executed, 1)
+        self.assertEqual((self.stats.requests, self.stats.retries, self.stats.failures), (3, 0, 3))
+
+    def test_request_fails_once_retries_run_out(self):
+        request = Request([fakeAPI._http_error(503, 'backendError')] * 3)
+        self.assertRaises(HttpError, googleAPI._execute, request, 2)
+        self.assertEqual((self.stats.requests, self.stats.retries, self.stats.failures), (3, 2, 1))
+
+    def test_batch_retries_failed_messages(self):
+        service = fakeAPI.FakeMailService(self.mailbox, error_rate=0.5, seed=1)
+        labels = googleAPI.get_labels(service)
+        requests, retries = self.stats.requests, self.stats.retries
+        msg_ids = self.msg_ids + self.msg_ids[:2]
+
+        messages = googleAPI.get_messages_batch(service, 'me', msg_ids, labels, batch_size=4, retries=20)
+        self.assertEqual([message['X-GM-MSGID'] for message in messages], msg_ids)
+        self.assertEqual(messages[0]['X-Gmail-Labels'], ['INBOX', 'Issue'])
+        retries = self.stats.retries - retries
+        self.assertGreater(retries, 0)
+        # Every message is requested once plus once for each of its retries.
+        self.assertEqual(self.stats.requests - requests, len(self.msg_ids) + retries)
+        self.assertEqual((self.stats.failures, self.stats.dropped), (0, []))
+
+    def test_batch_drops_messages_once_retries_run_out(self):
+        service = fakeAPI.FakeMailService(self.mailbox)
+        labels = googleAPI.get_labels(service)
+        service.error_rate = 1.0
+        requests = self.stats.requests
+
+        self.assertEqual(googleAPI.get_messages_batch(service, 'me', self.msg_ids, labels, retries=2), [])
+        self.assertEqual(self.stats.requests - requests, 3 * len(self.msg_ids))
+        self.assertEqual(self.stats.retries, 2 * len(self.msg_ids))
+        self.assertEqual(self.stats.failures, len(self.msg_ids))
+        self.assertEqual([item_id for kind, item_id, reason in self.stats.dropped], self.msg_ids)
+
+    def test_batch_raises_errors_affecting_the_run(self):
+        service = fakeAPI.FakeMailService(self.mailbox)
+        labels = googleAPI.get_labels(service)
+        get_message = service._get_message
+
+        def forbidden(**kwargs):
+            if kwargs['id'] == self.msg_ids[2]:
+                raise fakeAPI._http_error(403, 'forbidden')
+            return get_message(**kwargs)
+        service._get_message = forbidden
+
+        self.assertRaises(HttpError, googleAPI.get_messages_batch, service, 'me', self.msg_ids, labels)
+        self.assertEqual((self.stats.failures, self.stats.dropped), (1, []))
+
+    def test_unknown_label_is_read_once(self):
+        service = fakeAPI.FakeMailService(self.mailbox)
+        labels = googleAPI.get_labels(service)
+        label_id = self.mailbox.label_id('Training')
+
+        self.assertEqual(labels[label_id], 'Training')
+        for i in range(3):
+            self.assertEqual(labels['Label_missing'], 'Label_missing')
+        self.assertEqual(service.calls['fake.users.labels.list'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
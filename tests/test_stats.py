@@ -0,0 +1,123 @@
+"""
+Checks that weekly counts are kept by calendar week and averaged over the most recent weeks. Run from the repository
+root with
+python -m unittest discover tests
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from array import array
+from datetime import date, timedelta
+
+from tools.lib.stats import RollingWeeks
+
+KEY = ('totals', 'Total')
+FIRST = date(2018, 1, 4)  # Stats are usually run for the week starting on a Thursday.
+
+
+def _week(i):
+    return FIRST + timedelta(days=7 * i)
+
+
+class RollingWeeksTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self._dir, 'weeks.pickle')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_weeks_are_averaged(self):
+        weeks = RollingWeeks(weeks=4)
+        self.assertIsNone(weeks.average(KEY))
+        for i, count in enumerate([10, 20, 30]):
+            self.assertTrue(weeks.add(_week(i), {KEY: count}))
+        self.assertEqual(weeks.size, 3)
+        self.assertEqual(weeks.total(KEY), 60)
+        self.assertEqual(weeks.average(KEY), 20)
+        self.assertEqual(weeks.average(KEY, 2), 25)
+        self.assertEqual(weeks.average(KEY, 10), 20)
+        self.assertEqual(weeks.average(('totals', 'Unknown')), 0)
+
+    def test_oldest_week_is_dropped(self):
+        weeks = RollingWeeks(weeks=3)
+        for i, count in enumerate([10, 20, 30, 40]):
+            weeks.add(_week(i), {KEY: count})
+        self.assertEqual(weeks.size, 3)
+        self.assertEqual(weeks.total(KEY), 90)
+        self.assertEqual(weeks.total(KEY, 1), 40)
+
+    def test_week_can_be_re_run(self):
+        weeks = RollingWeeks(weeks=4)
+        weeks.add(_week(0), {KEY: 10})
+        weeks.add(_week(1), {KEY: 20, ('totals', 'Non-Pings'): 5})
+        self.assertTrue(weeks.add(_week(1), {KEY: 25}))
+        self.assertEqual((weeks.size, weeks.total(KEY), weeks.total(('totals', 'Non-Pings'))), (2, 35, 0))
+
+    def test_older_weeks_are_ignored(self):
+        weeks = RollingWeeks(weeks=4)
+        weeks.add(_week(1), {KEY: 10})
+        self.assertFalse(weeks.add(_week(0), {KEY: 20}))
+        self.assertEqual((weeks.size, weeks.total(KEY)), (1, 10))
+
+    def test_skipped_weeks_count_as_empty_weeks(self):
+        weeks = RollingWeeks(weeks=4)
+        for i in range(4):
+            weeks.add(_week(i), {KEY: 10})
+        weeks.add(_week(6), {KEY: 40})
+        # Weeks 3, 4 and 5 are held in the 3 slots before week 6. Week 3 still counts.
+        self.assertEqual(weeks.size, 4)
+        self.assertEqual(weeks.total(KEY), 50)
+        self.assertEqual(weeks.total(KEY, 3), 40)
+        self.assertEqual(weeks.average(KEY), 12.5)
+
+        weeks.add(_week(20), {KEY: 8})
+        self.assertEqual((weeks.size, weeks.total(KEY)), (4, 8))
+        self.assertEqual(weeks.average(KEY), 2)
+
+    def test_weeks_are_slotted_by_calendar_week(self):
+        weeks = RollingWeeks(weeks=4)
+        weeks.add(_week(0), {KEY: 10})
+        # A run started later in the same calendar week (Sunday to Saturday) replaces the week.
+        weeks.add(_week(0) + timedelta(days=1), {KEY: 15})
+        self.assertEqual((weeks.size, weeks.total(KEY)), (1, 15))
+        weeks.add(_week(1) - timedelta(days=1), {KEY: 5})
+        self.assertEqual((weeks.size, weeks.total(KEY)), (2, 20))
+
+    def test_weeks_are_kept_between_runs(self):
+        weeks = RollingWeeks.from_file(self.filename, 4)
+        self.assertEqual(weeks.size, 0)
+        for i, count in enumerate([10, 20]):
+            weeks.add(_week(i), {KEY: count})
+        weeks.write_to_file()
+
+        weeks = RollingWeeks.from_file(self.filename, 4)
+        self.assertEqual((weeks.size, weeks.total(KEY), weeks.total(KEY, 1)), (2, 30, 20))
+        weeks.add(_week(3), {KEY: 30})
+        self.assertEqual((weeks.size, weeks.total(KEY), weeks.total(KEY, 2)), (4, 60, 30))
+
+    def test_weeks_written_one_slot_per_run_are_re_slotted(self):
+        starts = array('l', [_week(0).toordinal(), _week(1).toordinal(), _week(3).toordinal(), 0])
+        with open(self.filename, 'wb') as out:
+            pickle.dump((starts, {KEY: array('d', [10, 20, 30, 0])}, 2, 3), out)
+
+        weeks = RollingWeeks.from_file(self.filename, 4)
+        self.assertEqual((weeks.size, weeks.total(KEY), weeks.total(KEY, 2)), (4, 60, 30))
+        self.assertFalse(weeks.add(_week(2), {KEY: 5}))
+
+    def test_malformed_file(self):
+        with open(self.filename, 'wb') as out:
+            out.write('not weeks')
+        self.assertRaises(IOError, RollingWeeks.from_file, self.filename, 4)
+
+        weeks = RollingWeeks(self.filename, 4)
+        weeks.add(_week(0), {KEY: 10})
+        weeks.write_to_file()
+        self.assertRaises(IOError, RollingWeeks.from_file, self.filename, 52)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Checks that the message store keeps messages and complete threads apart for each account. Run from the repository root
+with
+python -m unittest discover tests
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+
+from tools.lib import store
+from tools.lib.store import MessageStore
+
+
+def _message(msg_id, thread_id, labels, date):
+    return {'X-GM-MSGID': msg_id, 'X-GM-THRID': thread_id, 'X-Gmail-Labels': labels, 'To': 'support@irbnet.org',
+            'From': 'user@example.com', 'Subject': 'Subject ' + thread_id, 'Date': date}
+
+
+FIRST = _message('m1', 't1', ['INBOX', 'Issue'], 'Wed, 03 Jan 2018 17:20:00 -0000')
+SECOND = _message('m2', 't1', ['INBOX'], 'Thu, 04 Jan 2018 09:00:00 -0000')
+OTHER = _message('m3', 't2', ['Training'], 'Wed, 03 Jan 2018 08:00:00 -0000')
+
+
+class MessageStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = MessageStore(':memory:')
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_add_get_and_remove(self):
+        self.assertTrue(self.store.is_empty('support'))
+        self.store.add('support', FIRST)
+        self.assertEqual(self.store.get('support', 'm1'), FIRST)
+        self.assertIsNone(self.store.get('gov_support', 'm1'))
+
+        self.store.add('support', dict(FIRST, Subject='Replaced'))
+        self.assertEqual(self.store.get('support', 'm1')['Subject'], 'Replaced')
+        self.store.remove('support', 'm1')
+        self.store.remove('support', 'missing')
+        self.assertIsNone(self.store.get('support', 'm1'))
+        self.assertTrue(self.store.is_empty('support'))
+
+    def test_update_labels(self):
+        self.store.add('support', FIRST)
+        self.store.update_labels('support', 'm1', added=['Training', 'INBOX'], removed=['Issue'])
+        self.assertEqual(self.store.get('support', 'm1')['X-Gmail-Labels'], ['INBOX', 'Training'])
+        self.store.update_labels('support', 'missing', added=['Issue'])
+        self.assertIsNone(self.store.get('support', 'missing'))
+
+    def test_thread_ids(self):
+        for message in [FIRST, SECOND, OTHER]:
+            self.store.add('support', message)
+        self.assertEqual(self.store.thread_ids('support'), set(['t1', 't2']))
+        self.assertEqual(self.store.thread_ids('support', 'INBOX'), set(['t1']))
+        self.assertEqual(self.store.thread_ids('gov_support'), set())
+
+    def test_put_thread_replaces_thread(self):
+        self.store.put_thread('support', 't1', 5, [SECOND, FIRST])
+        self.assertEqual(self.store.get_thread('support', 't1'), [FIRST, SECOND])
+        self.assertEqual(self.store.get_thread_history_id('support', 't1'), '5')
+        self.assertIsNone(self.store.get_thread_history_id('support', 't2'))
+
+        self.store.put_thread('support', 't1', 7, [SECOND])
+        self.assertEqual(self.store.get_thread('support', 't1'), [SECOND])
+        self.assertEqual(self.store.get_thread_history_id('support', 't1'), '7')
+
+    def test_get_messages_between(self):
+        for message in [FIRST, SECOND, OTHER]:
+            self.store.add('support', message)
+        messages = self.store.get_messages_between('support', datetime(2018, 1, 3), datetime(2018, 1, 4))
+        self.assertEqual(messages, [OTHER, FIRST])
+        messages = self.store.get_messages_between('support', datetime(2018, 1, 3, 17, 20), datetime(2018, 1, 5))
+        self.assertEqual(messages, [FIRST, SECOND])
+
+    def test_clear_only_clears_account(self):
+        self.store.put_thread('support', 't1', 5, [FIRST])
+        self.store.put_thread('gov_support', 't1', 5, [FIRST])
+        self.store.clear('support')
+        self.assertTrue(self.store.is_empty('support'))
+        self.assertIsNone(self.store.get_thread_history_id('support', 't1'))
+        self.assertEqual(self.store.get_thread('gov_support', 't1'), [FIRST])
+        self.assertEqual(self.store.get_thread_history_id('gov_support', 't1'), '5')
+
+
+class StoreFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self._dir, 'messages.db')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_messages_are_kept_between_runs(self):
+        message_store = MessageStore(self.filename)
+        message_store.put_thread('support', 't1', 5, [FIRST, SECOND])
+        message_store.close()
+
+        message_store = MessageStore(self.filename)
+        self.assertEqual(message_store.get_thread('support', 't1'), [FIRST, SECOND])
+        self.assertEqual(message_store.get_thread_history_id('support', 't1'), '5')
+        message_store.close()
+
+    def test_older_layout_is_discarded(self):
+        conn = sqlite3.connect(self.filename)
+        conn.execute("CREATE TABLE messages (id TEXT)")
+        conn.execute("INSERT INTO messages VALUES ('m1')")
+        conn.commit()
+        conn.close()
+
+        message_store = MessageStore(self.filename)
+        self.assertTrue(message_store.is_empty('support'))
+        message_store.add('support', FIRST)
+        self.assertEqual(message_store.get('support', 'm1'), FIRST)
+        message_store.close()
+
+        conn = sqlite3.connect(self.filename)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], store.SCHEMA_VERSION)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
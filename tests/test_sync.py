@@ -0,0 +1,134 @@
+"""
+Checks that sync keeps the message store up to date with a synthetic mailbox, including messages and threads deleted
+while they are being read. Run from the repository root with
+python -m unittest discover tests
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from tools.lib import fakeAPI, googleAPI, sync
+from tools.lib.store import MessageStore
+
+START = 1515000000  # Timestamp of the first message. 2018/01/03
+DAY_START = datetime.utcfromtimestamp(START)
+DAY_END = DAY_START + timedelta(days=1)
+
+
+class SyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._backoff_base = googleAPI.BACKOFF_BASE
+        self._request_stats = googleAPI.request_stats
+        # History ids and label maps are written to tools/ relative to the working directory.
+        self._dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._dir, 'tools'))
+        os.chdir(self._dir)
+        googleAPI.BACKOFF_BASE = 0
+        googleAPI.request_stats = googleAPI.RequestStats()
+        googleAPI._label_cache.clear()
+
+        self.mailbox = fakeAPI.Mailbox()
+        self.service = fakeAPI.FakeMailService(self.mailbox)
+        self.store = MessageStore(':memory:')
+        self.inbox = [self.add_message('t1', ['INBOX', 'Issue'], 0), self.add_message('t1', ['INBOX'], 1),
+                      self.add_message('t2', ['INBOX', 'Training'], 2)]
+        self.archived = self.add_message('t3', ['Issue'], 3)
+
+    def tearDown(self):
+        self.store.close()
+        os.chdir(self._cwd)
+        shutil.rmtree(self._dir)
+        googleAPI.BACKOFF_BASE = self._backoff_base
+        googleAPI.request_stats = self._request_stats
+        googleAPI._label_cache.clear()
+
+    def add_message(self, thread_id, label_names, hour):
+        return self.mailbox.add_message(thread_id, label_names, 'user@example.com', 'support@irbnet.org',
+                                        'Subject ' + thread_id, START + hour * 3600)
+
+    def stored_ids(self):
+        messages = self.store.get_messages_between('support', DAY_START, DAY_END)
+        return set(message['X-GM-MSGID'] for message in messages)
+
+    def dropped_ids(self, kind):
+        return [item_id for dropped_kind, item_id, reason in googleAPI.request_stats.dropped if dropped_kind == kind]
+
+    def test_first_sync_is_full(self):
+        self.assertFalse(sync.sync(self.service, self.store, ''))
+        self.assertEqual(self.stored_ids(), set(self.inbox))
+        self.assertEqual(sync.read_history_id(''), str(self.mailbox.history_id))
+
+    def test_changes_are_applied_incrementally(self):
+        sync.sync(self.service, self.store, '')
+        added = self.add_message('t4', ['INBOX'], 4)
+        self.mailbox.modify_labels(self.inbox[0], added=['Training'], removed=['Issue'])
+        self.mailbox.delete_message(self.inbox[1])
+        self.mailbox.modify_labels(self.archived, added=['INBOX'])
+
+        self.assertTrue(sync.sync(self.service, self.store, ''))
+        self.assertEqual(self.stored_ids(), set([self.inbox[0], self.inbox[2], added, self.archived]))
+        self.assertEqual(self.store.get('support', self.inbox[0])['X-Gmail-Labels'], ['INBOX', 'Training'])
+        self.assertEqual(sync.read_history_id(''), str(self.mailbox.history_id))
+
+    def test_expired_history_id_falls_back_to_full_sync(self):
+        sync.sync(self.service, self.store, '')
+        self.add_message('t4', ['INBOX'], 4)
+        self.add_message('t4', ['INBOX'], 5)
+        del self.mailbox.history[:-1]  # Records older than the last sync are no longer available.
+
+        self.assertFalse(sync.sync(self.service, self.store, ''))
+        self.assertEqual(len(self.stored_ids()), len(self.inbox) + 2)
+
+    def test_message_deleted_after_history_is_read(self):
+        sync.sync(self.service, self.store, '')
+        added = self.add_message('t4', ['INBOX'], 4)
+        list_history = self.service._list_history
+
+        def list_then_delete(**kwargs):
+            response = list_history(**kwargs)
+            if added in self.mailbox.messages:
+                self.mailbox.delete_message(added)
+            return response
+        self.service._list_history = list_then_delete
+
+        self.assertTrue(sync.sync(self.service, self.store, ''))
+        self.assertIsNone(self.store.get('support', added))
+        self.assertEqual(self.dropped_ids('message'), [added])
+        # The deletion itself is applied by the next sync without a full sync.
+        self.assertTrue(sync.sync(self.service, self.store, ''))
+        self.assertEqual(self.stored_ids(), set(self.inbox))
+
+    def test_thread_deleted_between_list_and_get(self):
+        for workers in [1, 2]:
+            googleAPI.request_stats = googleAPI.RequestStats()
+            self.store.clear(sync._cache_account(''))
+            threads = googleAPI.list_threads(self.service, 'me', '')
+            deleted = threads[0]['id']
+            for msg_id in list(self.mailbox.threads[deleted]):
+                self.mailbox.delete_message(msg_id)
+
+            fetched = dict(sync.iter_threads(self.service, self.store, '', threads, workers=workers,
+                                             service_factory=self.service.clone))
+            self.assertEqual(fetched.pop(deleted), [])
+            self.assertTrue(all(len(messages) > 0 for messages in fetched.values()))
+            self.assertEqual(self.dropped_ids('thread'), [deleted])
+            self.assertIsNone(self.store.get_thread_history_id(sync._cache_account(''), deleted))
+            self.add_message(deleted, ['INBOX'], 6)
+
+    def test_message_deleted_between_list_and_get(self):
+        labels = googleAPI.get_labels(self.service)
+        deleted = self.inbox[1]
+        self.mailbox.delete_message(deleted)
+
+        messages = googleAPI.get_messages_batch(self.service, 'me', self.inbox, labels)
+        self.assertEqual([message['X-GM-MSGID'] for message in messages], [self.inbox[0], self.inbox[2]])
+        self.assertEqual(self.dropped_ids('message'), [deleted])
+        self.assertEqual(googleAPI.request_stats.retries, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,7 +5,11 @@ ADMIN_SHEET_ID = 452292035
 MEMBER_STATS_SHEET = 'Member Stats'
 MEMBER_STATS_SHEET_ID = 1220379579
 WEEKLY_STATS_SPREADSHEET_ID = '12wQxfv5EOEEsi3zCFwwwAq05SAgvzXoHRZbD33-TQ3o'
+# Column of the Weekly Stats sheets the 52 week averages are written to (0 = A). The column is overwritten every run
+# so it must be a dedicated empty column before column C, where each week's stats are inserted. None to skip.
+WEEKLY_AVERAGE_COLUMN = None
 STATS_TO_ADDRESS = "andy@irbnet.org"
+INITIALS = ""  # Signs the stats email. Asked for if empty. Must be set to send the stats email in batch mode.
 ENROLLMENT_DASHBOARD_ID = '1g_EwipY4Yp1WXGrBhvw8Lly4fdieXSPaeiqTxnVGrpg'
 CURRENT_SHEET_ID = 991688453
 RETENTION_CALLS = 'Weekly_Check_In'
@@ -48,6 +52,12 @@ SPAM_EMAILS = ["MAILER-DAEMON@LNAPL005.HPHC.org", "Mail Delivery System",
 
 # Thread "open" Labels. If any label contains any of the below phrases it will be considered open.
 OPEN_LABELS = ["Waiting on", "TO DO", "To Call"]
+
+# Answers to "Should the following message be counted?" given without prompting. Each rule is (field, phrase, count)
+# where field is 'from' | 'to' | 'subject' | 'label'. A thread is counted if count is True and skipped if count is False
+# when the message field (or any message label) contains phrase. Rules are checked in order after the answers recorded
+# in tools/<file_base>decisions.txt. e.g. ("from", "techsupport@irbnet.org", True)
+DECISION_RULES = []
 VM_ADMIN = "vm/admin"
 VM_SALES = "vm/sales"
 VM_FINANCE = "vm/finance"
@@ -68,6 +78,19 @@ SKIP = False  # If True, skips thread counting
 TEST = False  # IF True, uses test sheets
 DEBUG = False  # IF True, outputs log files
 GOV = False  # IF True, only calculates gov statistics
+WORKERS = 1  # Number of threads fetched concurrently from GMail
+SYNC = False  # IF True, reads the Inbox from the local message store after syncing it with GMail history
+CACHE = False  # IF True, threads unchanged since they were last read are served from the local message store
+PARALLEL = False  # IF True, runs the support and gov pipelines at the same time
+ENGINE = 'loop'  # Engine used to count stats. 'loop' | 'columnar' (requires numpy)
+DEFER = None  # 'review' | 'file' Questionable threads are reviewed once every thread is read or written to a file
+BATCH = False  # IF True, stats run without asking for input. See util.prompt
+START = None  # MM/DD/YYYY Earliest date stats count. Asked for if None unless BATCH
+END = None  # MM/DD/YYYY Last date stats count (inclusive). Asked for if None unless BATCH
+REPORT = None  # File the JSON run report is written to
+WATCH = None  # Seconds between polls of the support inboxes. IF set, stats are kept up to date until interrupted
+FLUSH_INTERVAL = 3600  # Seconds between writes of watched member and admin stats to the Retention sheet
+BACKFILL = False  # IF True, every week between START and END is recounted from a single read of each inbox
 
 QUERY = " -label:no-reply -label:Report-Heartbeat -label:-googlespam -label:-180spam -label:WebEx " \
         "-label:-forwarded-to-govsupport -label:-spam"
@@ -0,0 +1,174 @@
+import datetime
+import zipfile
+
+from stats import StatCounter, count_value
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Stats are only archived if numpy is installed
+
+MEMBERS = 'members'  # Kind of the rows holding member stats
+
+
+class StatArchive(object):
+    """
+    Stats counted by every run kept as columns with one row per count. Rows of a stat dictionary have the dictionary's
+    name as their kind and an empty member. Member rows have the kind MEMBERS and hold the stats the member gained
+    during the week rather than the running totals written to the Member Stats tab so they can be averaged like any
+    other count. Columns are written to a compressed NumPy .npz file so the history of the counts can be read without
+    the Weekly Stats sheet.
+
+    Attributes:
+        filename: str
+            .npz file the archive is read from and written to.
+        start: numpy.ndarray
+            Ordinal of the first day of the week each row was counted for.
+        end: numpy.ndarray
+            Ordinal of the day after the week each row was counted for.
+        kind: numpy.ndarray
+            Stat dictionary name or MEMBERS.
+        stat: numpy.ndarray
+            Stat label.
+        member: numpy.ndarray
+            Member short name. Empty for stat dictionary rows.
+        value: numpy.ndarray
+            Count. NaN if the count was not a number i.e. calls that were not entered.
+    """
+    COLUMNS = ['start', 'end', 'kind', 'stat', 'member', 'value']
+
+    def __init__(self, filename=None):
+        """
+        Creates an empty archive.
+        :param filename: File the archive is written to. (default = None)
+        """
+        if numpy is None:
+            raise ImportError("numpy is required to archive stats")
+        self.filename = filename
+        self.start = numpy.zeros(0, 'int32')
+        self.end = numpy.zeros(0, 'int32')
+        self.kind = numpy.zeros(0, 'U1')
+        self.stat = numpy.zeros(0, 'U1')
+        self.member = numpy.zeros(0, 'U1')
+        self.value = numpy.zeros(0, 'float64')
+
+    def __len__(self):
+        return len(self.value)
+
+    def add_run(self, start_date, end_date, stat_counter, member_data=None, stat_labels=None, start_stats=None):
+        """
+        Adds the counts of a run. Rows of an earlier run for the same week are replaced so a week can be re-run.
+        :param start_date: Earliest date for which stats were counted.
+        :param end_date: Date stats stopped counting (exclusive)
+        :param stat_counter: formatted StatCounter
+        :param member_data: member dictionary with (k,v) = (name, Member() object) with the week's stats added
+                            (default = None: no member rows)
+        :param stat_labels: labels of the member stats in the order they are kept by each Member
+        :param start_stats: dictionary (k,v) = (name, list of the member's stats before the week). Required with
+                            member_data. Members missing from it are new and started the week without stats.
+        :return: None
+        :raise ValueError: if member_data is given without start_stats
+        """
+        if member_data is not None and start_stats is None:
+            raise ValueError("start_stats are required to archive member stats")
+
+        rows = []
+        for name in StatCounter.DICTIONARIES:
+            for stat, value in getattr(stat_counter, name).iteritems():
+                rows.append((name, stat, u'', count_value(value.get_count(), float('nan'))))
+        if member_data is not None:
+            for mem in member_data.itervalues():
+                before = start_stats.get(mem.name) or [0] * len(mem.get_stats())
+                for stat, value, start in zip(stat_labels, mem.get_stats(), before):
+                    rows.append((MEMBERS, stat, mem.name, value - start))
+
+        start = start_date.toordinal()
+        keep = self.start != start
+        kinds, stats, members, values = zip(*rows) if rows else ((), (), (), ())
+        self.start = numpy.concatenate([self.start[keep], numpy.full(len(rows), start, 'int32')])
+        self.end = numpy.concatenate([self.end[keep], numpy.full(len(rows), end_date.toordinal(), 'int32')])
+        self.kind = numpy.concatenate([self.kind[keep], numpy.array(kinds, 'U')])
+        self.stat = numpy.concatenate([self.stat[keep], numpy.array(stats, 'U')])
+        self.member = numpy.concatenate([self.member[keep], numpy.array(members, 'U')])
+        self.value = numpy.concatenate([self.value[keep], numpy.array(values, 'float64')])
+
+    def _select(self, start_date=None, end_date=None, stat=None, member=None, kind=None):
+        """
+        :return: indexes of the rows matching every given filter ordered by week. See query.
+        """
+        mask = numpy.ones(len(self), bool)
+        if start_date is not None:
+            mask &= self.start >= start_date.toordinal()
+        if end_date is not None:
+            mask &= self.start < end_date.toordinal()
+        if stat is not None:
+            mask &= self.stat == stat
+        if member is not None:
+            mask &= self.member == member
+        if kind is not None:
+            mask &= self.kind == kind
+        rows = numpy.nonzero(mask)[0]
+        return rows[numpy.argsort(self.start[rows], kind='mergesort')]
+
+    def query(self, start_date=None, end_date=None, stat=None, member=None, kind=None):
+        """
+        Finds the counts matching every given filter.
+        :param start_date: earliest week start included (default = None: every week)
+        :param end_date: weeks starting on or after end_date are excluded (default = None: every week)
+        :param stat: stat label (default = None: every stat)
+        :param member: member short name (default = None: every row)
+        :param kind: stat dictionary name or MEMBERS (default = None: every kind)
+        :return: list of (week start date, week end date, kind, stat, member, value) ordered by week
+        """
+        return [(datetime.date.fromordinal(int(self.start[i])), datetime.date.fromordinal(int(self.end[i])),
+                 unicode(self.kind[i]), unicode(self.stat[i]), unicode(self.member[i]), float(self.value[i]))
+                for i in self._select(start_date, end_date, stat, member, kind)]
+
+    def series(self, stat, kind=None, member=u'', start_date=None, end_date=None):
+        """
+        :param stat: stat label
+        :param kind: stat dictionary name or MEMBERS (default = None: any kind)
+        :param member: member short name (default = u'': stat dictionary rows)
+        :param start_date: earliest week start included (default = None: every week)
+        :param end_date: weeks starting on or after end_date are excluded (default = None: every week)
+        :return: (list of week start dates, numpy array of counts) of the stat ordered by week
+        """
+        rows = self._select(start_date, end_date, stat, member, kind)
+        return [datetime.date.fromordinal(int(start)) for start in self.start[rows]], self.value[rows]
+
+    def average(self, stat, kind=None, member=u'', start_date=None, end_date=None):
+        """
+        :return: float average weekly count of the stat or None if the stat was not counted. See series.
+        """
+        weeks, values = self.series(stat, kind, member, start_date, end_date)
+        values = values[~numpy.isnan(values)]
+        if len(values) == 0:
+            return None
+        return float(values.mean())
+
+    def write_to_file(self):
+        with open(self.filename, 'wb') as out:
+            numpy.savez_compressed(out, **dict((name, getattr(self, name)) for name in StatArchive.COLUMNS))
+
+    @staticmethod
+    def from_file(filename):
+        """
+        Reads the archive written to filename. A missing file is treated as an empty archive.
+        :param filename: .npz file the archive is read from and written to.
+        :return: StatArchive
+        :raise: IOError if the file is not an archive
+        """
+        archive = StatArchive(filename)
+        try:
+            file_in = open(filename, 'rb')
+        except IOError:
+            return archive
+        with file_in:
+            try:
+                with numpy.load(file_in) as data:
+                    for name in StatArchive.COLUMNS:
+                        setattr(archive, name, data[name])
+            except (KeyError, ValueError, zipfile.BadZipfile):
+                raise IOError("Error: " + filename + " not properly formatted.")
+        if len(set(len(getattr(archive, name)) for name in StatArchive.COLUMNS)) != 1:
+            raise IOError("Error: " + filename + " columns do not have the same length.")
+        return archive
@@ -0,0 +1,550 @@
+import calendar
+import random
+import threading
+from datetime import datetime, timedelta
+from email.utils import formatdate
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from tools import config
+
+# Stat labels found on the Member Stats tab. format_stats requires every label it combines to be present.
+STAT_LABELS = ["Issue", "System Access Issue", "Issue/PDF", "Change Request", "Change Request - Access Level",
+               "CITI Integration", "CITI Interface Errors", "Training", "Forms", "Submissions", "Reports",
+               "Welcome to Support", "Welcome Ping", "Sales"]
+
+# (label, weight) Thread types and their share of a typical week of Support mail.
+THREAD_TYPES = [(None, 12), ("stat", 55), (config.PING_INQUIRY, 10), (config.PING_DEMO, 4),
+                (config.PING_SUPPORT, 8), (config.SALES_PING, 3), (config.NEW_ORG, 2), (config.VM_RESEARCHER, 3),
+                (config.VM_ADMIN, 1), (config.VM_SALES, 1), (config.VM_FINANCE, 1)]
+
+MEMBER_RATE = 0.3  # Share of threads labeled with a member
+CHECK_IN_RATE = 0.05
+OPEN_RATE = 0.1
+INBOX_RATE = 0.15
+INTERNAL_RATE = 0.03  # Share of threads containing a message from an internal address.
+SPAM_RATE = 0.01
+ADMIN_RATE = 0.05  # Share of researcher threads started by a member's admin.
+EARLY_RATE = 0.05  # Share of threads started before the window which should not count.
+MAX_THREAD_LENGTH = 6
+
+PAGE_SIZE = 100  # Default maxResults of the list methods.
+DOMAIN = 'irbnet.org'
+
+
+def _label_name_to_query(name):
+    """
+    :param name: label name
+    :return: label name as written in a GMail query (i.e. 'vm/admin' -> 'vm-admin')
+    """
+    return name.lower().replace(' ', '-').replace('/', '-')
+
+
+def _http_error(status, reason):
+    response = httplib2.Response({'status': status})
+    response.reason = reason
+    return HttpError(response, '{"error": {"errors": [{"reason": "%s"}]}}' % reason)
+
+
+class FakeRequest(object):
+    """
+    Stands in for a googleapiclient HttpRequest. The response is built when the request is executed.
+
+    Attributes:
+        methodId: str
+            Discovery method id (i.e. fake.users.threads.get). Requests are only rate limited by googleAPI if the
+            prefix names a limited api.
+    """
+
+    def __init__(self, service, method_id, build):
+        self._service = service
+        self._build = build
+        self.methodId = service.api + '.' + method_id
+
+    def execute(self):
+        self._service.record_call(self.methodId)
+        if self._service.error_rate > 0 and self._service.random.random() < self._service.error_rate:
+            raise _http_error(503, 'backendError')
+        return self._build()
+
+
+class FakeBatch(object):
+    """
+    Stands in for a googleapiclient BatchHttpRequest. Requests are executed in the order they were added.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request.execute(), None
+            except HttpError, e:
+                response, exception = None, e
+            callback(request_id, response, exception)
+
+
+class _Resource(object):
+    """
+    Collection of fake methods. Attribute access returns either a nested collection or a method.
+    """
+
+    def __init__(self, service, path, methods):
+        self._service = service
+        self._path = path
+        self._methods = methods
+
+    def __getattr__(self, name):
+        if name not in self._methods:
+            raise AttributeError(name)
+        method = self._methods[name]
+        if isinstance(method, dict):
+            return lambda: _Resource(self._service, self._path + '.' + name, method)
+
+        def call(**kwargs):
+            return FakeRequest(self._service, self._path + '.' + name, lambda: method(**kwargs))
+        return call
+
+
+class FakeService(object):
+    """
+    Common behaviour of the fake services.
+
+    Attributes:
+        api: str
+            Prefix of every method id. Use 'gmail' or 'sheets' to apply googleAPI's quota limits. (default = 'fake')
+        error_rate: float
+            Share of requests which fail with a retryable 503 error.
+        calls: dict
+            Number of requests executed keyed by method id.
+    """
+
+    def __init__(self, api='fake', error_rate=0.0, seed=0):
+        self.api = api
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls = {}
+        self._calls_lock = threading.Lock()
+
+    def record_call(self, method_id):
+        with self._calls_lock:
+            self.calls[method_id] = self.calls.get(method_id, 0) + 1
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(callback)
+
+
+class Mailbox(object):
+    """
+    A synthetic GMail mailbox. Messages are held as tuples and only converted into API resources when requested so
+    large mailboxes can be generated.
+
+    Attributes:
+        labels: dict
+            (key, value) = (label id, label name)
+        messages: dict
+            (key, value) = (message id, (thread id, label ids, from, to, subject, date, timestamp))
+        threads: dict
+            (key, value) = (thread id, list of message ids in date order)
+        history_id: int
+            Current mailbox history id.
+        history: list
+            History records in chronological order.
+    """
+
+    def __init__(self):
+        self.labels = {'INBOX': 'INBOX', 'SENT': 'SENT', 'UNREAD': 'UNREAD'}
+        self._label_ids = dict((name, label_id) for label_id, name in self.labels.items())
+        self.messages = {}
+        self.threads = {}
+        self.thread_history = {}
+        self.history_id = 1
+        self.history = []
+        self._message_count = 0  # Messages ever added so ids are never reused after a deletion
+        self.lock = threading.RLock()
+        self._searches = {}
+
+    def label_id(self, name):
+        """
+        :param name: label name
+        :return: id of the label, creating the label if it does not exist.
+        """
+        if name not in self._label_ids:
+            label_id = 'Label_' + str(len(self.labels))
+            self.labels[label_id] = name
+            self._label_ids[name] = label_id
+        return self._label_ids[name]
+
+    def add_message(self, thread_id, label_names, from_address, to, subject, timestamp, record=True):
+        """
+        Adds a message and records it in the mailbox history.
+        :param record: False if the message should not be added to the history (default = True)
+        :return: str message id
+        """
+        with self.lock:
+            msg_id = format(self._message_count + 0x10000000000, 'x')
+            self._message_count += 1
+            label_ids = tuple(self.label_id(name) for name in label_names)
+            self.messages[msg_id] = (thread_id, label_ids, from_address, to, subject,
+                                     formatdate(timestamp), timestamp)
+            self.threads.setdefault(thread_id, []).append(msg_id)
+            self.history_id += 1
+            self.thread_history[thread_id] = self.history_id
+            if record:
+                self.history.append({'id': str(self.history_id),
+                                     'messagesAdded': [{'message': {'id': msg_id, 'threadId': thread_id,
+                                                                    'labelIds': list(label_ids)}}]})
+            return msg_id
+
+    def modify_labels(self, msg_id, added=(), removed=()):
+        """
+        Adds and removes labels from a message and records the change in the mailbox history.
+        :param msg_id: message id
+        :param added: label names to add
+        :param removed: label names to remove
+        :return: None
+        """
+        with self.lock:
+            thread_id, label_ids, from_address, to, subject, date, timestamp = self.messages[msg_id]
+            added_ids = [self.label_id(name) for name in added]
+            removed_ids = [self.label_id(name) for name in removed]
+            label_ids = tuple(l for l in label_ids if l not in removed_ids) + \
+                tuple(l for l in added_ids if l not in label_ids)
+            self.messages[msg_id] = (thread_id, label_ids, from_address, to, subject, date, timestamp)
+            self.history_id += 1
+            self.thread_history[thread_id] = self.history_id
+            record = {'id': str(self.history_id)}
+            if len(added_ids) > 0:
+                record['labelsAdded'] = [{'message': {'id': msg_id}, 'labelIds': added_ids}]
+            if len(removed_ids) > 0:
+                record['labelsRemoved'] = [{'message': {'id': msg_id}, 'labelIds': removed_ids}]
+            self.history.append(record)
+
+    def delete_message(self, msg_id, record=True):
+        """
+        Permanently deletes a message and records the deletion in the mailbox history. Threads without messages are
+        deleted along with their last message.
+        :param msg_id: message id
+        :param record: False if the deletion should not be added to the history (default = True)
+        :return: None
+        """
+        with self.lock:
+            thread_id = self.messages.pop(msg_id)[0]
+            self.threads[thread_id].remove(msg_id)
+            self.history_id += 1
+            if len(self.threads[thread_id]) == 0:
+                del self.threads[thread_id]
+                del self.thread_history[thread_id]
+            else:
+                self.thread_history[thread_id] = self.history_id
+            if record:
+                self.history.append({'id': str(self.history_id),
+                                     'messagesDeleted': [{'message': {'id': msg_id, 'threadId': thread_id}}]})
+
+    def matches(self, msg_id, query):
+        """
+        Checks a message against the subset of GMail search operators used by stats: label:, -label:, after: and
+        before:. Other terms are ignored.
+        :param msg_id: message id
+        :param query: GMail query
+        :return: True if the message matches every supported term.
+        """
+        thread_id, label_ids, from_address, to, subject, date, timestamp = self.messages[msg_id]
+        names = set(_label_name_to_query(self.labels[l]) for l in label_ids)
+        for term in query.split():
+            if term.startswith('label:'):
+                if term[len('label:'):].lower() not in names:
+                    return False
+            elif term.startswith('-label:'):
+                if term[len('-label:'):].lower() in names:
+                    return False
+            elif term.startswith('after:') or term.startswith('before:'):
+                operator, day = term.split(':', 1)
+                bound = calendar.timegm(datetime.strptime(day, '%Y/%m/%d').timetuple())
+                if (operator == 'after' and timestamp < bound) or (operator == 'before' and timestamp >= bound):
+                    return False
+        return True
+
+    def search(self, kind, query, find):
+        """
+        Returns the result of a search, only searching again if the mailbox has changed since the same search was
+        last made. Each page of a listing would otherwise search the whole mailbox.
+        :param kind: 'messages' or 'threads'
+        :param query: GMail query
+        :param find: function returning the search result
+        :return: the search result
+        """
+        with self.lock:
+            key = (kind, query, self.history_id)
+            if key not in self._searches:
+                self._searches.clear()
+                self._searches[key] = find()
+            return self._searches[key]
+
+    def message_resource(self, msg_id, headers=None):
+        """
+        :param msg_id: message id
+        :param headers: header names to include (default = None: all headers)
+        :return: message resource in 'metadata' format
+        """
+        thread_id, label_ids, from_address, to, subject, date, timestamp = self.messages[msg_id]
+        values = [('From', from_address), ('To', to), ('Subject', subject), ('Date', date)]
+        return {'id': msg_id, 'threadId': thread_id, 'labelIds': list(label_ids),
+                'historyId': str(self.thread_history[thread_id]), 'internalDate': str(timestamp * 1000),
+                'payload': {'headers': [{'name': name, 'value': value} for name, value in values
+                                        if headers is None or name in headers]}}
+
+
+class FakeMailService(FakeService):
+    """
+    In-process stand-in for the GMail discovery service used by googleAPI. Supports users.getProfile and the list and
+    get methods of users.threads, users.messages, users.labels and users.history along with batch requests.
+    Services sharing a Mailbox may be used by concurrent fetch workers.
+    """
+
+    def __init__(self, mailbox, api='fake', error_rate=0.0, seed=0):
+        FakeService.__init__(self, api, error_rate, seed)
+        self.mailbox = mailbox
+
+    def clone(self):
+        """
+        :return: a new service for the same mailbox. Used as a googleAPI service factory.
+        """
+        return FakeMailService(self.mailbox, self.api, self.error_rate, self.random.random())
+
+    def users(self):
+        return _Resource(self, 'users', {
+            'getProfile': self._get_profile,
+            'labels': {'list': self._list_labels},
+            'messages': {'list': self._list_messages, 'get': self._get_message},
+            'threads': {'list': self._list_threads, 'get': self._get_thread},
+            'history': {'list': self._list_history},
+            'drafts': {'create': self._create_draft, 'send': self._send_draft},
+        })
+
+    @staticmethod
+    def _page(items, key, page_token, max_results):
+        start = int(page_token or 0)
+        response = {key: items[start:start + max_results], 'resultSizeEstimate': len(items)}
+        if start + max_results < len(items):
+            response['nextPageToken'] = str(start + max_results)
+        return response
+
+    def _get_profile(self, userId):
+        return {'emailAddress': config.SUPPORT_EMAIL, 'messagesTotal': len(self.mailbox.messages),
+                'threadsTotal': len(self.mailbox.threads), 'historyId': str(self.mailbox.history_id)}
+
+    def _list_labels(self, userId):
+        return {'labels': [{'id': label_id, 'name': name} for label_id, name in self.mailbox.labels.items()]}
+
+    def _list_messages(self, userId, q='', pageToken=None, maxResults=PAGE_SIZE):
+        messages = self.mailbox.search('messages', q, lambda: [
+            {'id': msg_id, 'threadId': self.mailbox.messages[msg_id][0]}
+            for msg_id in sorted(self.mailbox.messages, reverse=True) if self.mailbox.matches(msg_id, q)])
+        return FakeMailService._page(messages, 'messages', pageToken, maxResults)
+
+    def _get_message(self, userId, id, format='full', metadataHeaders=None):
+        with self.mailbox.lock:
+            if id not in self.mailbox.messages:
+                raise _http_error(404, 'notFound')
+            return self.mailbox.message_resource(id, metadataHeaders)
+
+    def _list_threads(self, userId, q='', pageToken=None, maxResults=PAGE_SIZE):
+        def search():
+            # Most recently updated threads are listed first.
+            return [{'id': thread_id, 'snippet': '', 'historyId': str(self.mailbox.thread_history[thread_id])}
+                    for thread_id in sorted(self.mailbox.threads, key=lambda t: self.mailbox.thread_history[t],
+                                            reverse=True)
+                    if any(self.mailbox.matches(msg_id, q) for msg_id in self.mailbox.threads[thread_id])]
+        threads = self.mailbox.search('threads', q, search)
+        return FakeMailService._page(threads, 'threads', pageToken, maxResults)
+
+    def _get_thread(self, userId, id, format='full', metadataHeaders=None):
+        with self.mailbox.lock:
+            if id not in self.mailbox.threads:
+                raise _http_error(404, 'notFound')
+            return {'id': id, 'historyId': str(self.mailbox.thread_history[id]),
+                    'messages': [self.mailbox.message_resource(msg_id, metadataHeaders)
+                                 for msg_id in self.mailbox.threads[id]]}
+
+    def _list_history(self, userId, startHistoryId, pageToken=None, maxResults=PAGE_SIZE):
+        with self.mailbox.lock:
+            start = int(startHistoryId)
+            if len(self.mailbox.history) > 0 and start < int(self.mailbox.history[0]['id']) - 1:
+                raise _http_error(404, 'notFound')
+            records = [record for record in self.mailbox.history if int(record['id']) > start]
+            response = FakeMailService._page(records, 'history', pageToken, maxResults)
+            response['historyId'] = str(self.mailbox.history_id)
+        return response
+
+    def _create_draft(self, userId, body):
+        return {'id': 'draft', 'message': body['message']}
+
+    def _send_draft(self, userId, body):
+        return {'id': body['id']}
+
+
+def _column(rows, i):
+    return [row[i] if i < len(row) else '' for row in rows]
+
+
+class FakeSheetsService(FakeService):
+    """
+    In-process stand-in for the Sheets discovery service used by googleAPI. Ranges are looked up by the exact A1 or
+    named range string they were added with. Every batch update is recorded rather than applied.
+
+    Attributes:
+        ranges: dict
+            (key, value) = ((spreadsheet id, range), rows)
+        updates: list
+            (spreadsheet id, request body) of every write made.
+    """
+
+    def __init__(self, api='fake', error_rate=0.0, seed=0):
+        FakeService.__init__(self, api, error_rate, seed)
+        self.ranges = {}
+        self.updates = []
+
+    def set_range(self, spreadsheet_id, rng, rows):
+        self.ranges[(spreadsheet_id, rng)] = rows
+
+    def spreadsheets(self):
+        return _Resource(self, 'spreadsheets', {
+            'get': self._get,
+            'batchUpdate': self._batch_update,
+            'values': {'get': self._get_values, 'update': self._update_values, 'batchClear': self._batch_clear},
+        })
+
+    def _get(self, spreadsheetId, ranges=None):
+        return {'spreadsheetId': spreadsheetId, 'namedRanges': []}
+
+    def _batch_update(self, spreadsheetId, body):
+        self.updates.append((spreadsheetId, body))
+        return {'spreadsheetId': spreadsheetId, 'replies': [{} for _ in body['requests']]}
+
+    def _get_values(self, spreadsheetId, range, majorDimension='ROWS'):
+        if (spreadsheetId, range) not in self.ranges:
+            raise _http_error(400, 'badRequest')
+        rows = self.ranges[(spreadsheetId, range)]
+        if majorDimension == 'COLUMNS':
+            rows = [_column(rows, i) for i in xrange(max([len(row) for row in rows] + [0]))]
+        return {'range': range, 'majorDimension': majorDimension, 'values': rows}
+
+    def _update_values(self, spreadsheetId, range, body, valueInputOption, responseValueRenderOption=None):
+        self.updates.append((spreadsheetId, {'range': range, 'values': body['values']}))
+        return {'updatedRange': range}
+
+    def _batch_clear(self, spreadsheetId, body):
+        self.updates.append((spreadsheetId, body))
+        return {'clearedRanges': body['ranges']}
+
+
+def member_names(count):
+    return ['Member ' + format(i, '03d') for i in range(count)]
+
+
+def admin_email(i):
+    return 'admin' + str(i) + '@university.edu'
+
+
+def build_mailbox(message_count, start, end, members, seed=0):
+    """
+    Generates a Support mailbox whose threads follow THREAD_TYPES and whose labels are taken from config. The generated
+    messages are not recorded in the mailbox history.
+    :param message_count: approximate number of messages generated
+    :param start: datetime start of the week being counted
+    :param end: datetime end of the week being counted (exclusive)
+    :param members: list of member labels
+    :param seed: random seed. The same seed always generates the same mailbox. (default = 0)
+    :return: Mailbox
+    """
+    rnd = random.Random(seed)
+    mailbox = Mailbox()
+    types = [t for t, weight in THREAD_TYPES for _ in range(weight)]
+    start_time = calendar.timegm(start.utctimetuple())
+    span = calendar.timegm(end.utctimetuple()) - start_time
+
+    count = 0
+    thread_number = 0
+    while count < message_count:
+        thread_type = rnd.choice(types)
+        length = min(rnd.randint(1, MAX_THREAD_LENGTH), message_count - count)
+        labels = []
+        subject = 'Question ' + str(thread_number)
+        sender = 'researcher' + str(rnd.randint(0, 5000)) + '@university.edu'
+
+        if thread_type == 'stat':
+            labels.extend(rnd.sample(STAT_LABELS, rnd.choice([1, 1, 1, 2])))
+        elif thread_type is not None:
+            labels.append(thread_type)
+            if thread_type.startswith('pings') or thread_type == config.SALES_PING:
+                sender = config.PING_EMAIL
+                subject = rnd.choice(['IRBNet Inquiry From ', 'IRBNet Demo Request ']) + str(thread_number)
+        if sender != config.PING_EMAIL and rnd.random() < ADMIN_RATE:
+            sender = admin_email(rnd.randrange(len(members)))
+        if rnd.random() < MEMBER_RATE:
+            labels.append(rnd.choice(members))
+        if rnd.random() < CHECK_IN_RATE:
+            labels.append(config.CHECK_IN)
+        if rnd.random() < OPEN_RATE:
+            labels.append(rnd.choice(config.OPEN_LABELS) + ' Researcher')
+        if rnd.random() < INBOX_RATE:
+            labels.append('INBOX')
+        if rnd.random() < SPAM_RATE:
+            sender = rnd.choice(config.SPAM_EMAILS)
+
+        thread_time = start_time + rnd.randint(0, span - 1)
+        if rnd.random() < EARLY_RATE:
+            thread_time -= span
+        internal = rnd.random() < INTERNAL_RATE
+        thread_id = format(0x10000000000 + thread_number, 'x')
+        for i in range(length):
+            if i % 2 == 0:
+                from_address, to = sender, config.SUPPORT_EMAIL
+            else:
+                from_address, to = config.SUPPORT_EMAIL, sender
+            if internal and i == length - 1:
+                from_address = 'staff@' + DOMAIN
+            mailbox.add_message(thread_id, labels, from_address, to, subject,
+                                thread_time + i * rnd.randint(60, 6 * 60 * 60), False)
+        count += length
+        thread_number += 1
+
+    return mailbox
+
+
+def build_sheets(members, stat_labels=STAT_LABELS, seed=0):
+    """
+    Builds a Sheets service holding the Retention sheet ranges read by support_stats.
+    :param members: list of member names
+    :param stat_labels: stat labels in Member Stats header order (default = STAT_LABELS)
+    :param seed: random seed (default = 0)
+    :return: FakeSheetsService
+    """
+    rnd = random.Random(seed)
+    sheets = FakeSheetsService()
+    last_week = datetime(2018, 1, 1) - timedelta(days=7)
+
+    rows = [['Name', 'Last Contact', 'Check In'] + stat_labels]
+    for name in members:
+        contact = last_week.strftime('%m/%d/%Y') if rnd.random() < 0.8 else ''
+        rows.append([name, contact, ''] + [str(rnd.randint(0, 50)) for _ in stat_labels])
+    for rng in [config.MEMBER_STATS_SHEET, config.GOV_MEMBER_STATS_SHEET]:
+        sheets.set_range(config.RETENTION_SPREADSHEET_ID, rng, rows)
+    for rng in [config.SHORT_NAME_RANGE, config.GOV_SHORT_NAME_RANGE]:
+        sheets.set_range(config.RETENTION_SPREADSHEET_ID, rng, [[name] for name in members])
+
+    admins = [['Org', 'Name', 'Phone', 'Title', 'Check In', 'Last Contact', 'Email 1', 'Email 2', 'Email 3']]
+    for i in range(len(members)):
+        admins.append([members[i], 'Admin ' + str(i), '', '', '', '',
+                       admin_email(i), '', ''])
+    sheets.set_range(config.RETENTION_SPREADSHEET_ID, config.ADMIN_SHEET, admins)
+    sheets.set_range(config.RETENTION_SPREADSHEET_ID, config.RETENTION_CALLS, [['12']])
+    sheets.set_range(config.ENROLLMENT_DASHBOARD_ID, 'Call_Info', [['10', '4', '2', 'Example University']])
+    return sheets
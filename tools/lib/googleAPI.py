@@ -1,14 +1,21 @@
 import os
 import base64
+import collections
+import itertools
+import json
 import pickle
-import traceback
+import random
+import socket
+import time
+import threading
 from ssl import SSLError
+from multiprocessing.pool import ThreadPool
 
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.auth.exceptions import RefreshError
 
-from util import print_error
+from util import print_error, prompt
 try:
     from google_auth_oauthlib.flow import InstalledAppFlow
     from google.auth.transport.requests import Request
@@ -30,6 +37,43 @@ GOV_SUPPORT_SCOPE = ['https://www.googleapis.com/auth/gmail.readonly']
 CLIENT_SECRET_FILE = 'tools/client_secret.json'
 APPLICATION_NAME = 'Google API for Stats'
 
+METADATA_HEADERS = ['From', 'To', 'Date', 'Subject']
+MAX_BATCH_SIZE = 100  # Maximum number of calls accepted by the GMail API in a single batch request.
+FETCH_AHEAD = 2  # Threads each fetch worker may download ahead of the thread being processed.
+
+LABEL_CACHE_FILE = 'tools/{account}_labels.pickle'
+LABEL_CACHE_TTL = 24 * 60 * 60  # Seconds a cached label map is used before it is read from GMail again.
+
+# Holds the service object owned by each fetch worker thread.
+_worker = threading.local()
+
+# Label maps read this run keyed by (account, user_id)
+_label_cache = {}
+_label_cache_lock = threading.Lock()
+
+MAX_RETRIES = 5  # Number of times a failed request is retried before giving up.
+BACKOFF_BASE = 1  # Seconds. Maximum wait before the first retry. Doubles with every further retry.
+BACKOFF_CAP = 64  # Seconds. Maximum wait before any retry.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+MISSING_STATUSES = (404, 410)  # The item was deleted after it was listed
+
+# Per user quota of each api as (quota units per second, burst size). GMail allows 250 units per second. Sheets
+# allows 60 requests per minute.
+QUOTA_RATES = {'gmail': (250, 250), 'sheets': (1, 60)}
+# Quota units used by each GMail method. Methods not listed use 1 unit.
+QUOTA_COSTS = {
+    'gmail.users.getProfile': 1,
+    'gmail.users.labels.list': 1,
+    'gmail.users.history.list': 2,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.list': 5,
+    'gmail.users.threads.get': 10,
+    'gmail.users.threads.list': 10,
+    'gmail.users.drafts.create': 10,
+    'gmail.users.drafts.send': 100,
+}
+
 
 def _get_credentials(account_type, scope):
     """
@@ -61,13 +105,13 @@ def _get_credentials(account_type, scope):
             except RefreshError, e:
                 # Catch any problems refreshing the existing credential. This will not catch refresh errors if the
                 # user has changed their password in the last six hours. Manually delete the credential in those cases.
-                raw_input("Unable to authenticate. Deleting existing credential. Please re-authenticate: " +
-                          account_type + ". Press enter to continue with authentication.")
+                prompt("Unable to authenticate. Deleting existing credential. Please re-authenticate: " +
+                       account_type + ". Press enter to continue with authentication.")
                 os.remove(credential_path)
                 raise e
         else:
-            raw_input("You will now be asked to authenticate access for a " + account_type + " google account."
-                      "Please log into the appropriate account when prompted. Press enter to continue.")
+            prompt("You will now be asked to authenticate access for a " + account_type + " google account."
+                   "Please log into the appropriate account when prompted. Press enter to continue.")
             flow = InstalledAppFlow.from_client_secrets_file(
                 CLIENT_SECRET_FILE, scope)
             creds = flow.run_local_server()
@@ -88,6 +132,22 @@ def remove_credentials(account_type):
     os.remove(credential_path)
 
 
+def _get_valid_credentials(account_type, scope, timeout):
+    """
+    Gets valid user credentials, retrying the authentication up to timeout times. See _get_credentials.
+    :param account_type: ['personal', 'support', 'gov'] specifies account for which credentials should be obtained
+    :param scope: Access scope for the api service
+    :param timeout: number of attempts to access the api
+    :return: Credentials, the obtained credential.
+    """
+    if timeout == 0:
+        raise RuntimeError("Unable to obtain authentication credentials. Please contact Stephan")
+    try:
+        return _get_credentials(account_type, scope)
+    except RefreshError:
+        return _get_valid_credentials(account_type, scope, timeout - 1)
+
+
 def get_api(name, version, account_type, scope, timeout):
     """
     Retrieves the specified google api for the specified account type
@@ -98,13 +158,228 @@ def get_api(name, version, account_type, scope, timeout):
     :param timeout: number of attempts to access the api
     :return: google api service. If an invalid type is provided None is returned.
     """
+    return build(name, version, credentials=_get_valid_credentials(account_type, scope, timeout))
 
-    if timeout == 0:
-        raise RuntimeError("Unable to obtain authentication credentials. Please contact Stephan")
+
+def get_api_factory(name, version, account_type, scope, timeout):
+    """
+    Creates a function which builds a new service for the specified api and account type. Service objects are not
+    thread-safe so each worker thread must build its own. The credentials are obtained once by the calling thread so
+    workers never read, refresh or rewrite the stored token.
+    :param name: name of the api being requested (i.e. gmail, sheets)
+    :param version: version of the requested api
+    :param account_type: ['personal', 'support', 'gov'] specifies account for which api should be obtained
+    :param scope: Access scope for the api service
+    :param timeout: number of attempts to access the api
+    :return: function taking no arguments that returns a new google api service
+    """
+    credentials = _get_valid_credentials(account_type, scope, timeout)
+
+    def factory():
+        return build(name, version, credentials=credentials)
+    return factory
+
+
+class TokenBucket(object):
+    """
+    Limits the rate at which quota units are used. The bucket holds up to capacity units and is refilled at rate units
+    per second. Requests wait until enough units are available.
+
+    Attributes:
+        rate: float
+            Units added to the bucket per second.
+        capacity: float
+            Maximum number of units held by the bucket.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost):
+        """
+        Waits until cost units are available and removes them from the bucket. A cost larger than the bucket's capacity
+        waits for a full bucket and leaves the bucket in debt so later requests wait for the difference.
+        :param cost: quota units used by the request
+        :return: None
+        """
+        needed = min(cost, self.capacity)
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= cost
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RequestStats(object):
+    """
+    Counts the api requests made during a run and records every item which could not be retrieved.
+
+    Attributes:
+        requests: int
+            Number of api calls made including retries. Each call in a batch is counted.
+        retries: int
+            Number of api calls that were retried.
+        failures: int
+            Number of api calls that failed after all retries.
+        dropped: list((str, str, str))
+            (kind, id, reason) of every message or thread that could not be retrieved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.dropped = []
+
+    def add_requests(self, count=1):
+        with self._lock:
+            self.requests += count
+
+    def add_retries(self, count=1):
+        with self._lock:
+            self.retries += count
+
+    def add_failures(self, count=1):
+        with self._lock:
+            self.failures += count
+
+    def add_dropped(self, kind, item_id, reason):
+        """
+        Records an item that could not be retrieved and will not be counted.
+        :param kind: 'message' or 'thread'
+        :param item_id: GMail id of the item
+        :param reason: why the item was dropped
+        :return: None
+        """
+        with self._lock:
+            self.dropped.append((kind, str(item_id), str(reason)))
+
+
+# Quota shared by every service of each api. Both support accounts draw from the same GMail bucket so the limit is
+# conservative when the pipelines run in parallel.
+_buckets = dict((api, TokenBucket(rate, capacity)) for api, (rate, capacity) in QUOTA_RATES.items())
+
+request_stats = RequestStats()
+
+
+def _quota(request):
+    """
+    :param request: googleapiclient HttpRequest
+    :return: (TokenBucket for the request's api or None if the api is not limited, quota units used by the request)
+    """
+    method_id = getattr(request, 'methodId', None) or ''
+    return _buckets.get(method_id.split('.')[0]), QUOTA_COSTS.get(method_id, 1)
+
+
+def _acquire(requests):
+    """
+    Waits until every request can be made without exceeding the api's quota.
+    :param requests: list of googleapiclient HttpRequests made in a single round trip
+    :return: None
+    """
+    costs = {}
+    for request in requests:
+        bucket, cost = _quota(request)
+        if bucket is not None:
+            costs[bucket] = costs.get(bucket, 0) + cost
+    for bucket, cost in costs.items():
+        bucket.acquire(cost)
+
+
+def _error_reason(error):
+    """
+    :param error: HttpError
+    :return: str reason given in the error response (i.e. rateLimitExceeded) or None if no reason was given.
+    """
     try:
-        return build(name, version, credentials=_get_credentials(account_type, scope))
-    except RefreshError:
-        return get_api(name, version, account_type, scope, timeout - 1)
+        return json.loads(error.content)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def _is_retryable(error):
+    """
+    :param error: exception raised by a request
+    :return: True if the request may succeed if it is made again.
+    """
+    if isinstance(error, HttpError):
+        if error.resp.status in RETRY_STATUSES:
+            return True
+        return error.resp.status == 403 and _error_reason(error) in RATE_LIMIT_REASONS
+    # Timeouts and dropped connections
+    return isinstance(error, (SSLError, socket.error))
+
+
+def _is_droppable(error):
+    """
+    :param error: exception raised by a request for a single message or thread
+    :return: True if only the requested item is affected and it can be skipped. i.e. the item was deleted after it was
+             listed or the request was still failing with a retryable error once its retries ran out. Other errors such
+             as authorization errors affect the whole run.
+    """
+    if isinstance(error, HttpError) and error.resp.status in MISSING_STATUSES:
+        return True
+    return _is_retryable(error)
+
+
+def _backoff(attempt):
+    """
+    Waits before a retry. The wait is chosen at random up to an exponentially increasing limit so concurrent workers
+    do not retry in lock step.
+    :param attempt: number of retries already made
+    :return: None
+    """
+    time.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+
+
+def _execute(request, retries=MAX_RETRIES):
+    """
+    Executes a request within the api's quota. Rate limited, server and connection errors are retried with exponential
+    backoff.
+    :param request: googleapiclient HttpRequest
+    :param retries: number of times the request is retried before giving up (default = MAX_RETRIES)
+    :return: the response
+    :raise HttpError: If the request fails with an error that cannot be retried or fails after all retries.
+    :raise SSLError, socket.error: If the connection fails after all retries.
+    """
+    attempt = 0
+    while True:
+        _acquire([request])
+        request_stats.add_requests()
+        try:
+            return request.execute()
+        except (HttpError, SSLError, socket.error), e:
+            if attempt >= retries or not _is_retryable(e):
+                request_stats.add_failures()
+                raise e
+            request_stats.add_retries()
+            _backoff(attempt)
+            attempt += 1
+
+
+def print_request_summary():
+    """
+    Prints the number of api requests made and retried during the run along with every item that could not be
+    retrieved.
+    :return: None
+    """
+    print str(request_stats.requests) + " API requests made. " + str(request_stats.retries) + " retried, " + \
+        str(request_stats.failures) + " failed."
+    if len(request_stats.dropped) > 0:
+        print_error("Warning: Stats are incomplete. " + str(len(request_stats.dropped)) +
+                    " items could not be retrieved and were not counted:\n" +
+                    "\n".join("  " + kind + " " + item_id + ": " + reason
+                              for kind, item_id, reason in request_stats.dropped))
 
 
 def get_range(rng, sheet_id, sheet_api, dimension='ROWS', values_only=True):
@@ -120,11 +395,11 @@ def get_range(rng, sheet_id, sheet_api, dimension='ROWS', values_only=True):
     """
     try:
         if values_only:
-            return sheet_api.spreadsheets().values().get(spreadsheetId=sheet_id, range=rng,
-                                                         majorDimension=dimension).execute().get('values', [])
+            return _execute(sheet_api.spreadsheets().values().get(spreadsheetId=sheet_id, range=rng,
+                                                                  majorDimension=dimension)).get('values', [])
         else:
-            return sheet_api.spreadsheets().values().get(spreadsheetId=sheet_id, range=rng,
-                                                         majorDimension=dimension).execute()
+            return _execute(sheet_api.spreadsheets().values().get(spreadsheetId=sheet_id, range=rng,
+                                                                  majorDimension=dimension))
     except HttpError, e:
         print_error('Error: Could not get range: ' + str(rng) + ' from sheet ' + str(sheet_id))
         raise e
@@ -243,9 +518,9 @@ def update_range(service, spreadsheet_id, rng, values,
     """
     request_body = _create_row(values)
     try:
-        service.spreadsheets().values().update(spreadsheetId=spreadsheet_id, body=request_body,
-                                               range=rng, valueInputOption=value_input,
-                                               responseValueRenderOption=value_render).execute()
+        _execute(service.spreadsheets().values().update(spreadsheetId=spreadsheet_id, body=request_body,
+                                                        range=rng, valueInputOption=value_input,
+                                                        responseValueRenderOption=value_render))
     except HttpError, e:
         print_error('Error: Failed to update range: ' + str(rng) + ' on sheet: ' + str(spreadsheet_id))
         raise e
@@ -335,7 +610,7 @@ def delete_named_range_request(service, spreadsheet_id, rng):
     :raise HttpError: If any of the ranges are not present in the sheet.
     """
     try:
-        named_ranges = service.spreadsheets().get(spreadsheetId=spreadsheet_id, ranges=rng).execute().get(
+        named_ranges = _execute(service.spreadsheets().get(spreadsheetId=spreadsheet_id, ranges=rng)).get(
             'namedRanges', [])
 
         request_body = []
@@ -363,7 +638,7 @@ def spreadsheet_batch_update(service, spreadsheet_id, requests):
     request_body = {'requests': requests}
 
     try:
-        service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=request_body).execute()
+        _execute(service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body=request_body))
     except HttpError, e:
         request_names = []
         for request in requests:
@@ -375,8 +650,8 @@ def spreadsheet_batch_update(service, spreadsheet_id, requests):
 def remove_formulas(service, spreadsheet_id, rng):
     values = get_range(rng, spreadsheet_id, service, 'COLUMNS', False)
     try:
-        service.spreadsheets().values().update(spreadsheetId=spreadsheet_id, valueInputOption='RAW',
-                                               range=values['range'], body=values).execute()
+        _execute(service.spreadsheets().values().update(spreadsheetId=spreadsheet_id, valueInputOption='RAW',
+                                                        range=values['range'], body=values))
     except HttpError, e:
         print_error('Error: Failed to remove formulas from range: ' + str(rng) + 'on sheet: ' + str(spreadsheet_id))
         raise e
@@ -392,7 +667,7 @@ def clear_ranges(service, spreadsheet_id, ranges):
     """
     request_body = {'ranges': ranges}
     try:
-        service.spreadsheets().values().batchClear(spreadsheetId=spreadsheet_id, body=request_body).execute()
+        _execute(service.spreadsheets().values().batchClear(spreadsheetId=spreadsheet_id, body=request_body))
     except HttpError, e:
         print_error('Error: Failed to clear ranges: ' + str(ranges) + 'on sheet: ' + str(spreadsheet_id))
         raise e
@@ -425,7 +700,7 @@ def _create_draft(service, user_id, message_body):
     """
     try:
         message = {'message': message_body}
-        draft = service.users().drafts().create(userId=user_id, body=message).execute()
+        draft = _execute(service.users().drafts().create(userId=user_id, body=message))
         return draft
     except HttpError as error:
         print_error('Error: Failed to create. Please see stats_email.txt for draft and send manually.')
@@ -441,7 +716,7 @@ def _send_draft(service, user_id, draft):
     :return: None
     """
     try:
-        service.users().drafts().send(userId=user_id, body={'id': draft['id']}).execute()
+        _execute(service.users().drafts().send(userId=user_id, body={'id': draft['id']}))
     except HttpError, e:
         print_error('Error: Failed to send draft')
         raise e
@@ -473,15 +748,15 @@ def send_message(service, sender, to, subject, text):
             print text
 
 
-def get_labels(service, user_id='me'):
+def _list_labels(service, user_id):
     """
-    Obtain a dictionary of label IDs mapped to their respective label name.
+    Reads the label IDs and names from GMail.
     :param service: Mail API service used to obtain the lables. Must have read access to user's mail
-    :param user_id: default to 'me'
+    :param user_id: user whose labels are read
     :return: dictionary (key, value) = (id, name)
     """
     try:
-        response = service.users().labels().list(userId=user_id).execute()
+        response = _execute(service.users().labels().list(userId=user_id))
         labels = {}
 
         for item in response['labels']:
@@ -493,70 +768,264 @@ def get_labels(service, user_id='me'):
         raise e
 
 
-def get_message(service, user_id, msg_id, labels):
+class LabelMap(dict):
     """
-    Gets the specified message
-    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
-    :param user_id: default to 'me':
-    :param msg_id: message to be fetched
+    Dictionary of label IDs mapped to their respective label name. Looking up an unknown label ID re-reads the labels
+    from GMail rather than raising a KeyError. If the ID is still unknown the ID itself is returned and the labels are
+    not re-read for that ID again.
+
+    Attributes:
+        account: str
+            Account the labels belong to. The labels are persisted to LABEL_CACHE_FILE if an account is given.
+        read_time: float
+            Time the labels were read from GMail in seconds since the epoch.
+    """
+
+    def __init__(self, service, user_id, account, labels, read_time):
+        """
+        :param service: Mail API service used to re-read the labels
+        :param user_id: user whose labels are mapped
+        :param account: account the labels belong to or None if the labels should not be persisted
+        :param labels: dictionary (key, value) = (id, name)
+        :param read_time: time the labels were read from GMail in seconds since the epoch
+        """
+        dict.__init__(self, labels)
+        self._service = service
+        self._user_id = user_id
+        self._lock = threading.Lock()
+        self._refreshed = set()  # Unknown IDs the labels have already been re-read for
+        self.account = account
+        self.read_time = read_time
+
+    def __missing__(self, label_id):
+        with self._lock:
+            # Another fetch worker may have refreshed the labels while this one waited.
+            if not dict.__contains__(self, label_id) and label_id not in self._refreshed:
+                self._refreshed.add(label_id)
+                self.invalidate()
+                # Fetch workers refresh through their own service as services are not shared between threads.
+                self.refresh(getattr(_worker, 'service', self._service))
+        if dict.__contains__(self, label_id):
+            return dict.__getitem__(self, label_id)
+        return label_id
+
+    def is_expired(self):
+        return time.time() - self.read_time > LABEL_CACHE_TTL
+
+    def invalidate(self):
+        """
+        Marks the labels as expired and removes them from LABEL_CACHE_FILE so they are re-read from GMail by the next
+        get_labels call should the refresh fail.
+        :return: None
+        """
+        self.read_time = 0
+        if self.account is not None:
+            try:
+                os.remove(LABEL_CACHE_FILE.format(account=self.account))
+            except OSError:
+                pass
+
+    def refresh(self, service=None):
+        """
+        Re-reads the labels from GMail and persists them if an account was given. Labels are replaced in place so
+        lookups made during the refresh never see an empty map.
+        :param service: Mail API service used to read the labels (default = None: the service the map was created with)
+        :return: None
+        """
+        labels = _list_labels(service or self._service, self._user_id)
+        self.update(labels)
+        for label_id in [label_id for label_id in self.keys() if label_id not in labels]:
+            del self[label_id]
+        self.read_time = time.time()
+        if self.account is not None:
+            try:
+                with open(LABEL_CACHE_FILE.format(account=self.account), 'wb') as out:
+                    pickle.dump({'read_time': self.read_time, 'labels': labels}, out)
+            except IOError:
+                print_error('Error: Could not write label cache for ' + self.account)
+
+
+def get_labels(service, user_id='me', account=None):
+    """
+    Obtain a dictionary of label IDs mapped to their respective label name. If an account is given the labels are
+    cached in memory and in LABEL_CACHE_FILE and only re-read from GMail once they are older than LABEL_CACHE_TTL.
+    :param service: Mail API service used to obtain the lables. Must have read access to user's mail
+    :param user_id: default to 'me'
+    :param account: account the labels belong to (i.e. support, gov_support). (default = None: labels are not cached)
+    :return: LabelMap (key, value) = (id, name)
+    """
+    if account is None:
+        return LabelMap(service, user_id, None, _list_labels(service, user_id), time.time())
+
+    with _label_cache_lock:
+        labels = _label_cache.get((account, user_id))
+        if labels is None:
+            try:
+                with open(LABEL_CACHE_FILE.format(account=account), 'rb') as f:
+                    cached = pickle.load(f)
+                labels = LabelMap(service, user_id, account, cached['labels'], cached['read_time'])
+            except (IOError, EOFError, KeyError, pickle.UnpicklingError):
+                labels = LabelMap(service, user_id, account, {}, 0)
+            _label_cache[(account, user_id)] = labels
+
+        if labels.is_expired():
+            with labels._lock:
+                labels.refresh(service)
+        return labels
+
+
+def _parse_message(response, labels):
+    """
+    Builds a message from a messages().get response in 'metadata' format.
+    :param response: GMail message resource containing 'threadId', 'labelIds' and 'payload' headers
     :param labels: dictionary mapping label ids to label name
-    :return: message in JSON format containing 'X-GM-THRID', 'X-Gmail-Labels', 'To', 'From', 'Subject', 'Date'
+    :return: message in JSON format containing 'X-GM-MSGID', 'X-GM-THRID', 'X-Gmail-Labels', 'To', 'From', 'Subject',
+             'Date' or None if the message is missing one of the headers.
     """
     to_find = ['To', 'From', 'Subject', 'Date']
-    try:
-        response = service.users().messages().get(
-            userId=user_id, id=msg_id, format='metadata', metadataHeaders=['From', 'To', 'Date', 'Subject']).execute()
-        message = {'X-GM-THRID': response['threadId'], 'X-Gmail-Labels': response['labelIds']}
-        message['X-Gmail-Labels'] = map(lambda l: labels[l], message['X-Gmail-Labels'])
+    message = {'X-GM-MSGID': response['id'], 'X-GM-THRID': response['threadId'],
+               'X-Gmail-Labels': response['labelIds']}
+    message['X-Gmail-Labels'] = map(lambda l: labels[l], message['X-Gmail-Labels'])
 
+    try:
         while len(to_find) > 0:
             found = next(header for header in response['payload']['headers'] if header['name'] in to_find)
             encoded = found['value'].encode('ascii', 'ignore')
             message[found['name']] = encoded
             to_find.remove(found['name'])
-
-        return message
-    except SSLError, e:
-        print "Timeout"
-        print msg_id
-        print e.__class__
-        print e
-        traceback.print_exc()
-
     except StopIteration:
         # Skip this message. This only happens with drafts missing a field and does not affect stats.
-        pass
-    except HttpError, e:
-        print_error('Error: Failed to retrieve message: ' + msg_id)
-        raise e
+        return None
+
+    return message
+
+
+def get_message(service, user_id, msg_id, labels):
+    """
+    Gets the specified message
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param user_id: default to 'me':
+    :param msg_id: message to be fetched
+    :param labels: dictionary mapping label ids to label name
+    :return: message in JSON format containing 'X-GM-THRID', 'X-Gmail-Labels', 'To', 'From', 'Subject', 'Date' or None
+             if the message was deleted or was still failing once its retries ran out. Such messages are recorded in
+             request_stats.
+    :raise HttpError: If the request fails with an error which affects the whole run. See _is_droppable.
+    """
+    try:
+        response = _execute(service.users().messages().get(
+            userId=user_id, id=msg_id, format='metadata', metadataHeaders=METADATA_HEADERS))
+        return _parse_message(response, labels)
+    except (HttpError, SSLError, socket.error), e:
+        if not _is_droppable(e):
+            raise e
+        request_stats.add_dropped('message', msg_id, e)
+        return None
 
 
-def get_messages(service, user_id='me', query=''):
+def get_messages_batch(service, user_id, msg_ids, labels, batch_size=MAX_BATCH_SIZE, retries=MAX_RETRIES):
+    """
+    Gets the specified messages using batch requests. Up to batch_size messages are requested per HTTP round trip.
+    Only the requests which failed with an error that can be retried are retried.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param user_id: default to 'me'
+    :param msg_ids: list of messages to be fetched
+    :param labels: dictionary mapping label ids to label name
+    :param batch_size: number of messages requested per batch (default = MAX_BATCH_SIZE)
+    :param retries: number of times failed requests are retried before giving up (default = MAX_RETRIES)
+    :return: list of messages in the order of msg_ids. Messages missing a header or labels are skipped. Messages which
+             were deleted or were still failing once their retries ran out are skipped and recorded in request_stats.
+    :raise HttpError: If a request fails with an error which affects the whole run. See _is_droppable.
+    """
+    responses = {}
+    errors = {}
+
+    def callback(request_id, response, exception):
+        if exception is None:
+            responses[request_id] = response
+        else:
+            errors[request_id] = exception
+
+    pending = []
+    seen = set()
+    for msg_id in msg_ids:
+        if msg_id not in seen:
+            seen.add(msg_id)
+            pending.append(msg_id)
+
+    attempt = 0
+    while len(pending) > 0:
+        if attempt > 0:
+            request_stats.add_retries(len(pending))
+            _backoff(attempt - 1)
+        errors.clear()
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            requests = []
+            for msg_id in chunk:
+                request = service.users().messages().get(userId=user_id, id=msg_id, format='metadata',
+                                                         metadataHeaders=METADATA_HEADERS)
+                requests.append(request)
+                batch.add(request, request_id=msg_id)
+            _acquire(requests)
+            request_stats.add_requests(len(chunk))
+            try:
+                batch.execute()
+            except (HttpError, SSLError, socket.error), e:
+                # The whole batch failed. Every message in it is retried.
+                for msg_id in chunk:
+                    errors[msg_id] = e
+
+        failed = [msg_id for msg_id in pending if msg_id in errors]
+        attempt += 1
+        pending = []
+        for msg_id in failed:
+            if not _is_droppable(errors[msg_id]):
+                request_stats.add_failures()
+                raise errors[msg_id]
+            if attempt > retries or not _is_retryable(errors[msg_id]):
+                request_stats.add_failures()
+                request_stats.add_dropped('message', msg_id, errors[msg_id])
+            else:
+                pending.append(msg_id)
+
+    result = []
+    for msg_id in msg_ids:
+        if msg_id not in responses:
+            continue  # Dropped once its retries ran out
+        try:
+            new_message = _parse_message(responses[msg_id], labels)
+            if new_message is not None:
+                result.append(new_message)
+        except KeyError:
+            print "Failed:"
+            print responses[msg_id]
+    return result
+
+
+def get_messages(service, user_id='me', query='', account=None):
     """
     Obtains a list of gmail messages containing Thread ID, Subject, To, From and Labels
     :param service: Mail API service used to obtain the messages. Must have read access to user's mail
     :param user_id: default to 'me'
     :param query:
+    :param account: account the messages belong to. Used to cache labels (default = None: labels are not cached)
     :return: list of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
     """
     try:
-        response = service.users().messages().list(userId=user_id, q=query).execute()
+        response = _execute(service.users().messages().list(userId=user_id, q=query))
         messages = []
         if 'messages' in response:
             messages.extend(response['messages'])
 
         while 'nextPageToken' in response:
             page_token = response['nextPageToken']
-            response = service.users().messages().list(userId=user_id, q=query,
-                                                       pageToken=page_token).execute()
+            response = _execute(service.users().messages().list(userId=user_id, q=query,
+                                                                pageToken=page_token))
             messages.extend(response['messages'])
-        labels = get_labels(service, user_id)
-        result = []
-        for message in messages:
-            new_message = get_message(service, user_id, message['id'], labels)
-            if new_message is not None:
-                result.append(new_message)
-        return result
+        labels = get_labels(service, user_id, account)
+        return get_messages_batch(service, user_id, [message['id'] for message in messages], labels)
 
     except HttpError, e:
         print_error('Error: Failed to retrieve messages for: ' + str(user_id) + ' using query: ' + str(query))
@@ -572,7 +1041,7 @@ def get_thread_ids(service, user_id='me', query=''):
     :return: list of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
     """
     try:
-        response = service.users().messages().list(userId=user_id, q=query).execute()
+        response = _execute(service.users().messages().list(userId=user_id, q=query))
         thread_ids = set()
 
         while 'nextPageToken' in response:
@@ -582,8 +1051,8 @@ def get_thread_ids(service, user_id='me', query=''):
 
             # Advance to next page.
             page_token = response['nextPageToken']
-            response = service.users().messages().list(userId=user_id, q=query,
-                                                       pageToken=page_token).execute()
+            response = _execute(service.users().messages().list(userId=user_id, q=query,
+                                                                pageToken=page_token))
         # Get threadIds from last page.
         if 'messages' in response:
             for message in response['messages']:
@@ -596,81 +1065,233 @@ def get_thread_ids(service, user_id='me', query=''):
         raise e
 
 
-def get_messages_from_thread_ids(service, threads, user_id='me'):
+def get_history_id(service, user_id='me'):
+    """
+    Obtains the mailbox's current history id.
+    :param service: Mail API service. Must have read access to user's mail
+    :param user_id: default to 'me'
+    :return: str history id
+    """
+    try:
+        return str(_execute(service.users().getProfile(userId=user_id))['historyId'])
+    except HttpError, e:
+        print_error('Error: Failed to retrieve history id for: ' + str(user_id))
+        raise e
+
+
+def get_history(service, start_history_id, user_id='me'):
+    """
+    Obtains every mailbox change made after start_history_id.
+    :param service: Mail API service. Must have read access to user's mail
+    :param start_history_id: history id returned by a prior call to get_history_id or get_history
+    :param user_id: default to 'me'
+    :return: (history records in chronological order, str current history id)
+    :raise HttpError: status 404 if start_history_id is too old to be used and a full sync is required.
+    """
+    response = _execute(service.users().history().list(userId=user_id, startHistoryId=start_history_id))
+    records = response.get('history', [])
+
+    while 'nextPageToken' in response:
+        page_token = response['nextPageToken']
+        response = _execute(service.users().history().list(userId=user_id, startHistoryId=start_history_id,
+                                                           pageToken=page_token))
+        records.extend(response.get('history', []))
+
+    return records, str(response['historyId'])
+
+
+def _parse_thread(response, labels):
+    """
+    Builds a message for every message in a threads().get response in 'metadata' format.
+    :param response: GMail thread resource containing 'messages'
+    :param labels: dictionary mapping label ids to label name
+    :return: list of messages in thread order. Messages missing a header or labels are skipped.
+    """
+    result = []
+    for message in response["messages"]:
+        try:
+            new_message = _parse_message(message, labels)
+            if new_message is not None:
+                result.append(new_message)
+        except KeyError:
+            print "Failed:"
+            print message
+    return result
+
+
+def get_messages_from_thread_ids(service, threads, user_id='me', account=None):
     """
     Obtains every message in the specified threadIds
     :param service: Mail API service used to obtain the messages. Must have read access to user's mail
     :param threads: list of gmail threadIds
     :param user_id: default to 'me'
+    :param account: account the messages belong to. Used to cache labels (default = None: labels are not cached)
     :return: list of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
+             Threads which could not be retrieved are skipped and recorded in request_stats.
+    """
+    result = []
+    labels = get_labels(service, user_id, account)
+    for thread in threads:
+        result.extend(_get_thread_messages(service, user_id, thread, labels))
+    return result
+
+
+def _get_thread_messages(service, user_id, thread_id, labels):
+    """
+    Obtains every message in a single thread. Message headers and labels are read from the thread itself so only one
+    request is made per thread.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param user_id: default to 'me'
+    :param thread_id: gmail threadId
+    :param labels: dictionary mapping label ids to label name
+    :return: list of messages in thread order. An empty list if the thread was deleted or was still failing once its
+             retries ran out. Such threads are recorded in request_stats.
+    :raise HttpError: If the request fails with an error which affects the whole run. See _is_droppable.
     """
     try:
-        result = []
-        labels = get_labels(service, user_id)
-        for thread in threads:
-            thread_response = service.users().threads().get(userId='me', id=thread).execute()
-            messages = thread_response["messages"]
-            for message in messages:
-                new_message = get_message(service, user_id, message['id'], labels)
-                if new_message is not None:
-                    result.append(new_message)
-        return result
+        thread_response = _execute(service.users().threads().get(userId=user_id, id=thread_id, format='metadata',
+                                                                 metadataHeaders=METADATA_HEADERS))
+        return _parse_thread(thread_response, labels)
+    except (HttpError, SSLError, socket.error), e:
+        if not _is_droppable(e):
+            raise e
+        request_stats.add_dropped('thread', thread_id, e)
 
-    except HttpError, e:
-        print_error('Error: Failed to retrieve messages from thread ids for: ' + str(user_id))
-        raise e
+    return []
 
 
-def get_messages_from_threads(service, user_id='me', query=''):
+def _fetch_thread(service_factory, user_id, thread_id, labels):
     """
-    Obtains a list of gmail messages containing Thread ID, Subject, To, From and Labels
-    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    Fetches a thread with the service owned by the current fetch worker thread. The service is built by the worker's
+    first fetch rather than by a pool initializer so a failure to build it is raised to the caller instead of the pool
+    restarting the worker forever.
+    :param service_factory: function returning a new Mail API service
+    :return: list of messages in the thread. See _get_thread_messages.
+    """
+    if getattr(_worker, 'factory', None) is not service_factory:
+        _worker.service = service_factory()
+        _worker.factory = service_factory
+    return _get_thread_messages(_worker.service, user_id, thread_id, labels)
+
+
+def list_threads(service, user_id='me', query=''):
+    """
+    Obtains every thread containing at least one message matching the query.
+    :param service: Mail API service used to obtain the threads. Must have read access to user's mail
     :param user_id: default to 'me'
-    :param query: gmail query used to search for messages. All messages in thread must match query.
-    :return: list of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
+    :param query: gmail query used to search for messages.
+    :return: list of thread resources {"id": "xxxx", "snippet": "xxxxx", "historyId": "xxxxx"} in listing order
     """
-    # try:
     # response has format {"threads": [threadResource], "resultSizeEstimate": 1, "nextPageToken": "xxxx"}
-    # threadResource has format {"id": "xxxx", "snippet": "xxxxx", "historyId": "xxxxx"}
-    response = service.users().threads().list(userId=user_id, q=query).execute()
-    threads = set()
+    response = _execute(service.users().threads().list(userId=user_id, q=query))
+    threads = []
+    seen = set()
     if 'threads' in response:
         for thread in response['threads']:
-            threads.add(thread["id"])
+            if thread["id"] not in seen:
+                seen.add(thread["id"])
+                threads.append(thread)
 
     while 'nextPageToken' in response:
         page_token = response['nextPageToken']
-        response = service.users().threads().list(userId=user_id, q=query,
-                                                  pageToken=page_token).execute()
+        response = _execute(service.users().threads().list(userId=user_id, q=query,
+                                                           pageToken=page_token))
         for thread in response['threads']:
-            threads.add(thread["id"])
+            if thread["id"] not in seen:
+                seen.add(thread["id"])
+                threads.append(thread)
 
-    labels = get_labels(service, user_id)
-    result = []
+    return threads
 
-    for thread in threads:
+
+def iter_thread_messages(service, thread_ids, labels, user_id='me', workers=1, service_factory=None):
+    """
+    Generates the messages in each of the specified threads as soon as each thread has been fetched. When workers > 1
+    later threads continue to download while earlier ones are being processed. At most workers * FETCH_AHEAD fetched
+    threads wait to be processed so a slow consumer does not hold every thread in memory.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param thread_ids: list of gmail threadIds
+    :param labels: dictionary mapping label ids to label name
+    :param user_id: default to 'me'
+    :param workers: number of threads fetched concurrently (default = 1)
+    :param service_factory: function returning a new Mail API service for the same account. Required when
+                            workers > 1 as each worker needs its own service. (default = None: fetch serially)
+    :return: generator yielding a list of messages for each thread in the order of thread_ids.
+    """
+    if workers > 1 and service_factory is not None and len(thread_ids) > 1:
+        pool = ThreadPool(min(workers, len(thread_ids)))
+        remaining = iter(thread_ids)
+        fetching = collections.deque()
         try:
-            # print thread # this is the thread id
-            # TODO Multithread this for speed
-            thread_response = service.users().threads().get(userId='me', id=thread, format="minimal").execute()
-            messages = thread_response["messages"]
-            for message in messages:
-                try:
-                    new_message = get_message(service, user_id, message['id'], labels)
-                    if new_message is not None:
-                        result.append(new_message)
-                except KeyError:
-                    print "Failed:"
-                    print message
-        except SSLError, e:
-            print "Thread Timeout"
-            print thread
-            print e.__class__
-            print e
-            traceback.print_exc()
+            # A thread is only submitted once an earlier one is taken so results are yielded in submission order and
+            # never pile up ahead of the consumer.
+            for thread in itertools.islice(remaining, workers * FETCH_AHEAD):
+                fetching.append(pool.apply_async(_fetch_thread, (service_factory, user_id, thread, labels)))
+            while len(fetching) > 0:
+                messages = fetching.popleft().get()
+                for thread in itertools.islice(remaining, 1):
+                    fetching.append(pool.apply_async(_fetch_thread, (service_factory, user_id, thread, labels)))
+                yield messages
+        finally:
+            if len(fetching) > 0:
+                # The consumer stopped early. Queued threads are abandoned rather than downloaded.
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+    else:
+        for thread in thread_ids:
+            yield _get_thread_messages(service, user_id, thread, labels)
+
+
+def get_thread_messages(service, thread_ids, labels, user_id='me', workers=1, service_factory=None):
+    """
+    Obtains every message in each of the specified threads.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param thread_ids: list of gmail threadIds
+    :param labels: dictionary mapping label ids to label name
+    :param user_id: default to 'me'
+    :param workers: number of threads fetched concurrently (default = 1)
+    :param service_factory: function returning a new Mail API service for the same account. Required when
+                            workers > 1 as each worker needs its own service. (default = None: fetch serially)
+    :return: list containing a list of messages for each thread in the order of thread_ids.
+    """
+    return list(iter_thread_messages(service, thread_ids, labels, user_id, workers, service_factory))
 
-    return result
 
-    # except HttpError, e:
-    #     print_error('Error: Failed to retrieve thread messages for: ' + str(user_id) + ' using query: ' + str(query))
-    #     raise e
+def iter_messages_from_threads(service, user_id='me', query='', workers=1, service_factory=None, account=None):
+    """
+    Generates the same messages as get_messages_from_threads, yielding each thread's messages as soon as the thread
+    has been fetched rather than once every thread has been fetched.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param user_id: default to 'me'
+    :param query: gmail query used to search for messages. All messages in thread must match query.
+    :param workers: number of threads fetched concurrently (default = 1)
+    :param service_factory: function returning a new Mail API service for the same account. Required when
+                            workers > 1 as each worker needs its own service. (default = None: fetch serially)
+    :param account: account the messages belong to. Used to cache labels (default = None: labels are not cached)
+    :return: generator of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
+             Messages are grouped by thread in the order the threads were listed.
+    """
+    threads = [thread["id"] for thread in list_threads(service, user_id, query)]
+    labels = get_labels(service, user_id, account)
+
+    for messages in iter_thread_messages(service, threads, labels, user_id, workers, service_factory):
+        for message in messages:
+            yield message
+
+
+def get_messages_from_threads(service, user_id='me', query='', workers=1, service_factory=None, account=None):
+    """
+    Obtains a list of gmail messages containing Thread ID, Subject, To, From and Labels
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param user_id: default to 'me'
+    :param query: gmail query used to search for messages. All messages in thread must match query.
+    :param workers: number of threads fetched concurrently (default = 1)
+    :param service_factory: function returning a new Mail API service for the same account. Required when
+                            workers > 1 as each worker needs its own service. (default = None: fetch serially)
+    :param account: account the messages belong to. Used to cache labels (default = None: labels are not cached)
+    :return: list of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
+             Messages are grouped by thread in the order the threads were listed.
+    """
+    return list(iter_messages_from_threads(service, user_id, query, workers, service_factory, account))
@@ -1,13 +1,187 @@
+import re
+
 from tools import config
 import util
 
+MAX_MATCHES = 100000  # Results remembered by each PhraseMatcher.
+
+
+class PhraseMatcher(object):
+    """
+    Checks whether a string contains any of a list of phrases using a single compiled regular expression so the cost
+    of a check does not grow with the number of phrases. Results are remembered per string.
+
+    Attributes:
+        phrases: lst(str)
+            Phrases searched for.
+    """
+
+    def __init__(self, phrases):
+        """
+        :param phrases: phrases to search for
+        """
+        self.phrases = list(phrases)
+        if len(self.phrases) > 0:
+            self._search = re.compile('|'.join(re.escape(phrase) for phrase in self.phrases)).search
+        else:
+            self._search = lambda text: None
+        self._matches = {}
+
+    def __call__(self, text):
+        """
+        :param text: string to search
+        :return: True if text contains any of the phrases.
+        """
+        try:
+            return self._matches[text]
+        except KeyError:
+            if len(self._matches) >= MAX_MATCHES:
+                self._matches.clear()
+            match = self._search(text) is not None
+            self._matches[text] = match
+            return match
+
+
+# Matchers for the phrase lists in config. Built once when the module is loaded.
+INTERNAL_EMAILS = PhraseMatcher(config.INTERNAL_EMAILS)
+SPAM_EMAILS = PhraseMatcher(config.SPAM_EMAILS)
+OPEN_LABELS = PhraseMatcher(config.OPEN_LABELS)
+
+_internal = {}  # is_internal results by address
+
+# Label names, label lists and addresses shared by many messages are stored once.
+MAX_INTERNED = 100000  # Strings and label lists remembered by _intern and _intern_labels.
+_strings = {}
+_label_lists = {}
+
+
+def _intern(value):
+    """
+    :param value: str or unicode
+    :return: the first equal value seen so that equal strings share one object.
+    """
+    try:
+        return _strings[value]
+    except KeyError:
+        pass
+
+    # Forget every value rather than grow without bound. Values interned earlier stay valid but are no longer shared.
+    if len(_strings) >= MAX_INTERNED:
+        _strings.clear()
+    _strings[value] = value
+    return value
+
+
+def _intern_labels(labels):
+    """
+    :param labels: list of GMail label names
+    :return: tuple of interned label names shared by every message with the same labels.
+    """
+    labels = tuple(_intern(label) for label in labels)
+    try:
+        return _label_lists[labels]
+    except KeyError:
+        pass
+
+    if len(_label_lists) >= MAX_INTERNED:
+        _label_lists.clear()
+    _label_lists[labels] = labels
+    return labels
+
 
 def is_internal(address):
     """
     :return: True if the address contains 'irbnet.org' and is not listed
     in config.INTERNAL_EMAILS.
     """
-    return 'irbnet.org' in address and all(x not in address for x in config.INTERNAL_EMAILS)
+    try:
+        return _internal[address]
+    except KeyError:
+        if len(_internal) >= MAX_MATCHES:
+            _internal.clear()
+        internal = 'irbnet.org' in address and not INTERNAL_EMAILS(address)
+        _internal[address] = internal
+        return internal
+
+
+class LabelClassifier(object):
+    """
+    Classifies GMail labels as stat labels, member labels and the thread type labels listed in config. Build one
+    classifier per stats run so every membership test is a set lookup rather than a scan of the label lists.
+
+    Thread type labels are returned as bit flags:
+        VM_ADMIN, VM_RESEARCHER, VM_SALES, VM_FINANCE, PING_DEMO, PING_INQUIRY, PING_SUPPORT, NEW_ORG, SALES_PING,
+        CHECK_IN: the label equals the respective config label.
+        OPEN: the label contains any phrase in config.OPEN_LABELS.
+
+    Attributes:
+        stat_labels: frozenset(str)
+            Stat labels to search for.
+        member_labels: frozenset(str)
+            Member labels to search for.
+    """
+    VM_ADMIN = 1
+    VM_RESEARCHER = 1 << 1
+    VM_SALES = 1 << 2
+    VM_FINANCE = 1 << 3
+    PING_DEMO = 1 << 4
+    PING_INQUIRY = 1 << 5
+    PING_SUPPORT = 1 << 6
+    NEW_ORG = 1 << 7
+    SALES_PING = 1 << 8
+    CHECK_IN = 1 << 9
+    OPEN = 1 << 10
+
+    def __init__(self, stat_labels, member_labels=()):
+        """
+        :param stat_labels: collection of stat labels to search for
+        :param member_labels: collection of member labels to search for (default = (): no member labels)
+        """
+        self.stat_labels = frozenset(stat_labels)
+        self.member_labels = frozenset(member_labels or ())
+        self._type_flags = {
+            config.VM_ADMIN: LabelClassifier.VM_ADMIN,
+            config.VM_RESEARCHER: LabelClassifier.VM_RESEARCHER,
+            config.VM_SALES: LabelClassifier.VM_SALES,
+            config.VM_FINANCE: LabelClassifier.VM_FINANCE,
+            config.PING_DEMO: LabelClassifier.PING_DEMO,
+            config.PING_INQUIRY: LabelClassifier.PING_INQUIRY,
+            config.PING_SUPPORT: LabelClassifier.PING_SUPPORT,
+            config.NEW_ORG: LabelClassifier.NEW_ORG,
+            config.SALES_PING: LabelClassifier.SALES_PING,
+            config.CHECK_IN: LabelClassifier.CHECK_IN,
+        }
+        self._flags = {}  # Flags of every label seen so far
+
+    def label_flags(self, label):
+        """
+        :param label: GMail label name
+        :return: int thread type flags of the label
+        """
+        try:
+            return self._flags[label]
+        except KeyError:
+            flags = self._type_flags.get(label, 0)
+            if OPEN_LABELS(label):
+                flags |= LabelClassifier.OPEN
+            self._flags[label] = flags
+            return flags
+
+    def classify(self, labels):
+        """
+        :param labels: GMail label names of a message
+        :return: (set of stat labels, set of member labels, int thread type flags)
+        """
+        statistics = set()
+        members = set()
+        flags = 0
+        for label in labels:
+            if label in self.stat_labels:
+                statistics.add(label)
+            if label in self.member_labels:
+                members.add(label)
+            flags |= self.label_flags(label)
+        return statistics, members, flags
 
 
 class Message(object):
@@ -23,9 +197,11 @@ class Message(object):
             Subject line
         date: datetime
             Subject Date
-        labels: lst(str)
-            All GMail labels associated with the message.
+        labels: tuple(str)
+            All GMail labels associated with the message. Messages with the same labels share one tuple.
     """
+    __slots__ = ['thread_id', 'to', 'from_address', 'subject', 'date', 'labels']
+
     def __init__(self, message):
         """
         :param message: GMail message used to build the Message object.
@@ -54,12 +230,13 @@ class Message(object):
         else:
             # Extract email address from string containing "<email>"
             self.from_address = from_address[from_address.find("<") + 1: from_address.find(">")].lower()
+        self.from_address = _intern(self.from_address)
 
-        self.labels = message['X-Gmail-Labels']
+        self.labels = _intern_labels(message['X-Gmail-Labels'])
 
         date = message['Date']
         if date is not None:
-            self.date = util.parse_date(date)
+            self.date = util.parse_header_date(date)
 
     def is_spam(self):
         """
@@ -67,7 +244,7 @@ class Message(object):
         of a 'spam' message that can be ignored for stats. Spam addresses listed in config.SPAM_EMAILS
         :return: True if the address matches any know spam strings or if the address is the empty string
         """
-        return any(s in self.from_address for s in config.SPAM_EMAILS)
+        return SPAM_EMAILS(self.from_address)
 
     def is_idea(self):
         """
@@ -90,21 +267,27 @@ class Message(object):
         """
         return config.SUPPORT_EMAIL in self.from_address
 
-    def extract_labels(self, stat_labels, members_labels):
+    def extract_labels(self, classifier):
         """
-        Extracts all labels from the message labels that are in either in stat_labels or members.MEMBERS
-        :param stat_labels collection of stat labels to search for.
-        :param members_labels collection of member labels to search for
-        :return: 2 lists fro stat and member labels respectively.
+        Extracts all labels from the message labels that are stat or member labels and the message's thread type.
+        :param classifier: LabelClassifier used to classify the labels
+        :return: 2 sets for stat and member labels respectively and the LabelClassifier flags of the message.
         """
-        statistics = set()
-        members = set()
-        for label in self.labels:
-            if label in stat_labels:
-                statistics.add(label)
-            if label in members_labels:
-                members.add(label)
-        return statistics, members
+        return classifier.classify(self.labels)
+
+    def is_check_in(self):
+        """
+        :return: True if the message is labeled config.CHECK_IN
+        """
+        return config.CHECK_IN in self.labels
+
+    def describe(self, separator='\n'):
+        """
+        :param separator: str placed between the message fields (default = new line)
+        :return: str From, To, Subject, Date and Labels of the message
+        """
+        return separator.join(["From: " + self.from_address, "To: " + self.to, "Subject: " + self.subject,
+                               "Date: " + str(self.date), "Labels: " + str(list(self.labels))])
 
     def get_thread_id(self):
         return self.thread_id
@@ -125,10 +308,47 @@ class Message(object):
         return self.subject
 
 
+def ask_to_count(message_type, description):
+    """
+    Asks the user if a thread should count. Acceptable user responses include 'Y' | 'y' | 'N' | 'n'
+    If an unrecognized response is entered the user is asked again.
+    :param message_type: str 'Support' | 'Internal' printed to provide user with more information.
+    :param description: str message information printed for the user. See Message.describe
+    :return: True if the user responds 'Y' | 'y' and False if the user responds 'N' | 'n'
+    """
+    with util.PROMPT_LOCK:
+        print "\nFound " + message_type + " email. Should the following message be counted?\n\n" + description
+        while True:
+            answer = util.prompt("Y/N?    ").lower().strip()
+            if answer == "y":
+                print "Thread will be counted."
+                return True
+            elif answer == "n":
+                print "Thread won't be counted."
+                return False
+            print "Answer not recognized."
+
+
+def _flag_property(bit):
+    """
+    :param bit: bit of Thread._flags holding the property
+    :return: boolean property stored in Thread._flags
+    """
+    def get(self):
+        return self._flags & bit != 0
+
+    def set(self, value):
+        if value:
+            self._flags |= bit
+        else:
+            self._flags &= ~bit
+    return property(get, set)
+
+
 class Thread(object):
 
     """Mail thread tracking the thread type for stats as well as basic thread information. Labels are only evaluated
-    when a message is first added to the thread.
+    when a message is first added to the thread. The boolean attributes below are packed into a single int.
 
     Attributes:
         id : int
@@ -175,19 +395,52 @@ class Thread(object):
             False if any of the message labels contained a phrase contained in config.OPEN_LABELS (default=True)
 
     """
-    def __init__(self, message, stat_labels, cutoff, members=None):
+    __slots__ = ['id', 'subject', 'message_count', 'stat_labels', 'member_labels', 'oldest_date',
+                 'last_contact_date', 'check_in_date', '_flags']
+
+    # Bits of the flags returned by get_flags
+    GOOD = 1
+    NON_PING = 1 << 1
+    DEMO = 1 << 2
+    INQUIRY = 1 << 3
+    SUPPORT_PING = 1 << 4
+    ADMIN_VM = 1 << 5
+    RES_VM = 1 << 6
+    SALES_VM = 1 << 7
+    FINANCE_VM = 1 << 8
+    NEW_ORG = 1 << 9
+    SALES_PING = 1 << 10
+    CHECKED = 1 << 11
+    CLOSED = 1 << 12
+
+    good_thread = _flag_property(GOOD)
+    non_ping = _flag_property(NON_PING)
+    demo = _flag_property(DEMO)
+    inquiry = _flag_property(INQUIRY)
+    support_ping = _flag_property(SUPPORT_PING)
+    admin_vm = _flag_property(ADMIN_VM)
+    res_vm = _flag_property(RES_VM)
+    sales_vm = _flag_property(SALES_VM)
+    finance_vm = _flag_property(FINANCE_VM)
+    new_org = _flag_property(NEW_ORG)
+    sales_ping = _flag_property(SALES_PING)
+    checked = _flag_property(CHECKED)
+    closed = _flag_property(CLOSED)
+
+    def __init__(self, message, classifier, cutoff, decisions=None):
         """
         Constructs a new thread from the provided message.
         :param message: Message
             Used to construct the thread. Thread attributes are adjusted based on message information.
-        :param stat_labels stat labels to search for
-        :param members: collection of member labels to search for
+        :param classifier: LabelClassifier for the stat and member labels to search for
         :param cutoff: earliest date for which a thread should count
+        :param decisions: Decisions consulted before the user is asked if the thread should count (default = None)
         """
 
         self.id = message.get_thread_id()
+        self._flags = 0
 
-        self.stat_labels, self.member_labels = message.extract_labels(stat_labels, members)
+        self.stat_labels, self.member_labels, flags = message.extract_labels(classifier)
         self.last_contact_date = None
         self.oldest_date = message.get_date()
         self.good_thread = self.oldest_date >= cutoff
@@ -208,10 +461,9 @@ class Thread(object):
         self.checked = False
         self.closed = True
         self.subject = message.get_subject()
-        self._evaluate(message)
-        self.messages = [message]
+        self._evaluate(message, flags, decisions)
 
-    def _evaluate(self, message):
+    def _evaluate(self, message, flags, decisions=None):
         """
         Determines a thread type by evaluating a message. Thread can be set as a demo, inquiry, new org, sales ping
         or voicemail.
@@ -220,33 +472,33 @@ class Thread(object):
         Sets the check-in date and marks a message as not closed if applicable
         :param message: Message
             message being evaluated.
+        :param flags: LabelClassifier flags of the message's labels
+        :param decisions: Decisions consulted before the user is asked if the thread should count (default = None)
         :return: None
         """
 
-        labels = message.get_labels()
-
-        if config.VM_ADMIN in labels:
+        if flags & LabelClassifier.VM_ADMIN:
             self.admin_vm = True
-        elif config.VM_RESEARCHER in labels:
+        elif flags & LabelClassifier.VM_RESEARCHER:
             self.res_vm = True
             if config.PING_EMAIL not in message.get_from_address():
                 self.message_count -= 1  # Eliminates admin/researcher replies when total vm count is determined.
-        elif config.VM_SALES in labels:
+        elif flags & LabelClassifier.VM_SALES:
             self.sales_vm = True
             # Do not decrease thread count as additional messages between Support and the Sales Team may be exchanged
-        elif config.VM_FINANCE in labels:
+        elif flags & LabelClassifier.VM_FINANCE:
             self.finance_vm = True
             # Do not decrease thread count as additional messages between Support and the Sales Team may be exchanged
 
-        if config.PING_DEMO in labels:
+        if flags & LabelClassifier.PING_DEMO:
             self.demo = True
-        elif config.PING_INQUIRY in labels:
+        elif flags & LabelClassifier.PING_INQUIRY:
             self.inquiry = True
-        elif config.PING_SUPPORT in labels:
+        elif flags & LabelClassifier.PING_SUPPORT:
             self.support_ping = True
-        elif config.NEW_ORG in labels and self.message_count == 2:
+        elif flags & LabelClassifier.NEW_ORG and self.message_count == 2:
             self.new_org = True
-        if config.SALES_PING in labels:
+        if flags & LabelClassifier.SALES_PING:
             self.sales_ping = True
             self.checked = True
             if "IRBNet Demo Request" in message.get_subject():
@@ -257,19 +509,18 @@ class Thread(object):
         if self.non_ping:
             if not self.checked and self.good_thread:
                 if message.is_to_from_support() and not self.new_org:
-                    self.should_it_count(message, "to and from Support")
+                    self.should_it_count(message, "to and from Support", decisions=decisions)
                 elif is_internal(message.get_from_address()) or \
                         (message.is_from_support() and is_internal(message.get_to()) and not self.sales_ping):
-                    self.should_it_count(message, "Internal")
-            if config.CHECK_IN in labels:
+                    self.should_it_count(message, "Internal", decisions=decisions)
+            if flags & LabelClassifier.CHECK_IN:
                 if self.check_in_date is None or self.check_in_date < message.get_date():
                     self.check_in_date = message.get_date()
 
-        for l in config.OPEN_LABELS:
-            if any(l in label for label in message.get_labels()):
-                self.closed = False
+        if flags & LabelClassifier.OPEN:
+            self.closed = False
 
-    def should_it_count(self, message, message_type, override=False):
+    def should_it_count(self, message, message_type, override=False, decisions=None):
         """
         Prints basic message information and asks the user if a thread should count.
         Acceptable user responses include 'Y' | 'y' | 'N' | 'n'
@@ -280,49 +531,50 @@ class Thread(object):
 
         If config.COUNT_NONE = True or config.COUNT_ALL = True, user prompt is skipped and good_thread is
         set accordingly
+        If decisions already has an answer for the thread the user is not asked. Otherwise the user's answer is
+        recorded in decisions. If decisions defers questions and override is False, the thread is added to
+        decisions.pending instead of asking the user.
         :param message: Message
             Message from which information is extracted.
         :param message_type: str 'Support' | 'Internal
             Message type printed to provide user with more information.
         :param override: boolean
             True if system setting for COUNT_ALL and COUNT_NONE should be ignored and thread should be checked.
+        :param decisions: Decisions
+            Answers consulted before the user is asked. (default = None: The user is always asked)
         :return: None
         """
         if override or not (config.COUNT_ALL or config.COUNT_NONE):
             self.checked = True
-            print "\nFound ", message_type, " email. Should the following message be counted?\n",\
-                "\nFrom: " + message.get_from_address(),\
-                "\nTo: " + message.get_to(),\
-                "\nSubject: " + message.get_subject(),\
-                "\nDate: " + str(message.get_date()),\
-                "\nLabels:" + str(message.get_labels())
-            answer = raw_input("Y/N?    ").lower().strip()
-            if answer == "y":
-                print "Thread will be counted."
-                self.good_thread = True
-            elif answer == "n":
-                print "Thread won't be counted."
-                self.good_thread = False
-            else:
-                print "Answer not recognized."
-                self.should_it_count(message, message_type)
+            if decisions is not None:
+                decision = decisions.get(self.id, message)
+                if decision is not None:
+                    self.good_thread = decision
+                    return
+                if decisions.defer and not override:
+                    # Thread counts until the user answers otherwise during the review. See Decisions.review
+                    decisions.postpone(self.id, message, message_type)
+                    return
+            self.good_thread = ask_to_count(message_type, message.describe())
+            if decisions is not None:
+                decisions.record(self.id, self.good_thread)
         elif config.COUNT_NONE:
             self.good_thread = False
         else:
             self.good_thread = True
 
-    def add_message(self, message, stat_labels, cutoff, members=None):
+    def add_message(self, message, classifier, cutoff, decisions=None):
         """
         Adds message to a thread and evaluates all thread attributes making changes as necessary.
-        :param stat_labels to look search for during extraction
         :param message: Message
-        :param members: collection of member labels to search for
+        :param classifier: LabelClassifier for the stat and member labels to search for
         :param cutoff: earliest date for which a thread should count
+        :param decisions: Decisions consulted before the user is asked if the thread should count (default = None)
         :return: None
         """
         self.message_count += 1
 
-        new_stats, new_members = message.extract_labels(stat_labels, members)
+        new_stats, new_members, flags = message.extract_labels(classifier)
         for label in new_stats:
             self.stat_labels.add(label)
 
@@ -342,8 +594,7 @@ class Thread(object):
 
         self.non_ping = len(self.stat_labels) > 0
 
-        self._evaluate(message)
-        self.messages.append(message)
+        self._evaluate(message, flags, decisions)
 
     def dont_count(self):
         self.good_thread = False
@@ -411,10 +662,194 @@ class Thread(object):
     def is_check_in(self):
         return self.check_in_date is not None
 
+    def get_flags(self):
+        """
+        :return: int the boolean attributes of the thread packed using the Thread bit constants (i.e. Thread.GOOD)
+        """
+        return self._flags
+
     def __str__(self):
         return "Thread ID: " + self.id + ", Subject: " + self.subject() + ", Count: " + str(self.message_count)
 
 
+class Decisions(object):
+    """
+    Answers to "Should the following message be counted?" so a thread is only asked about once. Threads without a
+    recorded answer are checked against the answer rules before the user is asked.
+
+    Attributes:
+        filename : str
+            File answers are read from and written to. None if answers are not saved.
+        answers : dict
+            {thread_id: boolean} True if the thread should count
+        rules : lst
+            (field, phrase, count) rules. See config.DECISION_RULES
+        defer : boolean
+            True if threads without an answer should be added to pending instead of asking the user
+        pending : dict
+            {thread_id: (message_type, description)} threads waiting for an answer
+    """
+    FIELDS = {'from': Message.get_from_address, 'to': Message.get_to, 'subject': Message.get_subject}
+
+    def __init__(self, filename=None, rules=None, defer=False):
+        """
+        :param filename: File answers are written to (default = None: answers are not saved)
+        :param rules: (field, phrase, count) rules (default = None: config.DECISION_RULES)
+        :param defer: True if threads without an answer should wait for a review (default = False)
+        """
+        if rules is None:
+            rules = config.DECISION_RULES
+        for field, phrase, count in rules:
+            if field != 'label' and field not in Decisions.FIELDS:
+                raise ValueError("Unknown decision rule field: " + str(field))
+        self.filename = filename
+        self.answers = {}
+        self.rules = list(rules)
+        self.defer = defer
+        self.pending = {}
+        self._changed = False
+
+    def get(self, thread_id, message):
+        """
+        :param thread_id: GMail thread id
+        :param message: Message the user would be asked about
+        :return: True if the thread should count, False if it should not or None if the user must be asked.
+        """
+        try:
+            return self.answers[thread_id]
+        except KeyError:
+            pass
+        for field, phrase, count in self.rules:
+            if field == 'label':
+                if any(phrase in label for label in message.get_labels()):
+                    return count
+            elif phrase in Decisions.FIELDS[field](message):
+                return count
+        return None
+
+    def record(self, thread_id, count):
+        """
+        Records the user's answer for a thread.
+        :param thread_id: GMail thread id
+        :param count: True if the thread should count
+        :return: None
+        """
+        if self.answers.get(thread_id) != count:
+            self.answers[thread_id] = count
+            self._changed = True
+
+    def postpone(self, thread_id, message, message_type):
+        """
+        Adds a thread to pending so the user can be asked about it later.
+        :param thread_id: GMail thread id
+        :param message: Message the user would be asked about
+        :param message_type: str 'Support' | 'Internal'
+        :return: None
+        """
+        if thread_id not in self.pending:
+            self.pending[thread_id] = (message_type, message.describe())
+
+    def review(self, threads):
+        """
+        Asks the user about every pending thread and records the answers. Threads the user does not want counted are
+        marked with Thread.dont_count.
+        :param threads: {thread_id: Thread} threads the pending threads belong to
+        :return: None
+        """
+        if len(self.pending) == 0:
+            return
+        with util.PROMPT_LOCK:
+            print "\n" + str(len(self.pending)) + " threads need to be reviewed."
+            for thread_id in sorted(self.pending):
+                message_type, description = self.pending[thread_id]
+                count = ask_to_count(message_type, description)
+                self.record(thread_id, count)
+                if not count and thread_id in threads:
+                    threads[thread_id].dont_count()
+        self.pending = {}
+
+    def write_pending(self, filename):
+        """
+        Writes the pending threads to filename so they can be answered without running stats. Each line has the format
+            THREAD_ID ? | MESSAGE_TYPE | DESCRIPTION
+        :param filename: destination file
+        :raise IOError: If filename cannot be written to.
+        :return: None
+        """
+        with open(filename, 'w') as out:
+            out.write("# Replace ? with Y if the thread should count or N if it should not. Then re-run stats.\n")
+            for thread_id in sorted(self.pending):
+                message_type, description = self.pending[thread_id]
+                out.write(thread_id + " ? | " + message_type + " | " + description.replace('\n', ' | ') + '\n')
+
+    def read_pending(self, filename):
+        """
+        Records the answers given in a file written by write_pending. Threads still marked ? are ignored.
+        :param filename: File written by write_pending
+        :return: int number of answers recorded. 0 if the file does not exist.
+        :raise: IOError if the file is not formatted properly
+        """
+        try:
+            file_in = open(filename, 'r')
+        except IOError:
+            return 0
+        answered = 0
+        with file_in:
+            for line in file_in:
+                if line.startswith('#') or line.strip() == '':
+                    continue
+                fields = line.split(' | ')[0].split()
+                if len(fields) != 2 or fields[1].upper() not in ('Y', 'N', '?'):
+                    raise IOError("Error: " + filename + " not properly formatted.")
+                if fields[1] != '?':
+                    self.record(fields[0], fields[1].upper() == 'Y')
+                    answered += 1
+        return answered
+
+    @staticmethod
+    def from_file(filename, rules=None, defer=False):
+        """
+        Reads the answers recorded in filename. Each line has the format
+            THREAD_ID Y|N
+        A missing file is treated as a file without answers.
+        :param filename: File answers are read from and written to.
+        :param rules: (field, phrase, count) rules (default = None: config.DECISION_RULES)
+        :param defer: True if threads without an answer should wait for a review (default = False)
+        :return: Decisions
+        :raise: IOError if the file is not formatted properly
+        """
+        decisions = Decisions(filename, rules, defer)
+        try:
+            file_in = open(filename, 'r')
+        except IOError:
+            return decisions
+        with file_in:
+            for line in file_in:
+                fields = line.split()
+                if len(fields) == 0:
+                    continue
+                if len(fields) != 2 or fields[1] not in ('Y', 'N'):
+                    raise IOError("Error: " + filename + " not properly formatted.")
+                decisions.answers[fields[0]] = fields[1] == 'Y'
+        return decisions
+
+    def write_to_file(self):
+        """
+        Writes the recorded answers to self.filename if any answers were recorded since the file was read.
+        :return: None
+        """
+        if self.filename is None or not self._changed:
+            return
+        try:
+            with open(self.filename, 'w') as out:
+                for thread_id in sorted(self.answers):
+                    out.write(thread_id + (' Y\n' if self.answers[thread_id] else ' N\n'))
+            self._changed = False
+        except IOError, e:
+            print e
+            print 'Could not open ' + self.filename + ' for writing.'
+
+
 class OpenInquiry:
     """
     An open thread in the Support Inbox.
@@ -530,11 +965,13 @@ class OpenInquiry:
         return inbox
 
     @staticmethod
-    def from_current_inbox(inbox, stat_labels):
+    def from_current_inbox(inbox, classifier, cutoff, decisions=None):
         """
         Builds a dictionary of open inquiries from a list of GMail messages.
-        :param stat_labels: collection stat labels to look for
         :param inbox: A list of GMail messages. Not a list of mail.Message types.
+        :param classifier: LabelClassifier for the stat labels to look for
+        :param cutoff: earliest date for which a thread should count
+        :param decisions: Decisions consulted before the user is asked if a thread should count (default = None)
         :return: {Thread ID: OpenInquiry} for currently open and good threads.
         """
         threads = {}
@@ -543,20 +980,19 @@ class OpenInquiry:
             thread_id = message.get_thread_id()
             if thread_id in threads:
                 if threads[thread_id].is_good():
-                    threads[thread_id].add_message(message, stat_labels)
+                    threads[thread_id].add_message(message, classifier, cutoff, decisions)
             else:
-                threads[thread_id] = Thread(message, stat_labels)
+                threads[thread_id] = Thread(message, classifier, cutoff, decisions)
 
             if not threads[thread_id].checked:
                 if message.is_to_from_support():
-                    threads[thread_id].should_it_count(message, 'to and from Support', True)
+                    threads[thread_id].should_it_count(message, 'to and from Support', True, decisions)
                 elif is_internal(message.get_from_address()) or \
                         (message.is_from_support() and is_internal(message.get_to())):
-                    threads[thread_id].should_it_count(message, 'internal', True)
+                    threads[thread_id].should_it_count(message, 'internal', True, decisions)
 
-            for l in config.OPEN_LABELS:
-                if any(l in label for label in message.get_labels()):
-                    threads[thread_id].closed = False
+            if classifier.classify(message.get_labels())[2] & LabelClassifier.OPEN:
+                threads[thread_id].closed = False
 
         open_inquiries = {}
         for thread in threads:
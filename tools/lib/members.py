@@ -2,6 +2,16 @@ from googleAPI import get_range
 import util
 
 
+def _date_cell(serial):
+    """
+    :param serial: serial date or None
+    :return: (value, type) cell for the serial date or an empty cell if serial is None.
+    """
+    if serial is None:
+        return "", 'STRING'
+    return serial, 'DATE'
+
+
 class Member(object):
     """
     A Member allows for the tracking tracking member specific statistics, check in date and last contact date.
@@ -51,14 +61,15 @@ class Member(object):
     def get_stats(self):
         return self.stats
 
-    def increment_stat(self, index):
+    def increment_stat(self, index, i=1):
         """
-        Increments members.stats[index] by one
+        Increments members.stats[index] by i
         :param index: index of the stat to be updated.
+        :param i: (default=1)
         :return: None
         """
         try:
-            self.stats[index] += 1
+            self.stats[index] += i
         except IndexError:
             util.print_error('Error: IndexError during counting for ' + self.name + ': ' + str(index))
             util.print_error(self.get_stats())
@@ -72,22 +83,29 @@ class Member(object):
         :param mem: str Member for which stat row would be created.
         :return: lst: a list with the response format listed above
         """
-        if mem.last_contact is None:
-            last_contact = ("", 'STRING')
-        else:
-            last_contact = (util.serial_date(mem.last_contact), 'DATE')
+        return Member.create_stat_rows([mem])[0]
 
-        if mem.check_in is None:
-            check_in = ("", 'STRING')
-        else:
-            check_in = (util.serial_date(mem.check_in), 'DATE')
-
-        result = [(mem.name, 'STRING'), last_contact, check_in]
+    @staticmethod
+    def create_stat_rows(mems):
+        """
+        Creates a row for each member which can be written to the Member Stats tab on the Retention sheet. Dates for
+        every member are converted in a single pass.
+        Response format = [name, last_contact, check_in, stats]
+        :param mems: lst(Member) Members for which stat rows would be created.
+        :return: lst: a list of rows with the response format listed above in the order of mems
+        """
+        # The time of day is kept so the sheet records when the member was last contacted, not only the day.
+        last_contacts = util.serial_dates([mem.last_contact for mem in mems], fractional=True)
+        check_ins = util.serial_dates([mem.check_in for mem in mems], fractional=True)
 
-        for stat in mem.stats:
-            result.append((stat, 'NUMBER'))
+        rows = []
+        for mem, last_contact, check_in in zip(mems, last_contacts, check_ins):
+            result = [(mem.name, 'STRING'), _date_cell(last_contact), _date_cell(check_in)]
+            for stat in mem.stats:
+                result.append((stat, 'NUMBER'))
+            rows.append(result)
 
-        return result
+        return rows
 
     @staticmethod
     def read_members(rng, sheet_id, sheet_api, header_index, short_name_range):
@@ -147,7 +165,7 @@ class Admin(object):
     """
     _id = 0
 
-    def __init__(self, name, org, last_contact, check_in, emails):
+    def __init__(self, name, org, last_contact, check_in, emails, admin_id=None):
         """
         Constructs a new admin.
         :param name: str
@@ -155,14 +173,17 @@ class Admin(object):
         :param last_contact: datetime
         :param check_in: datetime
         :param emails: lst(str)
+        :param admin_id: int (default = None: Will be assigned the next available id)
         """
         self.name = name
         self.org = org
         self.emails = emails
         self.check_in = check_in
         self.last_contact = last_contact
-        self.id = Admin._id
-        Admin._id += 1
+        if admin_id is None:
+            admin_id = Admin._id
+            Admin._id += 1
+        self.id = admin_id
 
     @staticmethod
     def read_admins(rng, sheet_id, sheet_api):
@@ -172,13 +193,14 @@ class Admin(object):
         :param sheet_id: Google sheet_id for the sheet to be read
         :param sheet_api: Google sheets API used to read the sheet
         :return: admin dictionary with (k,v) = (id, Admin() object)
+                 Ids are assigned from 0 in sheet order so that each read is independent of Admin._id.
         """
         admins = {}
         admin_emails = {}
 
         data = get_range(rng, sheet_id, sheet_api)
 
-        for admin in data[1:]:
+        for i, admin in enumerate(data[1:]):
             try:
                 emails = [email.lower() for email in admin[6:9]]
                 name = admin[1]
@@ -186,7 +208,7 @@ class Admin(object):
                 check_in = util.parse_date(admin[4])
                 last_contact = util.parse_date(admin[5])
 
-                new = Admin(name, org, last_contact, check_in, emails)
+                new = Admin(name, org, last_contact, check_in, emails, i)
                 admins[new.id] = new
                 for email in emails:
                     admin_emails[email] = new.id
@@ -238,15 +260,18 @@ class Admin(object):
         :param admin: str Admin for which stat row would be created.
         :return: lst: a list with the response format listed above
         """
-        if admin.last_contact is None:
-            last_contact = ("", 'STRING')
-        else:
-            last_contact = (util.serial_date(admin.last_contact), 'DATE')
+        return Admin.create_stat_rows([admin])[0]
 
-        if admin.check_in is None:
-            check_in = ("", 'STRING')
-        else:
-            check_in = (util.serial_date(admin.check_in), 'DATE')
-
-        result = [check_in, last_contact]
-        return result
+    @staticmethod
+    def create_stat_rows(admins):
+        """
+        Creates a row for each admin which can be written to the Support Outreach Admins tab on the Retention sheet.
+        Dates for every admin are converted in a single pass.
+        Response format = [last_contact, check_in]
+        :param admins: lst(Admin) Admins for which stat rows would be created.
+        :return: lst: a list of rows with the response format listed above in the order of admins
+        """
+        last_contacts = util.serial_dates([admin.last_contact for admin in admins], fractional=True)
+        check_ins = util.serial_dates([admin.check_in for admin in admins], fractional=True)
+        return [[_date_cell(check_in), _date_cell(last_contact)]
+                for last_contact, check_in in zip(last_contacts, check_ins)]
@@ -1,5 +1,7 @@
 import csv
 import datetime
+import pickle
+from array import array
 
 from googleapiclient.errors import HttpError
 import googleAPI
@@ -7,6 +9,10 @@ import mail
 from tools import config
 import util
 from email.mime.text import MIMEText
+try:
+    import numpy
+except ImportError:
+    numpy = None  # Only needed by the columnar counting engine
 
 
 class Stat:
@@ -140,41 +146,204 @@ def get_retention_calls(sheets_api, retention_spreadsheet_id):
         return str(retention_calls[0][0])
     except HttpError:
         util.print_error("Error: Failed to read number of check in calls.")
-        retention_calls = raw_input(
-            "Enter the number of check in calls this week (cell B2 on Chart Data tab of Retention sheet).   ")
+        retention_calls = util.prompt(
+            "Enter the number of check in calls this week (cell B2 on Chart Data tab of Retention sheet).   ", "")
+        if config.BATCH:
+            util.print_error("Warning: Check in calls were left blank. Enter them on the Weekly Stats sheet.")
         return retention_calls
 
 
 def _enter_calls():
     """
-    Asks the user to enter the number of Support Calls
+    Asks the user to enter the number of Support Calls. In batch mode every value is left blank and a warning is
+    recorded.
     :return: number of sessions, sales calls, sales demos, demo institutions
     """
-    sessions = raw_input("\n\nEnter the Total # of Sessions...  ")
-    sales_calls = raw_input("Enter the Total # of Sales Calls...  ")
-    sales_demos = raw_input("Enter the Total # of Sales Demos...  ")
-    demo_institutions = raw_input("Enter Sales Demo institutions...  ")
+    with util.PROMPT_LOCK:
+        sessions = util.prompt("\n\nEnter the Total # of Sessions...  ", "")
+        sales_calls = util.prompt("Enter the Total # of Sales Calls...  ", "")
+        sales_demos = util.prompt("Enter the Total # of Sales Demos...  ", "")
+        demo_institutions = util.prompt("Enter Sales Demo institutions...  ", "")
+    if config.BATCH:
+        util.print_error("Warning: Sessions, Sales Calls, Sales Demos and Sales Demo institutions were left blank. "
+                         "Enter them on the Weekly Stats sheet.")
     return sessions, sales_calls, sales_demos, demo_institutions
 
 
-def _sort_stats(stats, dictionary):
+def _priority_order(dictionary):
     """
-    Sorts a list of stats by assigned priority from lo to hi.
-    :param stats: List of stat labels to be sorted.
+    Orders the stats of a dictionary by priority from lo to hi. Stats with equal priorities keep their dictionary
+    order.
     :param dictionary: Dictionary mapping stat to Stat object.
-    :return: A list of sorted statistics from lo to hi using on stat priority in dictionary.
+    :return: A list of the stat labels in dictionary sorted by priority from lo to hi.
     """
-    i = 1
-    while i < len(stats):
-        j = i
-        while j > 0 and dictionary[stats[j-1]].get_priority() > dictionary[stats[j]].get_priority():
-            swap = stats[j-1]
-            stats[j-1] = stats[j]
-            stats[j] = swap
-            j = j - 1
-        i = i + 1
+    return sorted(dictionary, key=lambda stat: dictionary[stat].get_priority())
 
-    return stats
+
+def count_value(count, default=0.0):
+    """
+    :param count: stat count
+    :param default: value of counts which are not numbers i.e. blank calls (default = 0.0)
+    :return: numeric value of count. Combined counts such as 'Sales Pings' = '3(1)' use their first number.
+    """
+    if isinstance(count, basestring):
+        if "(" in count:
+            count = count[:count.find("(")]
+        try:
+            return float(count)
+        except ValueError:
+            return default
+    return count
+
+
+class RollingWeeks(object):
+    """
+    Weekly counts of each stat for the most recent weeks. Each stat's counts are kept in a fixed size ring buffer along
+    with their running sum so adding a week and averaging over every week held take constant time per stat. Weeks are
+    slotted by their calendar week number (weeks start on Sunday) so weeks without a run are held as weeks of 0 counts.
+
+    Attributes:
+        filename: str
+            File the weeks are read from and written to.
+        weeks: int
+            Number of weeks held before the oldest week is dropped.
+        starts: array
+            Ordinal of the first day of the week held in each slot. 0 if the slot has never held a week.
+        counts: dict
+            (key, value) = ((stat dictionary name, stat), array of the stat's count in each slot)
+        sums: dict
+            (key, value) = ((stat dictionary name, stat), sum of the stat's counts)
+        position: int
+            Slot of the most recent week. -1 if no weeks are held.
+        size: int
+            Number of calendar weeks held, counting skipped weeks, up to weeks.
+    """
+    WEEKS = 52
+
+    def __init__(self, filename=None, weeks=WEEKS):
+        """
+        Creates RollingWeeks without any weeks.
+        :param filename: File the weeks are written to. (default = None)
+        :param weeks: Number of weeks held. (default = WEEKS)
+        """
+        self.filename = filename
+        self.weeks = weeks
+        self.starts = array('l', [0] * weeks)
+        self.counts = {}
+        self.sums = {}
+        self.position = -1
+        self.size = 0
+
+    def add(self, start_date, counts):
+        """
+        Records the counts of the week starting on start_date. Adding a week in the most recent week again replaces its
+        counts so stats for a week can be re-run. Weeks skipped since the most recent week are held with 0 counts.
+        Weeks older than the most recent week are ignored.
+        :param start_date: datetime first day of the week
+        :param counts: {(stat dictionary name, stat): count} Stats without a count are recorded as 0.
+        :return: True if the counts were recorded
+        """
+        start = start_date.toordinal()
+        week = _week_number(start)
+        if self.size == 0:
+            self.size = 1
+        else:
+            last_week = _week_number(self.starts[self.position])
+            if week < last_week:
+                return False
+            skipped = week - last_week
+            # Clears the slots from the week after the most recent week up to this week. Every slot is cleared once
+            # more weeks were skipped than are held.
+            for i in range(max(1, skipped - self.weeks + 1), skipped + 1):
+                slot = (last_week + i) % self.weeks
+                self.starts[slot] = start - 7 * (skipped - i)
+                for key, column in self.counts.iteritems():
+                    self.sums[key] -= column[slot]
+                    column[slot] = 0.0
+            self.size = min(self.size + skipped, self.weeks)
+        self.position = week % self.weeks
+        self.starts[self.position] = start
+
+        for key in set(self.counts) | set(counts):
+            if key not in self.counts:
+                self.counts[key] = array('d', [0.0] * self.weeks)
+                self.sums[key] = 0.0
+            column = self.counts[key]
+            value = float(counts.get(key, 0))
+            self.sums[key] += value - column[self.position]
+            column[self.position] = value
+        return True
+
+    def total(self, key, weeks=None):
+        """
+        :param key: (stat dictionary name, stat)
+        :param weeks: Number of most recent weeks summed. (default = None: every week held)
+        :return: float sum of the stat's counts over the weeks
+        """
+        if key not in self.counts:
+            return 0.0
+        if weeks is None or weeks >= self.size:
+            return self.sums[key]
+        column = self.counts[key]
+        return sum(column[(self.position - i) % self.weeks] for i in range(weeks))
+
+    def average(self, key, weeks=None):
+        """
+        :param key: (stat dictionary name, stat)
+        :param weeks: Number of most recent weeks averaged. (default = None: every week held)
+        :return: float average weekly count of the stat or None if no weeks are held
+        """
+        if weeks is None or weeks > self.size:
+            weeks = self.size
+        if weeks == 0:
+            return None
+        return self.total(key, weeks) / weeks
+
+    def write_to_file(self):
+        with open(self.filename, 'wb') as out:
+            pickle.dump((self.starts, self.counts, self.position, self.size), out, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def from_file(filename, weeks=WEEKS):
+        """
+        Reads the weeks written to filename. A missing file is treated as a file without weeks.
+        :param filename: File weeks are read from and written to.
+        :param weeks: Number of weeks held. (default = WEEKS)
+        :return: RollingWeeks
+        :raise: IOError if the file is not formatted properly
+        """
+        rolling = RollingWeeks(filename, weeks)
+        try:
+            file_in = open(filename, 'rb')
+        except IOError:
+            return rolling
+        with file_in:
+            try:
+                starts, counts, position, size = pickle.load(file_in)
+            except (EOFError, KeyError, IndexError, ValueError, TypeError, pickle.UnpicklingError):
+                raise IOError("Error: " + filename + " not properly formatted.")
+        if len(starts) != weeks or any(len(column) != weeks for column in counts.values()):
+            raise IOError("Error: " + filename + " does not hold " + str(weeks) + " weeks.")
+
+        if all(start == 0 or _week_number(start) % weeks == slot for slot, start in enumerate(starts)):
+            rolling.starts, rolling.counts, rolling.position, rolling.size = starts, counts, position, size
+            rolling.sums = dict((key, sum(column)) for key, column in counts.iteritems())
+            return rolling
+
+        # Files written before weeks were slotted by week number hold one week per run. Re-adding their weeks oldest
+        # first moves each week to its slot.
+        for slot in sorted((slot for slot in range(weeks) if starts[slot] != 0), key=lambda slot: starts[slot]):
+            week_counts = dict((key, column[slot]) for key, column in counts.iteritems())
+            rolling.add(datetime.date.fromordinal(starts[slot]), week_counts)
+        return rolling
+
+
+def _week_number(ordinal):
+    """
+    :param ordinal: date ordinal
+    :return: int number of the calendar week, starting on Sunday, holding the date
+    """
+    return ordinal // 7
 
 
 def _write_stat_row(writer, thread, stat):
@@ -190,14 +359,17 @@ def _write_stat_row(writer, thread, stat):
                     stat, thread.is_closed()])
 
 
-def add_stats(dictionary):
+def add_stats(dictionary, order=None):
     """
     Creates a list of stat counts sorted by the respective stat priority for the given stat dictionary.
     :param dictionary: {name : Stat} dictionary whose stats will be sorted.
+    :param order: stat labels of dictionary already sorted by priority. (default = None: dictionary will be sorted)
     :return: A list of stat counts sorted by stat priority lo -> hi
     """
+    if order is None:
+        order = _priority_order(dictionary)
     values = []
-    for item in _sort_stats(dictionary.keys(), dictionary):
+    for item in order:
         if type(dictionary[item].get_count()) is str:
             values.append(((dictionary[item].get_count()), 'STRING'))
         else:
@@ -209,17 +381,19 @@ def add_stats(dictionary):
 def extract_labels(data):
     """
     Creates a new Stat object for each item in data and adds it to the STAT_LABELS dictionary.
+    Priorities are assigned from 0 in the order of data so that each StatCounter is independent of Stat._id.
     :param data: List of stats.
     :return: {stat: Stat(stat)}
     """
-    result = {}
-    for stat in data:
-        result[stat] = Stat(stat)
-
-    return result
+    return from_list(data)
 
 
 class StatCounter:
+    # Stat dictionaries of a StatCounter in the order they are written to the Weekly Stats sheet.
+    DICTIONARIES = ['stat_labels', 'ping_stats', 'total_stats', 'call_stats', 'vm_stats']
+    # Stat dictionaries recorded by record_week. Calls are entered by hand and are not inquiries.
+    WEEKLY_DICTIONARIES = ['stat_labels', 'ping_stats', 'total_stats', 'vm_stats']
+
     def __init__(self, labels):
         self.ping_stats = from_list(PINGS)
         self.total_stats = from_list(TOTALS)
@@ -227,13 +401,25 @@ class StatCounter:
         self.vm_stats = from_list(VOICEMAILS)
 
         self.stat_labels = extract_labels(labels)
+        self.resolve_order()
+        self.weeks = None  # RollingWeeks this week's counts were recorded in
 
     def set_labels(self, stats_labels):
         self.stat_labels = extract_labels(stats_labels)
+        self.resolve_order()
         print "\nThe following Statistics will be determined..."
         for stat in sorted(self.stat_labels):
             print stat
 
+    def resolve_order(self):
+        """
+        Caches the priority order of every stat dictionary and the rank of each stat label so stats are not sorted
+        again for every thread. Must be called whenever stats are added, removed or given a new priority.
+        :return: None
+        """
+        self.orders = dict((name, _priority_order(getattr(self, name))) for name in StatCounter.DICTIONARIES)
+        self.ranks = dict((label, rank) for rank, label in enumerate(self.orders['stat_labels']))
+
     def count_user_inquiry(self, i=1):
         try:
             self.ping_stats["User Inquiries"].increment(i)
@@ -395,10 +581,28 @@ class StatCounter:
         self.total_stats["Overall Total New Inquiries"].set_count(total_pings + total_non_pings)
         self.calc_total_closed()
         self.total_stats["Total Open Inquiries"].increment(self.total_stats['New Open Inquiries'].get_count())
+        self.resolve_order()
 
     def count_stats(self, threads, members, file_base):
         """
         Counts the number of statistics and updates the STAT_LABELS, PING_STATS, TOTAL_STATS dictionaries.
+        Stats are counted by the engine selected by config.ENGINE. The loop engine is always used if config.DEBUG is
+        set as only it writes the thread lookup log.
+        :param threads: Threads for which stats will be determined.
+        :param members: Members whos stats will be updated.
+        :param file_base: preface any generated log files
+        :return: Dictionary of new open inquiries.
+        """
+        if config.ENGINE == 'columnar' and not config.DEBUG:
+            if numpy is not None:
+                return self._count_stats_columnar(threads, members)
+            util.print_error("Error: numpy not found. Stats will be counted with the loop engine. "
+                             "Install numpy by typing 'pip install numpy' to use the columnar engine.")
+        return self._count_stats_loop(threads, members, file_base)
+
+    def _count_stats_loop(self, threads, members, file_base):
+        """
+        Counts stats one thread at a time. See count_stats.
         :param threads: Threads for which stats will be determined.
         :param members: Members whos stats will be updated.
         :param file_base: preface any generated log files
@@ -420,6 +624,7 @@ class StatCounter:
                 util.print_error('Error. Could not open ' + base + 'thread_lookup. Results will not be logged.')
 
         open_inquiries = {}
+        ranks = self.ranks
         for thread in threads:
             trd = threads[thread]
             if trd.is_good():
@@ -474,9 +679,9 @@ class StatCounter:
                         _write_stat_row(writer, trd, "New Org")
 
                 # Handle Non-pings, Count lowest priority stat only
-                sorted_stats = _sort_stats(trd.get_stats(), self.stat_labels)
-                if len(sorted_stats) > 0:
-                    counted_stat = sorted_stats[0]
+                thread_stats = trd.get_stats()
+                if len(thread_stats) > 0:
+                    counted_stat = min(thread_stats, key=ranks.__getitem__)
                     self.stat_labels[counted_stat].increment()
                     # Sales inquiries are considered Pings
                     if counted_stat not in ["Sales"]:
@@ -489,7 +694,7 @@ class StatCounter:
                         _write_stat_row(writer, trd, counted_stat)
 
                     for mem in trd.get_members():
-                        for stat in sorted_stats:
+                        for stat in thread_stats:
                             members[mem].increment_stat(self.stat_labels[stat].get_priority())
                 else:
                     # TODO Error Log
@@ -499,6 +704,92 @@ class StatCounter:
             out.close()
         return open_inquiries
 
+    def _count_stats_columnar(self, threads, members):
+        """
+        Counts stats from columns built with numpy. The threads are read once to build a column of thread flags,
+        message counts and lowest stat priorities along with (member, stat) pairs. Every count is then taken from the
+        columns at once. Counts are identical to _count_stats_loop. See count_stats.
+        :param threads: Threads for which stats will be determined.
+        :param members: Members whos stats will be updated.
+        :return: Dictionary of new open inquiries.
+        """
+        trds = [trd for trd in threads.itervalues() if trd.is_good()]
+        priorities = dict((label, stat.get_priority()) for label, stat in self.stat_labels.iteritems())
+        stat_count = max(priorities.values()) + 1 if priorities else 0
+        member_names = sorted(members.keys())
+        member_index = dict((name, i) for i, name in enumerate(member_names))
+
+        # The lowest priority of each thread starts past the last stat so threads without stats are easily found.
+        lowest = [stat_count] * len(trds)
+        member_pairs = []  # member index * stat_count + stat priority for every member and stat of each thread
+        for i, trd in enumerate(trds):
+            thread_priorities = [priorities[label] for label in trd.get_stats()]
+            if thread_priorities:
+                lowest[i] = min(thread_priorities)
+                for mem in trd.get_members():
+                    offset = member_index[mem] * stat_count
+                    member_pairs.extend([offset + priority for priority in thread_priorities])
+
+        flags = numpy.fromiter((trd.get_flags() for trd in trds), numpy.int64, len(trds))
+        message_counts = numpy.fromiter((trd.get_count() for trd in trds), numpy.int64, len(trds))
+        lowest = numpy.array(lowest, numpy.int64)
+
+        def flagged(bit):
+            return flags & bit != 0
+
+        def total(column):
+            return int(numpy.count_nonzero(column))
+
+        # Voicemails
+        admin_vm = flagged(mail.Thread.ADMIN_VM)
+        res_vm = flagged(mail.Thread.RES_VM) & ~admin_vm
+        finance_vm = flagged(mail.Thread.FINANCE_VM) & ~admin_vm & ~res_vm
+        sales_vm = flagged(mail.Thread.SALES_VM) & ~admin_vm & ~res_vm & ~finance_vm
+        self.count_admin_vm(total(admin_vm))
+        self.count_res_vm(int(message_counts[res_vm].sum()))
+        self.count_finance_vm(total(finance_vm))
+        self.count_sales_vm(total(sales_vm))
+
+        # Pings
+        sales_ping = flagged(mail.Thread.SALES_PING)
+        inquiry = flagged(mail.Thread.INQUIRY)
+        demo = flagged(mail.Thread.DEMO) & ~inquiry
+        support_ping = flagged(mail.Thread.SUPPORT_PING) & ~inquiry & ~demo
+        other = ~inquiry & ~demo & ~support_ping
+        web_form = total((inquiry | demo) & sales_ping)
+        self.count_web_form(web_form)
+        self.count_sales_ping(web_form + total(other & sales_ping))
+        self.count_user_inquiry(total(inquiry & ~sales_ping))
+        self.count_demo(total(demo & ~sales_ping))
+        self.count_support_ping(total(support_ping))
+        self.count_new_org(total(other & ~sales_ping & flagged(mail.Thread.NEW_ORG)))
+
+        # Non-pings, only the lowest priority stat is counted
+        has_stat = lowest < stat_count
+        stat_totals = numpy.bincount(lowest[has_stat], minlength=stat_count)
+        for label, priority in priorities.iteritems():
+            self.stat_labels[label].increment(int(stat_totals[priority]))
+
+        # Sales inquiries are considered Pings
+        inquiries = has_stat & (lowest != priorities.get("Sales", -1))
+        closed = flagged(mail.Thread.CLOSED)
+        self.count_new_closed(total(inquiries & closed))
+        new_open = numpy.flatnonzero(inquiries & ~closed)
+        self.count_new_open(len(new_open))
+        open_inquiries = {}
+        for i in new_open:
+            trd = trds[i]
+            open_inquiries[trd.get_id()] = mail.OpenInquiry(trd.get_id(), trd.get_subject())
+
+        if member_pairs:
+            member_totals = numpy.bincount(numpy.array(member_pairs, numpy.int64),
+                                           minlength=len(member_names) * stat_count)
+            member_totals = member_totals.reshape(len(member_names), stat_count)
+            for i, priority in zip(*numpy.nonzero(member_totals)):
+                members[member_names[i]].increment_stat(int(priority), int(member_totals[i, priority]))
+
+        return open_inquiries
+
     def get_support_calls(self, sheets_api):
         """
         Attempts to obtain the number of support calls from the Enrollment Dashboard. Updates the CALL_STATS with
@@ -536,7 +827,7 @@ class StatCounter:
         :param retention_calls: number of retention calls
         :return: email text in MIMEText format
         """
-        initials = raw_input("Enter your initials...  ")
+        initials = config.INITIALS or util.prompt("Enter your initials...  ")
 
         end = end_date.strftime('%m/%d/%Y')
         end_weekday = end_date.strftime('%a')
@@ -581,7 +872,36 @@ class StatCounter:
 
         return MIMEText(txt)
 
-    def update_weekly_support_stats(self, service, spreadsheet_id, sheet_id=0):
+    def _weekly_column(self, first, cells):
+        """
+        Lays out a column of the Weekly Stats sheet. See update_weekly_support_stats.
+        :param first: (value, type) of the first cell
+        :param cells: function returning the (value, type) cells of a stat dictionary in priority order given the
+                      dictionary's name
+        :return: list of (value, type)
+        """
+        values = [first]
+        values.extend(cells('stat_labels'))
+        values.extend([("", 'STRING'), ("", 'STRING')])
+        values.extend(cells('ping_stats'))
+        values.extend([("", 'STRING'), ("", 'STRING')])
+        values.extend(cells('total_stats'))
+        values.append(("", 'STRING'))
+        values.extend(cells('call_stats'))
+        values.append(("", 'STRING'))
+        values.extend(cells('vm_stats'))
+        return values
+
+    def _average_cells(self, name):
+        """
+        :param name: stat dictionary name
+        :return: (value, type) cells of the stats' averages in priority order. Blank for stats which are not recorded.
+        """
+        if name not in StatCounter.WEEKLY_DICTIONARIES:
+            return [("", 'STRING')] * len(self.orders[name])
+        return [(round(self.get_average(name, stat), 1), 'NUMBER') for stat in self.orders[name]]
+
+    def update_weekly_support_stats(self, service, spreadsheet_id, sheet_id=0, date=None):
         """
         Updates the specified sheet with aggregated statistics info by inserting a new column between columns B and C.
         The new column has the format.
@@ -599,25 +919,27 @@ class StatCounter:
 
             VM_STATS
 
+        If the week was recorded (see record_week) and config.WEEKLY_AVERAGE_COLUMN is set the average of each stat is
+        written to that column in the same format.
         :param service: Authorized Google Sheets service to access the Sheets API
         :param spreadsheet_id: Spreadsheet ID for the sheet that will be updated.
         :param sheet_id: Google Sheet ID for the sheet that will be updated.
+        :param date: datetime written at the top of the column (default = None: today)
         :return: None
         """
-
-        values = [(util.serial_date(datetime.datetime.today()), 'DATE')]
-        values.extend(add_stats(self.stat_labels))
-        values.extend([("", 'STRING'), ("", 'STRING')])
-        values.extend(add_stats(self.ping_stats))
-        values.extend([("", 'STRING'), ("", 'STRING')])
-        values.extend(add_stats(self.total_stats))
-        values.append(("", 'STRING'))
-        values.extend(add_stats(self.call_stats))
-        values.append(("", 'STRING'))
-        values.extend(add_stats(self.vm_stats))
-        insert_column_request = googleAPI.insert_column_request(sheet_id, values, 0, len(values), 2, 3)
+        if date is None:
+            date = datetime.datetime.today()
+
+        values = self._weekly_column((util.serial_date(date), 'DATE'),
+                                     lambda name: add_stats(getattr(self, name), self.orders[name]))
+        requests = googleAPI.insert_column_request(sheet_id, values, 0, len(values), 2, 3)
+        if self.weeks is not None and config.WEEKLY_AVERAGE_COLUMN is not None:
+            # Averages replace last week's averages in their own column.
+            averages = self._weekly_column((str(self.weeks.size) + " Wk Avg", 'STRING'), self._average_cells)
+            requests.append(googleAPI.update_request(sheet_id, [[cell] for cell in averages], 0, len(averages),
+                                                     config.WEEKLY_AVERAGE_COLUMN, config.WEEKLY_AVERAGE_COLUMN + 1))
         try:
-            googleAPI.spreadsheet_batch_update(service, spreadsheet_id, insert_column_request)
+            googleAPI.spreadsheet_batch_update(service, spreadsheet_id, requests)
         except HttpError:
             util.print_error("Failed to update Weekly Support Stats. ")
             try:
@@ -642,6 +964,42 @@ class StatCounter:
 
         return total, total_non_pings, pings_less_sales
 
+    def record_week(self, weeks, start_date):
+        """
+        Records this week's counts in weeks so weekly averages can be reported. Must be called after format_stats.
+        :param weeks: RollingWeeks
+        :param start_date: Earliest date for which stats were counted.
+        :return: True if the counts were recorded. See RollingWeeks.add
+        """
+        counts = {}
+        for name in StatCounter.WEEKLY_DICTIONARIES:
+            for stat, value in getattr(self, name).iteritems():
+                counts[(name, stat)] = count_value(value.get_count())
+        total, total_non_pings, pings_less_sales = self.get_totals()
+        counts[('totals', 'Total')] = total
+        counts[('totals', 'Non-Pings')] = total_non_pings
+        counts[('totals', 'Pings less Sales')] = pings_less_sales
+
+        self.weeks = weeks
+        return weeks.add(start_date, counts)
+
+    def get_average(self, name, stat, weeks=None):
+        """
+        :param name: stat dictionary name or 'totals' for the totals returned by get_totals
+        :param stat: stat label
+        :param weeks: Number of most recent weeks averaged. (default = None: every week recorded)
+        :return: float average weekly count of the stat or None if weeks have not been recorded
+        """
+        if self.weeks is None:
+            return None
+        return self.weeks.average((name, stat), weeks)
+
+    def _average_text(self, name, stat, weeks=None):
+        average = self.get_average(name, stat, weeks)
+        if average is None:
+            return "n/a"
+        return "%.1f" % average
+
     @staticmethod
     def draft_html_message(support_counter, gov_counter, start_date, end_date, retention_calls):
         """
@@ -653,7 +1011,7 @@ class StatCounter:
         :param retention_calls: number of retention calls
         :return: the email text
         """
-        initials = raw_input("Enter your initials...  ")
+        initials = config.INITIALS or util.prompt("Enter your initials...  ")
 
         total, total_non_pings, pings_less_sales = support_counter.get_totals()
         gov_total, gov_total_non_pings, gov_pings_less_sales = gov_counter.get_totals()
@@ -695,6 +1053,16 @@ class StatCounter:
             "Institutions"].get_count()
         retention_calls = retention_calls
 
+        # Average new inquiries per week over roughly the last month, quarter and year
+        def averages(counter, stat):
+            return " / ".join(counter._average_text('totals', stat, weeks) for weeks in (4, 13, RollingWeeks.WEEKS))
+        support_pings_averages = averages(support_counter, 'Pings less Sales')
+        gov_pings_averages = averages(gov_counter, 'Pings less Sales')
+        support_non_pings_averages = averages(support_counter, 'Non-Pings')
+        gov_non_pings_averages = averages(gov_counter, 'Non-Pings')
+        support_total_averages = averages(support_counter, 'Total')
+        gov_total_averages = averages(gov_counter, 'Total')
+
         weekly_stats_sheet_id = config.WEEKLY_STATS_SPREADSHEET_ID
         retention_sheet_id = config.RETENTION_SPREADSHEET_ID
 
@@ -802,6 +1170,37 @@ class StatCounter:
                     </tr>
                     </tbody>
             </table>
+
+            <p>
+                Average new inquiries per week over the last 4 / 13 / 52 weeks
+            </p>
+
+                <table width="50%">
+                <thead>
+                    <tr>
+                        <td width="40%"></td>
+                        <td width="30%"><strong>Support</strong></td>
+                        <td width="30%"><strong>Gov Support</strong></td>
+                    </tr>
+                </thead>
+                <tbody>
+                    <tr>
+                        <td>Pings (no Sales Pings):</td>
+                        <td>{support_pings_averages}</td>
+                        <td>{gov_pings_averages}</td>
+                    </tr>
+                    <tr>
+                        <td>Non-Pings:</td>
+                        <td>{support_non_pings_averages}</td>
+                        <td>{gov_non_pings_averages}</td>
+                    </tr>
+                    <tr>
+                        <td>Overall Total New Inquiries:</td>
+                        <td>{support_total_averages}</td>
+                        <td>{gov_total_averages}</td>
+                    </tr>
+                    </tbody>
+            </table>
             
             <p>
                Cumulative Weekly Statistics can be accessed via the following sheet:<br />
@@ -0,0 +1,216 @@
+import calendar
+import json
+import sqlite3
+
+import util
+
+STORE_FILE = 'tools/messages.db'
+SCHEMA_VERSION = 1
+
+
+class MessageStore(object):
+    """
+    Local copy of GMail message metadata keyed by account and message id. Messages are stored in the format returned
+    by googleAPI.get_message and are indexed by thread id and date. The history id of every thread whose messages
+    have all been stored is recorded so unchanged threads never need to be fetched again.
+
+    Attributes:
+        filename: str
+            SQLite database backing the store.
+    """
+
+    def __init__(self, filename=STORE_FILE):
+        """
+        Opens the store, creating the database if it does not exist.
+        :param filename: SQLite database file (default = STORE_FILE)
+        """
+        self.filename = filename
+        # Concurrent pipelines each open their own connection and may briefly wait on each other's writes.
+        self._conn = sqlite3.connect(filename, timeout=30)
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # The store is only a cache. Older layouts are discarded and rebuilt by the next sync.
+            self._conn.execute("DROP TABLE IF EXISTS messages")
+            self._conn.execute("DROP TABLE IF EXISTS threads")
+            self._conn.execute("PRAGMA user_version = " + str(SCHEMA_VERSION))
+
+        self._conn.execute("CREATE TABLE IF NOT EXISTS messages ("
+                           "account TEXT NOT NULL, "
+                           "id TEXT NOT NULL, "
+                           "thread_id TEXT NOT NULL, "
+                           "labels TEXT NOT NULL, "
+                           "to_address TEXT, "
+                           "from_address TEXT, "
+                           "subject TEXT, "
+                           "date TEXT, "
+                           "timestamp INTEGER, "
+                           "PRIMARY KEY (account, id))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_thread ON messages (account, thread_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_date ON messages (account, timestamp)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS threads ("
+                           "account TEXT NOT NULL, "
+                           "id TEXT NOT NULL, "
+                           "history_id TEXT NOT NULL, "
+                           "PRIMARY KEY (account, id))")
+        self._conn.commit()
+
+    @staticmethod
+    def _timestamp(date):
+        """
+        :param date: message Date header
+        :return: int seconds since the epoch or None if date cannot be parsed.
+        """
+        if date is None:
+            return None
+        parsed = util.parse_header_date(date)
+        if parsed is None:
+            return None
+        return calendar.timegm(parsed.utctimetuple())
+
+    @staticmethod
+    def _to_message(row):
+        """
+        Converts a messages row into a message.
+        :param row: (id, thread_id, labels, to_address, from_address, subject, date)
+        :return: message in JSON format containing 'X-GM-MSGID', 'X-GM-THRID', 'X-Gmail-Labels', 'To', 'From',
+                 'Subject', 'Date'
+        """
+        return {'X-GM-MSGID': row[0], 'X-GM-THRID': row[1], 'X-Gmail-Labels': json.loads(row[2]),
+                'To': row[3], 'From': row[4], 'Subject': row[5], 'Date': row[6]}
+
+    def add(self, account, message):
+        """
+        Adds a message to the store, replacing any existing copy.
+        :param account: account the message belongs to (i.e. support, gov_support)
+        :param message: message in the format returned by googleAPI.get_message
+        :return: None
+        """
+        self._conn.execute("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (account, message['X-GM-MSGID'], message['X-GM-THRID'],
+                            json.dumps(message['X-Gmail-Labels']), message['To'], message['From'],
+                            message['Subject'], message['Date'], MessageStore._timestamp(message['Date'])))
+
+    def remove(self, account, msg_id):
+        """
+        Removes a message from the store. Does nothing if the message is not stored.
+        :param account: account the message belongs to
+        :param msg_id: GMail message id
+        :return: None
+        """
+        self._conn.execute("DELETE FROM messages WHERE account = ? AND id = ?", (account, msg_id))
+
+    def get(self, account, msg_id):
+        """
+        :param account: account the message belongs to
+        :param msg_id: GMail message id
+        :return: the stored message or None if the message is not stored.
+        """
+        row = self._conn.execute("SELECT id, thread_id, labels, to_address, from_address, subject, date "
+                                 "FROM messages WHERE account = ? AND id = ?", (account, msg_id)).fetchone()
+        if row is None:
+            return None
+        return MessageStore._to_message(row)
+
+    def update_labels(self, account, msg_id, added=(), removed=()):
+        """
+        Adds and removes labels from a stored message. Does nothing if the message is not stored.
+        :param account: account the message belongs to
+        :param msg_id: GMail message id
+        :param added: label names to add
+        :param removed: label names to remove
+        :return: None
+        """
+        row = self._conn.execute("SELECT labels FROM messages WHERE account = ? AND id = ?",
+                                 (account, msg_id)).fetchone()
+        if row is None:
+            return
+
+        labels = [label for label in json.loads(row[0]) if label not in removed]
+        for label in added:
+            if label not in labels:
+                labels.append(label)
+        self._conn.execute("UPDATE messages SET labels = ? WHERE account = ? AND id = ?",
+                           (json.dumps(labels), account, msg_id))
+
+    def thread_ids(self, account, label=None):
+        """
+        :param account: account to search
+        :param label: if specified only threads containing a message with this label are returned (default = None)
+        :return: set of GMail thread ids stored for the account
+        """
+        thread_ids = set()
+        for thread_id, labels in self._conn.execute("SELECT thread_id, labels FROM messages WHERE account = ?",
+                                                    (account,)):
+            if label is None or label in json.loads(labels):
+                thread_ids.add(thread_id)
+        return thread_ids
+
+    def get_thread(self, account, thread_id):
+        """
+        :param account: account the thread belongs to
+        :param thread_id: GMail thread id
+        :return: list of stored messages in the thread ordered by date.
+        """
+        return [MessageStore._to_message(row) for row in self._conn.execute(
+            "SELECT id, thread_id, labels, to_address, from_address, subject, date FROM messages "
+            "WHERE account = ? AND thread_id = ? ORDER BY timestamp, id", (account, thread_id))]
+
+    def put_thread(self, account, thread_id, history_id, messages):
+        """
+        Replaces every stored message in a thread and records the thread as complete at history_id.
+        :param account: account the thread belongs to
+        :param thread_id: GMail thread id
+        :param history_id: thread history id at the time messages were fetched
+        :param messages: every message in the thread in the format returned by googleAPI.get_message
+        :return: None
+        """
+        self._conn.execute("DELETE FROM messages WHERE account = ? AND thread_id = ?", (account, thread_id))
+        for message in messages:
+            self.add(account, message)
+        self._conn.execute("INSERT OR REPLACE INTO threads VALUES (?, ?, ?)", (account, thread_id, str(history_id)))
+
+    def get_thread_history_id(self, account, thread_id):
+        """
+        :param account: account the thread belongs to
+        :param thread_id: GMail thread id
+        :return: history id recorded by put_thread or None if the thread has not been stored in full.
+        """
+        row = self._conn.execute("SELECT history_id FROM threads WHERE account = ? AND id = ?",
+                                 (account, thread_id)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_messages_between(self, account, start, end):
+        """
+        :param account: account to search
+        :param start: datetime earliest message date (inclusive)
+        :param end: datetime latest message date (exclusive)
+        :return: list of stored messages dated within [start, end) ordered by date.
+        """
+        return [MessageStore._to_message(row) for row in self._conn.execute(
+            "SELECT id, thread_id, labels, to_address, from_address, subject, date FROM messages "
+            "WHERE account = ? AND timestamp >= ? AND timestamp < ? ORDER BY timestamp, id",
+            (account, calendar.timegm(start.utctimetuple()), calendar.timegm(end.utctimetuple())))]
+
+    def is_empty(self, account):
+        """
+        :param account: account to check
+        :return: True if no messages are stored for the account.
+        """
+        return self._conn.execute("SELECT 1 FROM messages WHERE account = ? LIMIT 1", (account,)).fetchone() is None
+
+    def clear(self, account):
+        """
+        Removes every message and thread stored for the account.
+        :param account: account to clear
+        :return: None
+        """
+        self._conn.execute("DELETE FROM messages WHERE account = ?", (account,))
+        self._conn.execute("DELETE FROM threads WHERE account = ?", (account,))
+
+    def commit(self):
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
@@ -0,0 +1,238 @@
+from googleapiclient.errors import HttpError
+import googleAPI
+import util
+
+SYNC_QUERY = 'label:Inbox'  # Messages loaded into the store when a full sync is required.
+SYNC_LABEL = 'INBOX'  # Id of the label of the messages kept in the store by sync
+
+
+class HistoryExpiredError(Exception):
+    """
+    Raised when the history id the store was synced to is too old to be used and a full sync is required.
+    """
+    pass
+
+
+def _cache_account(file_base):
+    # Cached threads are kept apart from synced messages so a full sync does not clear them and synced messages are
+    # never mistaken for complete threads.
+    return file_base + 'support_threads'
+
+
+def _history_file(file_base):
+    return 'tools/' + file_base + 'history.txt'
+
+
+def read_history_id(file_base):
+    """
+    Reads the history id recorded by the last sync.
+    :param file_base: preface of the history file. History is stored next to open.txt as file_base + 'history.txt'
+    :return: str history id or None if the account has never been synced.
+    """
+    try:
+        with open(_history_file(file_base), 'r') as f:
+            history_id = f.read().strip()
+    except IOError:
+        return None
+    if history_id == '':
+        return None
+    return history_id
+
+
+def write_history_id(file_base, history_id):
+    """
+    Records the history id the store has been synced to.
+    :param file_base: preface of the history file.
+    :param history_id: str history id
+    :raise IOError: If the history file cannot be written to.
+    :return: None
+    """
+    with open(_history_file(file_base), 'w') as out:
+        out.write(str(history_id) + '\n')
+
+
+def full_sync(service, store, account, user_id='me', query=SYNC_QUERY):
+    """
+    Replaces every stored message for the account with the messages matching query.
+    :param service: Mail API service. Must have read access to user's mail
+    :param store: MessageStore being synced
+    :param account: account name used as the store key (i.e. support, gov_support)
+    :param user_id: default to 'me'
+    :param query: gmail query for messages loaded into the store (default = SYNC_QUERY)
+    :return: str history id the store is now synced to
+    """
+    # Read the history id first so changes made while the messages are listed are picked up by the next sync.
+    history_id = googleAPI.get_history_id(service, user_id)
+    messages = googleAPI.get_messages(service, user_id, query, account)
+
+    store.clear(account)
+    for message in messages:
+        store.add(account, message)
+    store.commit()
+    return history_id
+
+
+def apply_history(service, store, account, start_history_id, user_id='me'):
+    """
+    Applies every added or deleted message and label change made since start_history_id to the store.
+    :param service: Mail API service. Must have read access to user's mail
+    :param store: MessageStore being synced
+    :param account: account name used as the store key (i.e. support, gov_support)
+    :param start_history_id: history id the store was last synced to
+    :param user_id: default to 'me'
+    :return: str history id the store is now synced to
+    :raise HistoryExpiredError: if start_history_id has expired.
+    """
+    try:
+        records, history_id = googleAPI.get_history(service, start_history_id, user_id)
+    except HttpError, e:
+        if e.resp.status != 404:
+            raise e
+        raise HistoryExpiredError('History id ' + str(start_history_id) + ' has expired.')
+    labels = googleAPI.get_labels(service, user_id, account)
+
+    added = []
+    for record in records:
+        for item in record.get('messagesAdded', []):
+            if item['message']['id'] not in added:
+                added.append(item['message']['id'])
+        for item in record.get('messagesDeleted', []):
+            msg_id = item['message']['id']
+            store.remove(account, msg_id)
+            if msg_id in added:
+                added.remove(msg_id)
+        for item in record.get('labelsAdded', []):
+            msg_id = item['message']['id']
+            if store.get(account, msg_id) is None:
+                # Messages moved back to the Inbox are not stored if they left it before the last full sync.
+                if SYNC_LABEL in item['labelIds'] and msg_id not in added:
+                    added.append(msg_id)
+                continue
+            store.update_labels(account, msg_id, added=[labels[l] for l in item['labelIds']])
+        for item in record.get('labelsRemoved', []):
+            store.update_labels(account, item['message']['id'],
+                                removed=[labels[l] for l in item['labelIds']])
+
+    # Added messages are fetched last so they reflect any label changes made after they arrived.
+    fetched = set()
+    for message in googleAPI.get_messages_batch(service, user_id, added, labels):
+        store.add(account, message)
+        fetched.add(message['X-GM-MSGID'])
+    for msg_id in added:
+        if msg_id not in fetched:
+            # Deleted after the history was read. The deletion is applied by the next sync.
+            store.remove(account, msg_id)
+
+    store.commit()
+    return history_id
+
+
+def sync(service, store, file_base, user_id='me'):
+    """
+    Brings the store up to date for the account identified by file_base using the GMail History API. A full sync is
+    performed if the account has never been synced, the store holds no messages for it or the recorded history id has
+    expired.
+    :param service: Mail API service. Must have read access to user's mail
+    :param store: MessageStore being synced
+    :param file_base: '' for support or 'gov_' for gov support.
+    :param user_id: default to 'me'
+    :return: True if changes were applied incrementally, False if a full sync was performed.
+    """
+    account = file_base + 'support'
+    history_id = read_history_id(file_base)
+    incremental = history_id is not None and not store.is_empty(account)
+
+    if incremental:
+        try:
+            history_id = apply_history(service, store, account, history_id, user_id)
+        except HistoryExpiredError:
+            util.print_error('History id ' + history_id + ' for ' + account + ' has expired. Performing full sync.')
+            incremental = False
+
+    if not incremental:
+        history_id = full_sync(service, store, account, user_id)
+
+    try:
+        write_history_id(file_base, history_id)
+    except IOError:
+        util.print_error('Error: Could not write ' + _history_file(file_base) + '. The next sync will be a full sync.')
+
+    return incremental
+
+
+def iter_messages_from_threads(service, store, file_base, query='', user_id='me', workers=1, service_factory=None):
+    """
+    Generates the same messages as googleAPI.iter_messages_from_threads, serving threads from the store where
+    possible. Threads are only fetched from GMail if they have not been stored before or their history id has changed
+    since they were stored. Fetched threads are written to the store.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param store: MessageStore used as a cache
+    :param file_base: '' for support or 'gov_' for gov support.
+    :param query: gmail query used to search for messages.
+    :param user_id: default to 'me'
+    :param workers: number of threads fetched concurrently (default = 1)
+    :param service_factory: function returning a new Mail API service for the same account. (default = None)
+    :return: generator of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
+             Messages are grouped by thread in the order the threads were listed.
+    """
+    threads = googleAPI.list_threads(service, user_id, query)
+    for thread_id, messages in iter_threads(service, store, file_base, threads, user_id, workers, service_factory):
+        for message in messages:
+            yield message
+
+
+def iter_threads(service, store, file_base, threads, user_id='me', workers=1, service_factory=None):
+    """
+    Generates the messages of each listed thread, serving threads from the store where possible. See
+    iter_messages_from_threads.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param store: MessageStore used as a cache
+    :param file_base: '' for support or 'gov_' for gov support.
+    :param threads: threads as listed by googleAPI.list_threads. Each thread must have an 'id' and 'historyId'
+    :param user_id: default to 'me'
+    :param workers: number of threads fetched concurrently (default = 1)
+    :param service_factory: function returning a new Mail API service for the same account. (default = None)
+    :return: generator of (thread id, list of messages) in the order of threads. Threads which could not be
+             retrieved have no messages.
+    """
+    account = _cache_account(file_base)
+    stale = [thread for thread in threads
+             if store.get_thread_history_id(account, thread['id']) != str(thread['historyId'])]
+    print str(len(threads) - len(stale)) + " of " + str(len(threads)) + " threads will be read from the message store"
+
+    fetched = iter([])
+    if len(stale) > 0:
+        labels = googleAPI.get_labels(service, user_id, file_base + 'support')
+        fetched = googleAPI.iter_thread_messages(service, [thread['id'] for thread in stale], labels, user_id,
+                                                 workers, service_factory)
+    stale_ids = set(thread['id'] for thread in stale)
+
+    try:
+        for thread in threads:
+            if thread['id'] in stale_ids:
+                # Stale threads are fetched in listing order so the next fetched thread is always this one.
+                messages = next(fetched)
+                if len(messages) > 0:  # Threads which could not be retrieved are fetched again next time.
+                    store.put_thread(account, thread['id'], thread['historyId'], messages)
+            else:
+                messages = store.get_thread(account, thread['id'])
+            yield thread['id'], messages
+    finally:
+        store.commit()
+
+
+def get_messages_from_threads(service, store, file_base, query='', user_id='me', workers=1, service_factory=None):
+    """
+    Obtains the same messages as googleAPI.get_messages_from_threads, serving threads from the store where possible.
+    See iter_messages_from_threads.
+    :param service: Mail API service used to obtain the messages. Must have read access to user's mail
+    :param store: MessageStore used as a cache
+    :param file_base: '' for support or 'gov_' for gov support.
+    :param query: gmail query used to search for messages.
+    :param user_id: default to 'me'
+    :param workers: number of threads fetched concurrently (default = 1)
+    :param service_factory: function returning a new Mail API service for the same account. (default = None)
+    :return: list of messages. message.keys() = 'X-GM-THRID' , Subject, To, From and 'X-Gmail-Labels'
+             Messages are grouped by thread in the order the threads were listed.
+    """
+    return list(iter_messages_from_threads(service, store, file_base, query, user_id, workers, service_factory))
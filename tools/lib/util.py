@@ -1,9 +1,53 @@
 # Utility
 from dateutil import parser, tz
 from sys import stderr
-from datetime import timedelta
+from datetime import datetime, timedelta
+from email.utils import parsedate_tz
+from collections import deque
 from tools import config
 import argparse
+import threading
+
+# Held while the user is being prompted so prompts from concurrent pipelines are not interleaved.
+PROMPT_LOCK = threading.RLock()
+
+EDT = tz.tzoffset('EDT', -14400)
+SERIAL_EPOCH = datetime(1899, 12, 30, tzinfo=EDT)  # Day 0 of Google Sheets serial dates.
+SECONDS_PER_DAY = 24 * 60 * 60.0
+
+MAX_HEADER_DATES = 100000  # Parsed header dates remembered by parse_header_date.
+_header_dates = {}
+_date_fallbacks = [0]  # Number of header dates parse_header_date could not parse as RFC 2822 dates.
+_date_fallbacks_lock = threading.Lock()
+
+MAX_ERRORS = 1000  # Errors kept for the run report. Older errors are dropped so watching stats does not grow it.
+_errors = deque(maxlen=MAX_ERRORS)  # Most recent errors printed during the run. Included in the batch run report.
+_errors_lock = threading.Lock()
+
+
+class PromptError(Exception):
+    """
+    Raised when stats need an answer from the user while running in batch mode (config.BATCH) and the question has no
+    batch answer.
+    """
+    pass
+
+
+def prompt(message, batch_answer=None):
+    """
+    Asks the user for input. Replaces raw_input so every question follows the batch policy. In batch mode the user is
+    not asked and batch_answer is returned instead.
+    :param message: question printed for the user
+    :param batch_answer: str answer used in batch mode (default = None: the question cannot be answered in batch mode)
+    :return: str the user's answer or batch_answer in batch mode
+    :raise PromptError: if stats are run in batch mode and batch_answer is None
+    """
+    with PROMPT_LOCK:
+        if config.BATCH:
+            if batch_answer is None:
+                raise PromptError("Input needed: " + message.strip())
+            return batch_answer
+        return raw_input(message)
 
 
 def get_cutoff_date(message):
@@ -12,7 +56,7 @@ def get_cutoff_date(message):
     :return: A datetime object for the user entered date.
     """
     try:
-        cutoff = parse_date(raw_input(message))
+        cutoff = parse_date(prompt(message))
         if cutoff is None:
             print "Date not in an accepted format (MM/DD/YYYY)\nPlease try again."
             return get_cutoff_date(message)
@@ -23,6 +67,28 @@ def get_cutoff_date(message):
         return get_cutoff_date(message)
 
 
+def get_run_date(date, message, batch_date=None):
+    """
+    Determines a date stats are run for from the command line, the batch default or the user.
+    :param date: str MM/DD/YYYY date given on the command line or None
+    :param message: question asked if date is None and stats are not run in batch mode
+    :param batch_date: datetime used if date is None in batch mode (default = None: date must be given in batch mode)
+    :return: datetime
+    :raise ValueError: if date is not in an accepted format
+    :raise PromptError: if date and batch_date are None in batch mode
+    """
+    if date is not None:
+        parsed = parse_date(date, fuzzy=False)
+        if parsed is None:
+            raise ValueError("Date not in an accepted format (MM/DD/YYYY): " + date)
+        return parsed
+    if config.BATCH and batch_date is not None:
+        return batch_date
+    if config.BATCH:
+        raise PromptError("Input needed: " + message.strip())
+    return get_cutoff_date(message)
+
+
 def add_days(date, days):
     """
     Adds the specified number of days to date.
@@ -33,7 +99,7 @@ def add_days(date, days):
     return date + timedelta(days=days)
 
 
-def parse_date(date, fuzzy=True, day_first=False, tz_info=tz.tzoffset('EDT', -14400)):
+def parse_date(date, fuzzy=True, day_first=False, tz_info=EDT):
     """
     Parses the provided date and set the time zone to EDT if no time zone is specified.
     :param date: String date
@@ -53,6 +119,47 @@ def parse_date(date, fuzzy=True, day_first=False, tz_info=tz.tzoffset('EDT', -14
         return None
 
 
+def parse_header_date(date, tz_info=EDT):
+    """
+    Parses a message Date header. Headers are parsed as RFC 2822 dates using the email module which is much faster
+    than parse_date. Headers which are not valid RFC 2822 dates fall back to parse_date. Results are remembered so
+    repeated headers are only parsed once.
+    :param date: String date from a message Date header
+    :param tz_info: Time zone used if the header does not specify one. (default = EDT GMT - 4)
+    :return: datetime object representing date or None if date cannot be parsed.
+    """
+    try:
+        return _header_dates[date]
+    except KeyError:
+        pass
+
+    parsed = parsedate_tz(date)
+    try:
+        if parsed is None:
+            raise ValueError(date)
+        if parsed[9] is None:
+            zone = tz_info
+        else:
+            zone = tz.tzoffset(None, parsed[9])
+        ans = datetime(*parsed[:6], tzinfo=zone)
+    except (ValueError, OverflowError):
+        with _date_fallbacks_lock:
+            _date_fallbacks[0] += 1
+        ans = parse_date(date, tz_info=tz_info)
+
+    if len(_header_dates) >= MAX_HEADER_DATES:
+        _header_dates.clear()
+    _header_dates[date] = ans
+    return ans
+
+
+def get_date_fallbacks():
+    """
+    :return: Number of header dates parse_header_date has had to parse using parse_date.
+    """
+    return _date_fallbacks[0]
+
+
 # Return the A1 notation for a given index. _get_a1_column_notation(0) -> A
 def get_a1_column_notation(i):
     """
@@ -70,23 +177,55 @@ def get_a1_column_notation(i):
 
 def print_error(text):
     """
-    Prints to standard error
+    Prints to standard error and records the error for the run report
     :param text: Error message
     :return: None
     """
+    with _errors_lock:
+        _errors.append(str(text))
     print >> stderr.write('\n'+str(text)+'\n')
 
 
-def serial_date(date):
+def get_errors():
+    """
+    :return: list of the last MAX_ERRORS errors printed with print_error
+    """
+    with _errors_lock:
+        return list(_errors)
+
+
+def serial_date(date, fractional=False):
     """
     Converts date to a serial date as days since December 30th, 1899.
-    :param date: datetime date
-    :return: int Days since December 30th, 1899. Does not consider the time of day.
+    :param date: datetime date. Dates without a time zone are treated as EDT.
+    :param fractional: True if the time of day should be kept as a fraction of a day (default = False)
+    :return: int Days since December 30th, 1899 or float days if fractional is True.
     """
-    if date.tzinfo is None:
-        date = date.replace(tzinfo=tz.tzoffset('EDT', -14400))
-    zero = parse_date('12/30/1899')
-    return (date - zero).days
+    return serial_dates([date], fractional)[0]
+
+
+def serial_dates(dates, fractional=False):
+    """
+    Converts a list of dates to serial dates in a single pass. See serial_date.
+    :param dates: list of datetime dates. None values are allowed.
+    :param fractional: True if the time of day should be kept as a fraction of a day (default = False)
+    :return: list of serial dates in the order of dates. None for each None date.
+    """
+    epoch = SERIAL_EPOCH
+    result = []
+    append = result.append
+    for date in dates:
+        if date is None:
+            append(None)
+            continue
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=EDT)
+        delta = date - epoch
+        if fractional:
+            append(delta.days + (delta.seconds + delta.microseconds / 1000000.0) / SECONDS_PER_DAY)
+        else:
+            append(delta.days)
+    return result
 
 
 def is_internal(address, interal_emails):
@@ -131,6 +270,24 @@ def parse():
     config.TEST = args.test
     config.DEBUG = args.debug
     config.GOV = args.gov
+    config.WORKERS = args.workers
+    config.SYNC = args.sync
+    config.CACHE = args.cache
+    config.PARALLEL = args.parallel
+    config.ENGINE = args.engine
+    config.DEFER = args.defer
+    config.BATCH = args.batch
+    config.START = args.start
+    config.END = args.end
+    config.REPORT = args.report
+    config.WATCH = args.watch
+    config.BACKFILL = args.backfill
+    if config.WATCH is not None:
+        # Nobody is around to answer questions while stats are watched
+        config.BATCH = True
+    if config.BATCH and config.DEFER is None and not (config.COUNT_ALL or config.COUNT_NONE):
+        # Questionable threads cannot be asked about in batch mode
+        config.DEFER = 'file'
     # TODO if debug = True check that log directory exists
 
 
@@ -145,6 +302,20 @@ def args_parser():
     -t, --test 			  use test files and sheets not production sheets
     -g, --gov             only calculate government statistics
     -s, --skip            skips thread counting
+    -w, --workers WORKERS number of threads fetched concurrently from GMail
+    --sync                sync the local message store with GMail history and read the Inbox from it
+    --cache               serve threads unchanged since the last run from the local message store
+    -p, --parallel        run the support and gov pipelines at the same time
+    --engine {loop,columnar}
+                          engine used to count stats. columnar requires numpy
+    --defer {review,file}
+                          ask about questionable threads once every thread is read (review) or write them to
+                          tools/<file_base>pending.txt and exit (file)
+    -b, --batch           run without asking for input. Questionable threads are deferred to a file unless -a or -n
+                          is given. A JSON report is printed when stats finish
+    --start START         earliest date (MM/DD/YYYY) stats count. In batch mode defaults to the end of the last run
+    --end END             last date (MM/DD/YYYY) stats count. In batch mode defaults to yesterday
+    --report REPORT       write the JSON run report to REPORT
 
     --auth_host_name AUTH_HOST_NAME
                           Hostname when running a local web server.
@@ -171,6 +342,35 @@ def args_parser():
     arg_parser.add_argument("-t", "--test", action="store_true", help="use test sheets not production sheets")
     arg_parser.add_argument("-d", "--debug", action="store_true", help="write mail and stat counting csv logs")
     arg_parser.add_argument("-g", "--gov", action="store_true", help="only calculate government statistics")
+    arg_parser.add_argument("-w", "--workers", type=int, default=1,
+                            help="number of threads fetched concurrently from GMail")
+    arg_parser.add_argument("--sync", action="store_true",
+                            help="sync the local message store with GMail history and read the Inbox from it")
+    arg_parser.add_argument("--cache", action="store_true",
+                            help="serve threads unchanged since the last run from the local message store")
+    arg_parser.add_argument("-p", "--parallel", action="store_true",
+                            help="run the support and gov pipelines at the same time")
+    arg_parser.add_argument("--engine", choices=['loop', 'columnar'], default='loop',
+                            help="engine used to count stats. columnar requires numpy")
+    arg_parser.add_argument("--defer", choices=['review', 'file'], default=None,
+                            help="ask about questionable threads once every thread is read (review) or write them to "
+                                 "tools/<file_base>pending.txt and exit (file)")
+    arg_parser.add_argument("-b", "--batch", action="store_true",
+                            help="run without asking for input. Questionable threads are deferred to a file unless "
+                                 "-a or -n is given. A JSON report is printed when stats finish")
+    arg_parser.add_argument("--start", default=None,
+                            help="earliest date (MM/DD/YYYY) stats count. In batch mode defaults to the end of the "
+                                 "last run")
+    arg_parser.add_argument("--end", default=None,
+                            help="last date (MM/DD/YYYY) stats count. In batch mode defaults to yesterday")
+    arg_parser.add_argument("--report", default=None, help="write the JSON run report to REPORT")
+    mode = arg_parser.add_mutually_exclusive_group()
+    mode.add_argument("--watch", type=int, default=None, metavar="SECONDS",
+                      help="keep stats up to date by polling the support inboxes every SECONDS until interrupted. "
+                           "Implies --batch. Stats are published once the week ends")
+    mode.add_argument("--backfill", action="store_true",
+                      help="read every thread between --start and --end once and insert a Weekly Stats column for "
+                           "each week. Weeks are counted by -w processes")
 
     return arg_parser
 
@@ -193,6 +393,26 @@ def print_param():
         print "    DEBUG: Will write csv logs for mail and stat counting"
     if config.GOV:
         print "    GOV: Only government stats will be calculated. "
+    if config.WORKERS > 1:
+        print "    WORKERS: " + str(config.WORKERS) + " threads will be fetched concurrently"
+    if config.SYNC:
+        print "    SYNC: The Inbox will be read from the local message store"
+    if config.CACHE:
+        print "    CACHE: Threads unchanged since the last run will be read from the local message store"
+    if config.PARALLEL:
+        print "    PARALLEL: Support and gov stats will be calculated at the same time"
+    if config.ENGINE != 'loop':
+        print "    ENGINE: Stats will be counted with the " + config.ENGINE + " engine"
+    if config.DEFER == 'review':
+        print "    DEFER: Questionable threads will be reviewed once every thread is read"
+    elif config.DEFER == 'file':
+        print "    DEFER: Questionable threads will be written to a file for review and stats will stop"
+    if config.BATCH:
+        print "    BATCH: Stats will run without asking for input"
+    if config.BACKFILL:
+        print "    BACKFILL: A Weekly Stats column will be inserted for every week between the start and end dates"
+    if config.WATCH is not None:
+        print "    WATCH: The support inboxes will be polled every " + str(config.WATCH) + " seconds"
     if config.TEST:
         print "    TEST: Test sheets will be used rather than production sheets"
     else: